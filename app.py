@@ -2,10 +2,8 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from haversine import haversine, Unit
-import io
 import os
-from openpyxl.styles import PatternFill
+import subprocess
 import streamlit_authenticator as stauth
 import bcrypt
 import yaml
@@ -18,26 +16,30 @@ from modules.cps import analisar_cps
 from modules.session import inicializar_sessao
 from modules.data_loader import (
     uploader_agendamentos, uploader_mapeamento, uploader_pagamento, uploader_backlog, uploader_ultimaposicao,
-    uploader_devolucao, uploader_ativos, uploader_cps, uploader_ordens_pendentes, limpar_tudo
+    uploader_devolucao, uploader_ativos, uploader_cps, uploader_ordens_pendentes, limpar_tudo, obter_rt_index, obter_gazetteer,
+    obter_geocodificador_reverso, obter_geocodificador
 )
 from modules.dashboard import exibir_dashboard
 from modules.custos import analisar_custos
 from modules.devolucao import ferramenta_devolucao
 from modules.mapeamento import ferramenta_mapeamento
-from modules.otimizador import otimizador
+from modules.otimizador import otimizador, obter_cache_custos
 from modules.ativos import ferramenta_ativos
 from modules.chat import chat_interface
 from modules.agendadas import exibir_ordens_agendadas
 from modules.distancia import analisar_distancia_percorrida  # Importa a nova função
+from modules.exportacao import df_para_excel, botao_download, registrar_exportador
+from modules.geo import rts_mais_proximos
+from modules.paralelo import BuscaParalela, WORKERS_PADRAO, WORKERS_MAXIMO, MIN_PONTOS_PARALELO
+from modules.carregamento_tardio import perfil_importacao, modulos_importados, MODULOS_TARDIOS
 from modules.utils import (
     executar_analise_segura as executar_analise_pandas_fn,
-    convert_df_to_csv, 
     safe_to_numeric,
     backup_automatico_diario
 )
 
-# Importa a nova função de processamento que criamos
-from modules.processar_relatorio import processar_dataframe_posicao
+# Relatório de posição processado uma vez por conteúdo (compartilhado com o resumo do upload)
+from modules.posicao_processada import obter_posicao_processada
 
 # --- FUNÇÃO PARA ESTILIZAÇÃO CSS ---
 def inject_custom_css():
@@ -80,50 +82,32 @@ def inject_custom_css():
 def to_styled_excel(df: pd.DataFrame) -> bytes:
     """
     Converte um DataFrame para um arquivo Excel (.xlsx) em memória,
-    com formatação e estilo aplicados.
+    com as colunas principais do resultado destacadas em cinza claro.
     """
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        # Arredonda a coluna de distância para 1 casa decimal
-        df_export = df.copy()
-        if 'DISTANCIA_KM' in df_export.columns:
-            df_export['DISTANCIA_KM'] = df_export['DISTANCIA_KM'].round(1)
-        
-        df_export.to_excel(writer, index=False, sheet_name='Resultado')
-        
-        # Pega a worksheet para aplicar o estilo
-        workbook = writer.book
-        worksheet = writer.sheets['Resultado']
-        
-        # Define o preenchimento cinza claro
-        light_gray_fill = PatternFill(start_color="E0E0E0", end_color="E0E0E0", fill_type="solid")
-        
-        # Colunas para colorir
-        cols_to_style = ['RANKING', 'REPRESENTANTE', 'CIDADE_RT', 'DISTANCIA_KM', 'OS']
-        
-        # Itera pelas colunas do DataFrame para encontrar o índice correto
-        for col_name in cols_to_style:
-            if col_name in df_export.columns:
-                # +1 porque as colunas no openpyxl são 1-based
-                col_idx = df_export.columns.get_loc(col_name) + 1
-                for cell in worksheet.iter_cols(min_col=col_idx, max_col=col_idx):
-                    for c in cell:
-                        c.fill = light_gray_fill
+    # Arredonda a coluna de distância para 1 casa decimal
+    df_export = df.copy()
+    if 'DISTANCIA_KM' in df_export.columns:
+        df_export['DISTANCIA_KM'] = df_export['DISTANCIA_KM'].round(1)
+    return df_para_excel(df_export, sheet_name='Resultado',
+                         colunas_destaque=['RANKING', 'REPRESENTANTE', 'CIDADE_RT', 'DISTANCIA_KM', 'OS'])
+
+registrar_exportador('xlsx_backlog', to_styled_excel)
 
-    return output.getvalue()
 
+# O.S. por bloco no processamento em modo contínuo do backlog
+BACKLOG_TAMANHO_BLOCO = 2000
 
-def processar_backlog_df(df_backlog, df_mapeamento, num_rts_proximos=2):
+def processar_backlog_df(df_backlog, df_mapeamento, num_rts_proximos=2, tamanho_bloco=None, ao_concluir_bloco=None, inicio=0, workers=1):
     """
     Processa o DataFrame de backlog para encontrar os N RTs mais próximos para cada O.S.
-    """
-    # --- FILTRO DE REPRESENTANTES ESPECIAIS ---
-    # Identifica a coluna de representante no mapeamento para o filtro
-    rep_col_filtro = next((c for c in df_mapeamento.columns if 'nm_representante' in c.lower()), None)
-    if rep_col_filtro:
-        palavras_excluir = ['STELLANTIS', 'CEABS']
-        df_mapeamento = df_mapeamento[~df_mapeamento[rep_col_filtro].str.contains('|'.join(palavras_excluir), case=False, na=False)].copy()
 
+    Com tamanho_bloco, as O.S. (com coordenadas válidas) são processadas em blocos
+    a partir da posição `inicio`; após cada bloco é chamado
+    ao_concluir_bloco(df_bloco, processadas, total), permitindo exibir progresso e
+    guardar resultados parciais antes do fim do processamento.
+    workers > 1 divide a busca dos RTs entre processos (ver modules.paralelo),
+    com um único pool para todos os blocos.
+    """
     # Lógica aprimorada para encontrar colunas
     os_col_b = next((c for c in df_backlog.columns if c.lower() in ['os', 'numero os', 'ordem de servico', 'ordem', 'ordemservicoid']), None)
     
@@ -160,25 +144,16 @@ def processar_backlog_df(df_backlog, df_mapeamento, num_rts_proximos=2):
             st.error("Não foi possível encontrar colunas de 'Latitude'/'Longitude' nem uma coluna de 'Cidade' no arquivo de backlog.")
             return pd.DataFrame()
 
-        # Preparar o mapeamento para consulta (Cidade -> Coordenadas)
-        map_city_col = next((c for c in df_mapeamento.columns if 'nm_cidade_atendimento' in c.lower()), None)
-        map_lat_col = next((c for c in df_mapeamento.columns if 'cd_latitude_atendimento' in c.lower()), None)
-        map_lon_col = next((c for c in df_mapeamento.columns if 'cd_longitude_atendimento' in c.lower()), None)
-
-        if not all([map_city_col, map_lat_col, map_lon_col]):
+        # Consulta vetorizada no gazetteer do Mapeamento (cidade sem acento/caixa, qualificada pela UF quando houver)
+        gazetteer = obter_gazetteer(df_mapeamento)
+        if gazetteer is None:
             st.error("O arquivo de Mapeamento não contém as colunas necessárias ('nm_cidade_atendimento', 'cd_latitude_atendimento', 'cd_longitude_atendimento') para a busca por cidade.")
             return pd.DataFrame()
 
-        # Cria um dicionário de busca removendo duplicatas
-        df_mapeamento_coords = df_mapeamento[[map_city_col, map_lat_col, map_lon_col]].dropna().drop_duplicates(subset=[map_city_col])
-        df_mapeamento_coords[map_city_col] = df_mapeamento_coords[map_city_col].str.upper().str.strip()
-        coord_lookup = df_mapeamento_coords.set_index(map_city_col).to_dict('index')
-
-        # Aplica o lookup para obter as coordenadas
-        df_backlog['coords'] = df_backlog[cidade_col_b].str.upper().str.strip().map(coord_lookup)
-        df_backlog['lat_backlog'] = df_backlog['coords'].apply(lambda x: x[map_lat_col] if isinstance(x, dict) else None)
-        df_backlog['lon_backlog'] = df_backlog['coords'].apply(lambda x: x[map_lon_col] if isinstance(x, dict) else None)
-        df_backlog.drop(columns=['coords'], inplace=True)
+        uf_col_b = next((c for c in df_backlog.columns if c.lower() in ['uf', 'estado']), None)
+        coords = gazetteer.lookup_series(df_backlog[cidade_col_b], df_backlog[uf_col_b] if uf_col_b else None)
+        df_backlog['lat_backlog'] = coords['lat']
+        df_backlog['lon_backlog'] = coords['lon']
 
     df_backlog = df_backlog.dropna(subset=['lat_backlog', 'lon_backlog'])
     if df_backlog.empty:
@@ -190,96 +165,142 @@ def processar_backlog_df(df_backlog, df_mapeamento, num_rts_proximos=2):
         st.warning("Nenhuma ordem de serviço com coordenadas válidas foi encontrada após a limpeza dos dados.")
         return pd.DataFrame()
 
-    lat_col_m = next((c for c in df_mapeamento.columns if 'cd_latitude_representante' in c.lower()), None)
-    lon_col_m = next((c for c in df_mapeamento.columns if 'cd_longitude_representante' in c.lower()), None)
-    rep_col_m = next((c for c in df_mapeamento.columns if 'nm_representante' in c.lower()), None)
-    cidade_rt_col_m = next((c for c in df_mapeamento.columns if 'nm_cidade_representante' in c.lower()), None)
-
-    if not all([lat_col_m, lon_col_m, rep_col_m, cidade_rt_col_m]):
+    # Índice espacial dos RTs (construído uma vez por upload do Mapeamento), sem os RTs especiais
+    rt_index = obter_rt_index(df_mapeamento)
+    if rt_index is None:
         st.error("Arquivo de mapeamento precisa conter colunas de 'Representante', 'Cidade RT', 'Latitude' e 'Longitude'.")
         return pd.DataFrame()
+    rt_index = rt_index.subconjunto(('STELLANTIS', 'CEABS'))
 
-    df_mapeamento['lat_rt'] = safe_to_numeric(df_mapeamento[lat_col_m])
-    df_mapeamento['lon_rt'] = safe_to_numeric(df_mapeamento[lon_col_m])
-    df_mapeamento = df_mapeamento.dropna(subset=['lat_rt', 'lon_rt'])
-    
-    rts_unicos = df_mapeamento[[rep_col_m, cidade_rt_col_m, 'lat_rt', 'lon_rt']].drop_duplicates(subset=[rep_col_m])
-
-    resultados = []
-    for _, os_row in df_backlog.iterrows():
-        os_coord = (os_row['lat_backlog'], os_row['lon_backlog'])
-        distancias = []
-        for _, rt_row in rts_unicos.iterrows():
-            rt_coord = (rt_row['lat_rt'], rt_row['lon_rt'])
-            dist = haversine(os_coord, rt_coord, unit=Unit.KILOMETERS)
-            distancias.append({'OS': os_row[os_col_b], 'REPRESENTANTE': rt_row[rep_col_m], 'CIDADE_RT': rt_row[cidade_rt_col_m], 'DISTANCIA_KM': dist})
-        
-        distancias_df = pd.DataFrame(distancias)
-        mais_proximos = distancias_df.nsmallest(num_rts_proximos, 'DISTANCIA_KM')
-        mais_proximos['RANKING'] = range(1, len(mais_proximos) + 1)
-        
-        os_info = os_row.drop(labels=['lat_backlog', 'lon_backlog'])
-        for _, proximo_row in mais_proximos.iterrows():
-            resultado_final = proximo_row.to_dict()
-            resultado_final.update(os_info.to_dict())
-            resultados.append(resultado_final)
-
-    if not resultados: return pd.DataFrame()
-    df_final = pd.DataFrame(resultados)
-    
     cols_principais = ['RANKING', 'REPRESENTANTE', 'CIDADE_RT', 'DISTANCIA_KM']
     cols_backlog = [c for c in df_backlog.columns if c not in ['lat_backlog', 'lon_backlog']]
-    ordem_final = [c for c in cols_principais + cols_backlog if c in df_final.columns]
-    
-    # Garante que a coluna 'OS' exista, renomeando a coluna original se necessário.
-    os_col_original = next((c for c in df_final.columns if c.lower() in ['os', 'numero os', 'ordem de servico', 'ordem', 'ordemservicoid']), None)
-    if os_col_original and os_col_original != 'OS':
-        df_final.rename(columns={os_col_original: 'OS'}, inplace=True)
-    return df_final[ordem_final]
+
+    def _rts_do_bloco(df_bloco, busca):
+        # Busca vetorizada dos N RTs mais próximos para todas as O.S. do bloco de uma vez
+        df_final = rts_mais_proximos(df_bloco, 'lat_backlog', 'lon_backlog', rt_index, k=num_rts_proximos, busca=busca)
+        if df_final.empty: return pd.DataFrame()
+        ordem_final = [c for c in cols_principais + cols_backlog if c in df_final.columns]
+
+        # Garante que a coluna 'OS' exista, renomeando a coluna original se necessário.
+        os_col_original = next((c for c in df_final.columns if c.lower() in ['os', 'numero os', 'ordem de servico', 'ordem', 'ordemservicoid']), None)
+        if os_col_original and os_col_original != 'OS':
+            df_final.rename(columns={os_col_original: 'OS'}, inplace=True)
+        return df_final[ordem_final]
+
+    with BuscaParalela(rt_index, workers) as busca:
+        if not tamanho_bloco:
+            return _rts_do_bloco(df_backlog, busca)
+
+        total = len(df_backlog)
+        blocos = []
+        for posicao in range(inicio, total, tamanho_bloco):
+            df_bloco = _rts_do_bloco(df_backlog.iloc[posicao:posicao + tamanho_bloco], busca)
+            blocos.append(df_bloco)
+            if ao_concluir_bloco is not None:
+                ao_concluir_bloco(df_bloco, min(posicao + tamanho_bloco, total), total)
+    blocos = [b for b in blocos if not b.empty]
+    return pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame()
 
 def render_backlog_processor():
     df_mapeamento = st.session_state.get("df_mapeamento")
     df_backlog = st.session_state.get("df_backlog")
 
     st.markdown("---"); st.subheader("2. Filtros e Processamento")
-    col1, col2, col3 = st.columns([2, 2, 1])
+    col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
     uf_col = next((c for c in df_backlog.columns if 'uf' in c.lower()), None)
     cidade_col = next((c for c in df_backlog.columns if 'cidade' in c.lower() and 'rt' not in c.lower()), None)
     df_filtrado = df_backlog.copy()
 
     if uf_col:
         ufs = sorted(df_filtrado[uf_col].dropna().unique())
-        if uf_selecionada := col1.multiselect("Filtrar por UF:", options=ufs):
+        if uf_selecionada := col1.multiselect("Filtrar por UF:", options=ufs, key="backlog_ufs", persist_state="session"):
             df_filtrado = df_filtrado[df_filtrado[uf_col].isin(uf_selecionada)]
     if cidade_col:
         cidades = sorted(df_filtrado[cidade_col].dropna().unique())
-        if cidade_selecionada := col2.multiselect("Filtrar por Cidade:", options=cidades):
+        if cidade_selecionada := col2.multiselect("Filtrar por Cidade:", options=cidades, key="backlog_cidades", persist_state="session"):
             df_filtrado = df_filtrado[df_filtrado[cidade_col].isin(cidade_selecionada)]
 
-    num_rts = col3.number_input("Nº de RTs próximos:", min_value=1, max_value=10, value=2, step=1)
-
-    if st.button("Processar Backlog", use_container_width=True, type="primary"):
+    num_rts = col3.number_input("Nº de RTs próximos:", min_value=1, max_value=10, value=2, step=1, key="backlog_num_rts", persist_state="session")
+    workers = col4.number_input("Processos paralelos:", min_value=1, max_value=WORKERS_MAXIMO, value=min(WORKERS_PADRAO, WORKERS_MAXIMO), step=1,
+                                key="backlog_workers", persist_state="session",
+                                help=f"Divide a busca dos RTs mais próximos entre processos (blocos a partir de {MIN_PONTOS_PARALELO} O.S.). Compensa apenas para backlogs grandes.")
+    # Em paralelo os blocos precisam ser grandes o bastante para passar do limite de MIN_PONTOS_PARALELO
+    tamanho_bloco = BACKLOG_TAMANHO_BLOCO if workers == 1 else max(BACKLOG_TAMANHO_BLOCO, MIN_PONTOS_PARALELO)
+
+    # Processamento pendente (interrompido) só é retomado com os mesmos filtros e Nº de RTs
+    assinatura = (len(df_filtrado), int(pd.util.hash_pandas_object(df_filtrado.index).sum()), num_rts)
+    pendente = st.session_state.get("backlog_pendente")
+    if pendente and pendente['assinatura'] != assinatura:
+        pendente = None
+
+    col_b1, col_b2 = st.columns([3, 1])
+    iniciar = col_b1.button("Processar Backlog", use_container_width=True, type="primary")
+    slot_continuar = col_b2.empty()
+    continuar = pendente is not None and slot_continuar.button(f"▶️ Continuar ({pendente['processadas']}/{pendente['total']})", use_container_width=True)
+
+    if iniciar or continuar:
         if df_filtrado.empty: st.warning("Nenhum dado no backlog corresponde aos filtros selecionados.")
         else:
-            with st.spinner(f"Processando {len(df_filtrado)} ordens e buscando os {num_rts} RTs mais próximos..."):
-                df_resultado = processar_backlog_df(df_filtrado, df_mapeamento, num_rts)
-                st.session_state.df_backlog_resultado = df_resultado if not df_resultado.empty else None
+            if iniciar:
+                st.session_state.backlog_blocos = []
+                st.session_state.df_backlog_resultado = None
+            inicio = pendente['processadas'] if continuar else 0
+            barra = st.progress(0.0, text=f"Processando {len(df_filtrado)} ordens e buscando os {num_rts} RTs mais próximos...")
+            parcial = st.empty()
+
+            def _ao_concluir_bloco(df_bloco, processadas, total):
+                # Cada bloco concluído já fica salvo na sessão, mesmo que um bloco seguinte falhe
+                if not df_bloco.empty:
+                    st.session_state.backlog_blocos.append(df_bloco)
+                st.session_state.backlog_pendente = {'assinatura': assinatura, 'processadas': processadas, 'total': total}
+                barra.progress(processadas / total, text=f"Processadas {processadas} de {total} ordens...")
+                if st.session_state.backlog_blocos:
+                    df_parcial = pd.concat(st.session_state.backlog_blocos, ignore_index=True)
+                    with parcial.container():
+                        st.caption(f"Resultado parcial: {df_parcial['OS'].nunique()} ordens com RTs encontrados.")
+                        botao_download(
+                            label="📥 Baixar Resultado Parcial (.csv)",
+                            df=df_parcial,
+                            file_name="backlog_rts_proximos_parcial.csv",
+                            key=f"download_backlog_parcial_{processadas}",
+                        )
+
+            try:
+                processar_backlog_df(df_filtrado, df_mapeamento, num_rts, tamanho_bloco=tamanho_bloco,
+                                     ao_concluir_bloco=_ao_concluir_bloco, inicio=inicio, workers=workers)
+                st.session_state.backlog_pendente = None
+                slot_continuar.empty()
+            except Exception as e:
+                st.session_state.backlog_erro = f"O processamento foi interrompido: {e}. Os blocos já concluídos foram mantidos; use 'Continuar' para retomar."
+            barra.empty(); parcial.empty()
+            blocos = st.session_state.get("backlog_blocos") or []
+            st.session_state.df_backlog_resultado = pd.concat(blocos, ignore_index=True) if blocos else None
+            if st.session_state.get("backlog_erro"):
+                st.rerun()  # Redesenha com o botão 'Continuar' disponível
+
+    if erro := st.session_state.pop("backlog_erro", None):
+        st.error(erro)
 
     if (df_resultado := st.session_state.get("df_backlog_resultado")) is not None:
         st.markdown("---"); st.subheader("3. Resultados")
-        st.success(f"Análise concluída! Encontrados RTs para {df_resultado['OS'].nunique()} ordens de serviço.")
+        if (pendente := st.session_state.get("backlog_pendente")) is not None:
+            st.warning(f"Resultado parcial: {pendente['processadas']} de {pendente['total']} ordens processadas. Encontrados RTs para {df_resultado['OS'].nunique()} ordens de serviço.")
+        else:
+            st.success(f"Análise concluída! Encontrados RTs para {df_resultado['OS'].nunique()} ordens de serviço.")
         df_display = df_resultado.copy()
         if 'DISTANCIA_KM' in df_display.columns:
             df_display['DISTANCIA_KM'] = df_display['DISTANCIA_KM'].map('{:,.1f} km'.format)
         st.dataframe(df_display, use_container_width=True)
         
         # Novo botão de download para Excel
-        st.download_button(
-            label="📥 Exportar Resultado (.xlsx)",
-            data=to_styled_excel(df_resultado),
-            file_name="backlog_rts_proximos.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        col_d1, col_d2 = st.columns(2)
+        with col_d1:
+            botao_download(label="📥 Exportar Resultado (.xlsx)", df=df_resultado, tipo='xlsx_backlog',
+                           file_name="backlog_rts_proximos.xlsx", use_container_width=True)
+        with col_d2:
+            # Os dois formatos numa única geração, empacotados em .zip
+            botao_download(label="📦 Exportar .xlsx + .csv (.zip)", df=df_resultado, tipo=('xlsx_backlog', 'csv'),
+                           file_name="backlog_rts_proximos.zip", use_container_width=True)
 
 # --- FIM DAS FUNÇÕES DO BACKLOG ---
 
@@ -407,10 +428,14 @@ if st.session_state["authentication_status"]:
                 if not abas_para_renderizar:
                     st.warning("Você não tem permissão para acessar nenhuma funcionalidade. Por favor, contate um administrador.")
                 else:
-                    created_tabs = st.tabs(abas_para_renderizar)
+                    # Abas "preguiçosas": on_change="rerun" faz só a aba selecionada executar a cada rerun.
+                    # Os filtros de cada aba usam persist_state="session" para manter o valor enquanto a aba está oculta.
+                    created_tabs = st.tabs(abas_para_renderizar, key="aba_ativa", on_change="rerun")
                     
-                    # 5. Mapeia o nome da aba para o seu conteúdo e renderiza
+                    # 5. Mapeia o nome da aba para o seu conteúdo e renderiza apenas a aba ativa
                     for i, tab_name in enumerate(abas_para_renderizar):
+                        if not created_tabs[i].open:
+                            continue
                         with created_tabs[i]:
                             try:
                                 # Adiciona um log de acesso
@@ -468,7 +493,7 @@ if st.session_state["authentication_status"]:
                                     if "df_ultimaposicao" in st.session_state and st.session_state.df_ultimaposicao is not None:
                                         df_bruto = st.session_state.df_ultimaposicao
                                         with st.spinner("Extraindo dados de geolocalização..."):
-                                            df_processado = processar_dataframe_posicao(df_bruto)
+                                            df_processado = obter_posicao_processada(df_bruto, st.session_state.get("ultimaposicao_hash"))
                                         analisar_ultima_posicao(df_processado)
 
                                 elif tab_name == "✈️ Viagens":
@@ -593,6 +618,62 @@ if st.session_state["authentication_status"]:
                                         st.subheader("Perguntas mais comuns (Top 10)")
                                         st.dataframe(df_perguntas, use_container_width=True)
 
+                                    st.markdown("---")
+                                    st.subheader("Cache de Custos do Otimizador")
+                                    stats_cache = obter_cache_custos().estatisticas()
+                                    col_a, col_b, col_c, col_d = st.columns(4)
+                                    col_a.metric("Cidades em cache", f"{stats_cache['itens']} / {stats_cache['max_itens']}")
+                                    col_b.metric("Acertos (hits)", stats_cache['hits'])
+                                    col_c.metric("Erros (misses)", stats_cache['misses'])
+                                    col_d.metric("Taxa de acerto", f"{stats_cache['taxa_acerto']:.0%}")
+                                    st.caption(f"Expirados (TTL): {stats_cache['expirados']} | Descartados (LRU): {stats_cache['descartados']}")
+                                    if st.button("Limpar cache de custos", key="btn_limpar_cache_custos"):
+                                        obter_cache_custos().limpar()
+                                        st.success("Cache de custos limpo.")
+
+                                    st.subheader("Cache de Geocodificação Reversa")
+                                    stats_rg = obter_geocodificador_reverso().estatisticas()
+                                    col_a, col_b, col_c, col_d = st.columns(4)
+                                    col_a.metric("Coordenadas em cache", f"{stats_rg['itens']} / {stats_rg['max_itens']}")
+                                    col_b.metric("Acertos (hits)", stats_rg['hits'])
+                                    col_c.metric("Erros (misses)", stats_rg['misses'])
+                                    col_d.metric("Taxa de acerto", f"{stats_rg['taxa_acerto']:.0%}")
+                                    st.caption(f"Precisão: {stats_rg['precisao']} casas decimais | Árvore carregada: {'sim' if stats_rg['carregado'] else 'não'}")
+
+                                    st.subheader("Cache de Geocodificação de Endereços")
+                                    geocodificador = obter_geocodificador()
+                                    stats_geo = geocodificador.estatisticas()
+                                    col_a, col_b, col_c = st.columns(3)
+                                    col_a.metric("Pelo provedor", stats_geo.get('provedor', 0))
+                                    col_b.metric("Pelo município", stats_geo.get('gazetteer', 0))
+                                    col_c.metric("Não encontrados", stats_geo.get('nao_encontrado', 0))
+                                    st.caption(f"Provedor: {geocodificador.provedor.nome} | Municípios: {len(geocodificador.gazetteer)} ({geocodificador.gazetteer.fonte})")
+
+                                    st.markdown("---")
+                                    st.subheader("Tempo de Importação na Inicialização")
+                                    st.caption("Importa os módulos do app.py num processo novo com `python -X importtime`.")
+                                    if st.button("Medir tempo de importação", key="btn_perfil_importacao"):
+                                        with st.spinner("Medindo importações..."):
+                                            try:
+                                                st.session_state.perfil_importacao = perfil_importacao(modulos_importados(__file__))
+                                            except (RuntimeError, subprocess.TimeoutExpired) as e:
+                                                st.error(f"Não foi possível medir as importações: {e}")
+                                    df_perfil = st.session_state.get("perfil_importacao")
+                                    if df_perfil is not None and not df_perfil.empty:
+                                        df_topo = df_perfil[df_perfil['Nível'] == 0]
+                                        carregados = set(df_perfil['Módulo'])
+                                        tardios_carregados = sorted(m for m in MODULOS_TARDIOS if m in carregados)
+                                        col_a, col_b, col_c = st.columns(3)
+                                        col_a.metric("Tempo total (s)", f"{df_topo['Acumulado (ms)'].sum() / 1000:.2f}")
+                                        col_b.metric("Módulos carregados", len(df_perfil))
+                                        col_c.metric("Dependências adiadas carregadas", f"{len(tardios_carregados)} / {len(MODULOS_TARDIOS)}")
+                                        if tardios_carregados:
+                                            st.warning("Dependências declaradas como tardias foram importadas na inicialização: " + ", ".join(tardios_carregados))
+                                        st.markdown("**Maiores tempos acumulados (Top 25)**")
+                                        st.dataframe(df_perfil.nlargest(25, 'Acumulado (ms)'), use_container_width=True, hide_index=True)
+                                        with st.expander("Ver todas as importações"):
+                                            st.dataframe(df_perfil, use_container_width=True, hide_index=True)
+
                                     st.markdown("---")
                                     st.subheader("Painel de Administração de Usuários")
                                     with open('config.yaml', encoding='utf-8') as file:
@@ -0,0 +1,100 @@
+# benchmarks/benchmark_backlog.py
+"""
+Compara o motor vetorizado de RTs mais próximos (modules.geo) com o laço
+iterrows x iterrows usado anteriormente em processar_backlog_df.
+
+Uso:
+    python benchmarks/benchmark_backlog.py --ordens 40000 --rts 3000 --amostra-legado 200
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from haversine import haversine, Unit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from modules.geo import RTIndex, rts_mais_proximos  # noqa: E402
+
+
+def gerar_dados(num_ordens, num_rts, seed=42):
+    rng = np.random.default_rng(seed)
+    # Caixa aproximada do território brasileiro
+    df_backlog = pd.DataFrame({
+        'OS': [f"OS{i:06d}" for i in range(num_ordens)],
+        'UF': rng.choice(['SP', 'RJ', 'MG', 'PR', 'BA'], num_ordens),
+        'lat_backlog': rng.uniform(-33.0, 5.0, num_ordens),
+        'lon_backlog': rng.uniform(-73.0, -35.0, num_ordens),
+    })
+    df_rts = pd.DataFrame({
+        'nm_representante': [f"RT {i:05d}" for i in range(num_rts)],
+        'nm_cidade_representante': [f"CIDADE {i % 500:03d}" for i in range(num_rts)],
+        'lat_rt': rng.uniform(-33.0, 5.0, num_rts),
+        'lon_rt': rng.uniform(-73.0, -35.0, num_rts),
+    })
+    return df_backlog, df_rts
+
+
+def laco_legado(df_backlog, rts_unicos, num_rts_proximos):
+    """Reprodução do laço original (O.S. x RT com haversine escalar)."""
+    resultados = []
+    for _, os_row in df_backlog.iterrows():
+        os_coord = (os_row['lat_backlog'], os_row['lon_backlog'])
+        distancias = []
+        for _, rt_row in rts_unicos.iterrows():
+            rt_coord = (rt_row['lat_rt'], rt_row['lon_rt'])
+            dist = haversine(os_coord, rt_coord, unit=Unit.KILOMETERS)
+            distancias.append({'OS': os_row['OS'], 'REPRESENTANTE': rt_row['nm_representante'], 'CIDADE_RT': rt_row['nm_cidade_representante'], 'DISTANCIA_KM': dist})
+        mais_proximos = pd.DataFrame(distancias).nsmallest(num_rts_proximos, 'DISTANCIA_KM')
+        mais_proximos['RANKING'] = range(1, len(mais_proximos) + 1)
+        os_info = os_row.drop(labels=['lat_backlog', 'lon_backlog'])
+        for _, proximo_row in mais_proximos.iterrows():
+            resultado_final = proximo_row.to_dict()
+            resultado_final.update(os_info.to_dict())
+            resultados.append(resultado_final)
+    return pd.DataFrame(resultados)
+
+
+def motor_vetorizado(df_backlog, rts_unicos, num_rts_proximos):
+    indice = RTIndex(None, rts_unicos['nm_representante'], rts_unicos['lat_rt'], rts_unicos['lon_rt'],
+                     cidades=rts_unicos['nm_cidade_representante'])
+    return rts_mais_proximos(df_backlog, 'lat_backlog', 'lon_backlog', indice, k=num_rts_proximos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ordens', type=int, default=40000)
+    parser.add_argument('--rts', type=int, default=3000)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--amostra-legado', type=int, default=200,
+                        help="Nº de O.S. medidas no laço legado (o tempo total é extrapolado).")
+    args = parser.parse_args()
+
+    df_backlog, df_rts = gerar_dados(args.ordens, args.rts)
+
+    inicio = time.perf_counter()
+    df_novo = motor_vetorizado(df_backlog, df_rts, args.k)
+    tempo_novo = time.perf_counter() - inicio
+
+    amostra = df_backlog.head(args.amostra_legado)
+    inicio = time.perf_counter()
+    df_legado = laco_legado(amostra, df_rts, args.k)
+    tempo_amostra = time.perf_counter() - inicio
+    tempo_legado = tempo_amostra * args.ordens / max(len(amostra), 1)
+
+    # Confere que os dois motores escolhem os mesmos RTs na amostra
+    df_novo_amostra = df_novo[df_novo['OS'].isin(amostra['OS'])]
+    iguais = (df_novo_amostra['REPRESENTANTE'].to_numpy() == df_legado['REPRESENTANTE'].to_numpy()).all()
+    dist_ok = np.allclose(df_novo_amostra['DISTANCIA_KM'].to_numpy(), df_legado['DISTANCIA_KM'].to_numpy())
+
+    print(f"O.S.: {args.ordens} | RTs: {args.rts} | k: {args.k}")
+    print(f"Vetorizado: {tempo_novo:8.2f} s")
+    print(f"Legado:     {tempo_legado:8.2f} s (extrapolado de {len(amostra)} O.S. em {tempo_amostra:.2f} s)")
+    print(f"Speedup:    {tempo_legado / tempo_novo:8.1f}x")
+    print(f"Resultados idênticos na amostra: {'sim' if iguais and dist_ok else 'NÃO'}")
+
+
+if __name__ == '__main__':
+    main()
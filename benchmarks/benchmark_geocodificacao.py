@@ -0,0 +1,88 @@
+# benchmarks/benchmark_geocodificacao.py
+"""
+Mede a geocodificação em segundo plano (TarefaGeocodificacao) contra um
+servidor Nominatim local simulado, com latência por requisição, para
+diferentes números de requisições simultâneas, e confere a retomada de uma
+tarefa interrompida (só os endereços que faltam voltam ao provedor).
+
+Uso:
+    python benchmarks/benchmark_geocodificacao.py --enderecos 60 --latencia 0.2 --intervalo 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from modules.geocodificacao import Geocodificador, ProvedorNominatim  # noqa: E402
+
+
+def iniciar_servidor(latencia):
+    """Servidor /search que responde uma coordenada fixa após `latencia` segundos."""
+    requisicoes = []
+
+    class Manipulador(BaseHTTPRequestHandler):
+        def do_GET(self):
+            consulta = urllib.parse.parse_qs(urllib.parse.urlparse(self.path).query)['q'][0]
+            requisicoes.append(consulta)
+            time.sleep(latencia)
+            corpo = json.dumps([{'lat': '-23.55', 'lon': '-46.63'}]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def log_message(self, *args):
+            pass
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', 0), Manipulador)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, requisicoes
+
+
+def novo_geocodificador(url, intervalo, concorrencia, caminho=None):
+    caminho = caminho or os.path.join(tempfile.mkdtemp(), 'geocodificacao.sqlite')
+    return Geocodificador(ProvedorNominatim(url, intervalo_minimo=intervalo, concorrencia=concorrencia), None, caminho)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--enderecos', type=int, default=60)
+    parser.add_argument('--latencia', type=float, default=0.2)
+    parser.add_argument('--intervalo', type=float, default=0.05)
+    args = parser.parse_args()
+
+    servidor, requisicoes = iniciar_servidor(args.latencia)
+    url = f"http://127.0.0.1:{servidor.server_address[1]}"
+    enderecos = [f"Rua {i}, São Paulo - SP" for i in range(args.enderecos)]
+
+    print(f"Endereços: {args.enderecos} | latência: {args.latencia} s | intervalo mínimo: {args.intervalo} s")
+    for concorrencia in (1, 2, 4, 8):
+        geocodificador = novo_geocodificador(url, args.intervalo, concorrencia)
+        inicio = time.perf_counter()
+        resultado = geocodificador.geocodificar(enderecos)
+        tempo = time.perf_counter() - inicio
+        print(f"concorrência {concorrencia}: {tempo:6.2f} s ({resultado['lat'].notna().sum()} coordenadas)")
+
+    # Retomada: interrompe na metade e reinicia com o mesmo cache
+    caminho = os.path.join(tempfile.mkdtemp(), 'geocodificacao.sqlite')
+    tarefa = novo_geocodificador(url, args.intervalo, 2, caminho).iniciar_tarefa(enderecos, lote_gravacao=1)
+    while tarefa.feitos < args.enderecos // 2:
+        time.sleep(0.01)
+    tarefa.cancelar()
+    tarefa.aguardar()
+    requisicoes.clear()
+    retomada = novo_geocodificador(url, args.intervalo, 2, caminho).iniciar_tarefa(enderecos)
+    retomada.aguardar()
+    print(f"Retomada: {tarefa.feitos} antes da interrupção, {len(requisicoes)} requisições depois "
+          f"({retomada.resultado()['lat'].notna().sum()} de {args.enderecos} com coordenada)")
+    servidor.shutdown()
+
+
+if __name__ == '__main__':
+    main()
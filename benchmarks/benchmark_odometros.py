@@ -0,0 +1,92 @@
+# benchmarks/benchmark_odometros.py
+"""
+Compara a extração vetorizada de odômetros (extrair_odometros_series) com o
+`.apply(lambda txt: pd.Series(extrair_odometros(txt)))` usado anteriormente
+no CPS e no cruzamento Posição x CPS, e confere que os valores são iguais.
+
+Uso:
+    python benchmarks/benchmark_odometros.py --linhas 200000
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from modules.processar_relatorio import extrair_odometros, extrair_odometros_series  # noqa: E402
+
+
+def gerar_textos(num_linhas, seed=42):
+    rng = np.random.default_rng(seed)
+    modelos = [
+        "Posição / On\nOdometro: {n}\nOdometro CAN: {c}",
+        "Posição / Off Hodometro:{n} odometro_can:{c}",
+        "Ignição / On Odometro CAN: {c} Odometro: {n}",
+        "Bateria Violada / Off Odometro: {n}",
+        "Posição / On",
+        "Velocidade / On Velocidade: 80 Odometro: -{n}",
+    ]
+    escolhas = rng.integers(0, len(modelos), num_linhas)
+    normais = rng.integers(0, 999999, num_linhas)
+    cans = rng.uniform(0, 999999, num_linhas).round(1)
+    textos = [modelos[e].format(n=n, c=c) for e, n, c in zip(escolhas, normais, cans)]
+    serie = pd.Series(textos, dtype=object)
+    serie[rng.random(num_linhas) < 0.02] = None
+    return serie
+
+
+def extrair_odometros_legado(texto):
+    """Reprodução da função original (re.search/re.finditer com padrões não compilados)."""
+    if not isinstance(texto, str):
+        return None, None
+    texto_limpo = texto.replace('\n', ' ').replace('\r', ' ')
+    odometro_normal = None
+    odometro_can = None
+    match_can = re.search(r"(H?odometro[\s_]*CAN)\s*:?\s*(-?\d+\.?\d*)", texto_limpo, re.IGNORECASE)
+    if match_can:
+        odometro_can = float(match_can.group(2))
+    for match in re.finditer(r"(H?odometro)\s*:?\s*(-?\d+\.?\d*)", texto_limpo, re.IGNORECASE):
+        substring = texto_limpo[match.start(1) + len(match.group(1)):match.start(2)]
+        if "can" not in substring.lower():
+            odometro_normal = float(match.group(2))
+            break
+    return odometro_normal, odometro_can
+
+
+def medir(funcao, serie):
+    inicio = time.perf_counter()
+    resultado = funcao(serie)
+    return resultado, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--linhas', type=int, default=200000)
+    args = parser.parse_args()
+
+    serie = gerar_textos(args.linhas)
+    colunas = ['odometro', 'odometro_can']
+
+    df_legado, tempo_legado = medir(
+        lambda s: s.apply(lambda txt: pd.Series(extrair_odometros_legado(txt), index=colunas)), serie)
+    df_escalar, tempo_escalar = medir(
+        lambda s: pd.DataFrame(s.map(extrair_odometros).tolist(), index=s.index, columns=colunas), serie)
+    df_novo, tempo_novo = medir(extrair_odometros_series, serie)
+
+    referencia = df_legado.astype(float)
+    iguais = referencia.equals(df_novo) and referencia.equals(df_escalar.astype(float))
+
+    print(f"Linhas: {args.linhas}")
+    print(f"apply + pd.Series (legado):     {tempo_legado:8.2f} s")
+    print(f"map(extrair_odometros):         {tempo_escalar:8.2f} s")
+    print(f"extrair_odometros_series:       {tempo_novo:8.2f} s")
+    print(f"Speedup sobre o legado:         {tempo_legado / tempo_novo:8.1f}x")
+    print(f"Resultados idênticos: {'sim' if iguais else 'NÃO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# benchmarks/benchmark_paralelo.py
+"""
+Compara a busca dos RTs mais próximos do Backlog em 1, 4 e 16 processos
+(modules.paralelo.BuscaParalela) e confere que todas as execuções dão o mesmo
+resultado. Como no app, as O.S. são processadas em blocos e um único pool
+atende todos os blocos de uma execução; o início do pool é medido à parte.
+
+Rode no hardware de produção antes de mudar o padrão (MERCURIO_WORKERS).
+
+Uso:
+    python benchmarks/benchmark_paralelo.py --ordens 200000 --rts 3000 --workers 1 4 16
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from benchmarks.benchmark_backlog import gerar_dados  # noqa: E402
+from modules.geo import RTIndex, rts_mais_proximos  # noqa: E402
+from modules.paralelo import BuscaParalela, MIN_PONTOS_PARALELO  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ordens', type=int, default=200000)
+    parser.add_argument('--rts', type=int, default=3000)
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--bloco', type=int, default=MIN_PONTOS_PARALELO)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+
+    df_backlog, df_rts = gerar_dados(args.ordens, args.rts)
+    indice = RTIndex(None, df_rts['nm_representante'], df_rts['lat_rt'], df_rts['lon_rt'],
+                     cidades=df_rts['nm_cidade_representante'])
+
+    print(f"O.S.: {args.ordens} | RTs: {args.rts} | k: {args.k} | bloco: {args.bloco} | CPUs: {os.cpu_count()}")
+    referencia, tempo_base = None, None
+    for workers in args.workers:
+        with BuscaParalela(indice, workers) as busca:
+            inicio = time.perf_counter()
+            # Primeira busca com pontos suficientes abre o pool: medida à parte
+            busca.k_mais_proximos(df_backlog['lat_backlog'].to_numpy()[:args.bloco],
+                                  df_backlog['lon_backlog'].to_numpy()[:args.bloco], args.k)
+            tempo_pool = time.perf_counter() - inicio
+
+            inicio = time.perf_counter()
+            blocos = [rts_mais_proximos(df_backlog.iloc[p:p + args.bloco], 'lat_backlog', 'lon_backlog', indice,
+                                        k=args.k, busca=busca)
+                      for p in range(0, len(df_backlog), args.bloco)]
+            tempo = time.perf_counter() - inicio
+        df = pd.concat(blocos, ignore_index=True)
+        if referencia is None:
+            referencia, tempo_base = df, tempo
+        iguais = df.equals(referencia)
+        print(f"{workers:3d} processo(s): início do pool {tempo_pool:6.2f} s | busca {tempo:6.2f} s | "
+              f"speedup da busca {tempo_base / tempo:5.2f}x | idêntico ao primeiro: {'sim' if iguais else 'NÃO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -43,13 +43,13 @@ def exibir_ordens_agendadas(df: pd.DataFrame):
 
         if col_tecnico:
             tecnicos = sorted(df_filtrado[col_tecnico].dropna().unique())
-            tecnico_selecionado = col1.multiselect(f"Filtrar por {col_tecnico}:", options=tecnicos)
+            tecnico_selecionado = col1.multiselect(f"Filtrar por {col_tecnico}:", options=tecnicos, key="agend_tecnicos", persist_state="session")
             if tecnico_selecionado:
                 df_filtrado = df_filtrado[df_filtrado[col_tecnico].isin(tecnico_selecionado)]
 
         if col_cidade:
             cidades = sorted(df_filtrado[col_cidade].dropna().unique())
-            cidade_selecionada = col2.multiselect(f"Filtrar por {col_cidade}:", options=cidades)
+            cidade_selecionada = col2.multiselect(f"Filtrar por {col_cidade}:", options=cidades, key="agend_cidades", persist_state="session")
             if cidade_selecionada:
                 df_filtrado = df_filtrado[df_filtrado[col_cidade].isin(cidade_selecionada)]
 
@@ -1,7 +1,7 @@
 # modules/ativos.py
 import streamlit as st
 import pandas as pd
-from modules.utils import convert_df_to_csv
+from modules.exportacao import botao_download
 from modules.tutorial_helper import tutorial_button # <-- NOVO IMPORT
 
 def ferramenta_ativos(df):
@@ -37,7 +37,8 @@ def ferramenta_ativos(df):
         st.info("Devido ao tamanho do arquivo, digite o nome do cliente para pesquisar.")
         cliente_digitado = st.text_input(
             "Digite o nome (ou parte do nome) do Cliente para analisar:",
-            placeholder="Ex: 'TRANSPORTADORA XYZ'"
+            placeholder="Ex: 'TRANSPORTADORA XYZ'",
+            key="ativos_cliente", persist_state="session"
         )
 
         if not cliente_digitado:
@@ -87,12 +88,10 @@ def ferramenta_ativos(df):
 
         st.subheader("Exportar Dados do Cliente")
         
-        csv = convert_df_to_csv(df_cliente)
-        st.download_button(
+        botao_download(
             label="📥 Baixar dados deste cliente (.csv)",
-            data=csv,
+            df=df_cliente,
             file_name=f"ativos_{cliente_selecionado}.csv",
-            mime="text/csv",
         )
 
     except Exception as e:
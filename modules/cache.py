@@ -0,0 +1,69 @@
+# modules/cache.py
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """
+    Cache em memória limitado por quantidade de itens (LRU) e por tempo de vida (TTL).
+
+    Seguro para uso entre threads (sessões do Streamlit compartilham a mesma
+    instância quando ela vem de st.cache_resource). Mantém contadores de
+    acertos/erros para exibição no painel Admin.
+    """
+
+    def __init__(self, max_itens=500, ttl_segundos=6 * 3600):
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirados = 0
+        self.descartados = 0
+
+    def get(self, chave, padrao=None):
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                self.misses += 1
+                return padrao
+            criado_em, valor = item
+            if self.ttl_segundos is not None and time.monotonic() - criado_em > self.ttl_segundos:
+                del self._dados[chave]
+                self.expirados += 1
+                self.misses += 1
+                return padrao
+            self._dados.move_to_end(chave)
+            self.hits += 1
+            return valor
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = (time.monotonic(), valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+                self.descartados += 1
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+    def estatisticas(self):
+        """Resumo do uso do cache (itens, acertos, erros, taxa de acerto...)."""
+        consultas = self.hits + self.misses
+        return {
+            'itens': len(self._dados),
+            'max_itens': self.max_itens,
+            'ttl_segundos': self.ttl_segundos,
+            'hits': self.hits,
+            'misses': self.misses,
+            'expirados': self.expirados,
+            'descartados': self.descartados,
+            'taxa_acerto': self.hits / consultas if consultas else 0.0,
+        }
@@ -0,0 +1,106 @@
+# modules/carregamento_tardio.py
+"""
+Importação tardia das dependências pesadas e perfil de tempo de importação.
+
+modulo_tardio devolve um substituto que só importa o módulo real no primeiro
+acesso a um atributo: bibliotecas como pydeck, reverse_geocoder ou plotly
+passam a ser carregadas quando a aba que as usa é aberta, e não antes da
+tela de login.
+
+perfil_importacao roda `python -X importtime` num processo novo e devolve a
+tabela de tempos (exibida na aba Admin), para que regressões no tempo de
+inicialização fiquem visíveis.
+"""
+import ast
+import importlib
+import importlib.util
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+RAIZ_PROJETO = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Nomes de todos os módulos declarados com modulo_tardio (consultados pelo perfil)
+MODULOS_TARDIOS = set()
+
+
+class ModuloTardio:
+    """Substituto de um módulo que faz a importação real no primeiro uso."""
+
+    def __init__(self, nome):
+        self._nome = nome
+        self._modulo = None
+
+    def _carregar(self):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nome)
+        return self._modulo
+
+    @property
+    def carregado(self):
+        return self._modulo is not None
+
+    def __getattr__(self, atributo):
+        return getattr(self._carregar(), atributo)
+
+    def __repr__(self):
+        estado = "carregado" if self.carregado else "não carregado"
+        return f"<ModuloTardio '{self._nome}' ({estado})>"
+
+
+def modulo_tardio(nome):
+    """Ex.: `pdk = modulo_tardio("pydeck")` — o pydeck só é importado no primeiro `pdk.<algo>`."""
+    MODULOS_TARDIOS.add(nome)
+    return ModuloTardio(nome)
+
+
+def modulo_disponivel(nome):
+    """Indica se o pacote está instalado, sem importá-lo."""
+    return importlib.util.find_spec(nome.split('.')[0]) is not None
+
+
+def modulos_importados(caminho):
+    """Módulos importados no nível superior de um arquivo .py (na ordem em que aparecem)."""
+    with open(caminho, encoding='utf-8') as f:
+        arvore = ast.parse(f.read(), filename=caminho)
+    modulos = []
+    for no in arvore.body:
+        if isinstance(no, ast.Import):
+            modulos.extend(alias.name for alias in no.names)
+        elif isinstance(no, ast.ImportFrom) and no.module and no.level == 0:
+            modulos.append(no.module)
+    return list(dict.fromkeys(modulos))
+
+
+def _ler_importtime(saida):
+    """Converte as linhas 'import time: próprio | acumulado | módulo' em DataFrame (tempos em ms)."""
+    registros = []
+    for linha in saida.splitlines():
+        if not linha.startswith('import time:'):
+            continue
+        partes = linha[len('import time:'):].split('|')
+        if len(partes) != 3 or not partes[0].strip().isdigit():
+            continue  # cabeçalho
+        nome = partes[2].rstrip()
+        registros.append({
+            'Módulo': nome.strip(),
+            'Nível': (len(nome) - len(nome.lstrip()) - 1) // 2,
+            'Próprio (ms)': int(partes[0]) / 1000,
+            'Acumulado (ms)': int(partes[1]) / 1000,
+        })
+    return pd.DataFrame(registros, columns=['Módulo', 'Nível', 'Próprio (ms)', 'Acumulado (ms)'])
+
+
+def perfil_importacao(modulos, timeout=180):
+    """
+    Importa `modulos` num interpretador novo com -X importtime e devolve a
+    tabela de tempos. Levanta RuntimeError se a importação falhar.
+    """
+    comando = [sys.executable, '-X', 'importtime', '-c', '; '.join(f'import {m}' for m in modulos)]
+    resultado = subprocess.run(comando, capture_output=True, text=True, cwd=RAIZ_PROJETO, timeout=timeout)
+    if resultado.returncode != 0:
+        erro = [l for l in resultado.stderr.splitlines() if l and not l.startswith('import time:')]
+        raise RuntimeError(erro[-1] if erro else f"processo terminou com código {resultado.returncode}")
+    return _ler_importtime(resultado.stderr)
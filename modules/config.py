@@ -1,8 +1,11 @@
 # modules/config.py
 import streamlit as st
-import google.generativeai as genai
 import os
 import base64
+from modules.carregamento_tardio import modulo_tardio
+
+# SDK do Gemini: importado só ao configurar o modelo do chat
+genai = modulo_tardio("google.generativeai")
 
 # --- 1. NOVAS CONSTANTES DE TEMA ---
 # Tema escuro, limpo e profissional
@@ -1,38 +1,9 @@
 import streamlit as st
 import pandas as pd
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
 import numpy as np
-from modules.processar_relatorio import extrair_odometros
-
-@st.cache_data
-def geocode_addresses(addresses):
-    """
-    Converte uma lista de endereços em coordenadas (latitude, longitude)
-    usando Nominatim e exibe uma barra de progresso.
-    """
-    geolocator = Nominatim(user_agent="mercurio_app")
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
-    
-    coords = {}
-    
-    progress_bar = st.progress(0)
-    total = len(addresses)
-    
-    for i, address in enumerate(addresses):
-        try:
-            location = geocode(address)
-            if location:
-                coords[address] = {'lat': location.latitude, 'lon': location.longitude}
-            else:
-                coords[address] = {'lat': None, 'lon': None}
-        except Exception as e:
-            st.warning(f"Não foi possível geocodificar o endereço '{address}': {e}")
-            coords[address] = {'lat': None, 'lon': None}
-        
-        progress_bar.progress((i + 1) / total)
-        
-    return coords
+from modules.processar_relatorio import extrair_odometros_series
+from modules.data_loader import iniciar_geocodificacao, acompanhar_geocodificacao
+from modules.mapas import exibir_mapa
 
 def analisar_cps(df_cps):
     """
@@ -62,121 +33,110 @@ def analisar_cps(df_cps):
         return
 
     # 3. Extrair odômetros direto do texto (quando existir)
-    try:
-        odometro_cols = df_cps['Evento / Ignição'].apply(lambda txt: pd.Series(extrair_odometros(txt), index=['odometro', 'odometro_can']))
-        df_cps = pd.concat([df_cps, odometro_cols], axis=1)
-    except Exception:
-        df_cps['odometro'] = None
-        df_cps['odometro_can'] = None
+    odometro_cols = extrair_odometros_series(df_cps['Evento / Ignição'])
+    df_cps = pd.concat([df_cps, odometro_cols], axis=1)
 
     st.dataframe(df_cps)
 
     st.markdown("---")
     st.subheader("Gerar Mapas de Geolocalização")
-    st.info("Como o relatório não possui coordenadas, usaremos a coluna 'Localização' para geocodificar os endereços. Este processo pode ser lento.")
+    st.info("Como o relatório não possui coordenadas, usaremos a coluna 'Localização' para geocodificar os endereços. A geocodificação roda em segundo plano e os mapas são atualizados conforme as coordenadas chegam.")
 
     if st.button("Gerar Coordenadas e Mapas"):
-        with st.spinner("Geocodificando endereços... Isso pode levar vários minutos."):
-            unique_addresses = df_cps['Localização'].dropna().unique()
-            
-            # Chama a função de geocodificação
-            address_coords = geocode_addresses(tuple(unique_addresses))
-            
-            # Mapeia as coordenadas de volta para o dataframe
-            df_cps['lat'] = df_cps['Localização'].map(lambda x: address_coords.get(x, {}).get('lat'))
-            df_cps['lon'] = df_cps['Localização'].map(lambda x: address_coords.get(x, {}).get('lon'))
+        iniciar_geocodificacao('tarefa_geo_cps', df_cps['Localização'])
+
+    acompanhar_geocodificacao('tarefa_geo_cps', lambda coordenadas: _exibir_mapas_cps(df_cps, coordenadas))
 
-            st.session_state.df_cps_geocoded = df_cps.copy()
 
-    if 'df_cps_geocoded' in st.session_state:
-        df_geocoded = st.session_state.df_cps_geocoded.copy()
+def _exibir_mapas_cps(df_cps, coordenadas):
+    """ Mapas do CPS com as coordenadas obtidas até o momento (parciais enquanto a geocodificação roda). """
+    # Mapeia as coordenadas de volta para o dataframe
+    df_geocoded = df_cps.copy()
+    df_geocoded['lat'] = df_geocoded['Localização'].map(coordenadas['lat'])
+    df_geocoded['lon'] = df_geocoded['Localização'].map(coordenadas['lon'])
+    df_geocoded['Origem coordenada'] = df_geocoded['Localização'].map(coordenadas['origem'])
+
+    # Remove linhas que não puderam ser geocodificadas (ou que ainda estão na fila)
+    df_mapa = df_geocoded.dropna(subset=['lat', 'lon'])
+    
+    # Garante que as coordenadas são numéricas
+    df_mapa['lat'] = pd.to_numeric(df_mapa['lat'])
+    df_mapa['lon'] = pd.to_numeric(df_mapa['lon'])
+
+    num_geocoded = len(df_mapa)
+    num_total = len(df_geocoded)
+    st.success(f"{num_geocoded} de {num_total} endereços foram geocodificados com sucesso.")
+    num_municipio = int((df_mapa['Origem coordenada'] == 'gazetteer').sum())
+    if num_municipio:
+        st.caption(f"{num_municipio} deles localizados apenas pelo município (coordenada aproximada).")
+
+    if num_geocoded > 0:
+        # MAPA 1: Evento Posição (ON/OFF)
+        st.markdown("---")
+        st.subheader("Mapa de Dispositivos por Posição (ON/OFF)")
+
+        df_mapa['Ignição'] = df_mapa['Ignição'].str.lower()
         
-        # Remove linhas que não puderam ser geocodificadas
-        df_mapa = df_geocoded.dropna(subset=['lat', 'lon'])
+        # Cores da legenda do mapa (ignição fora de on/off fica cinza)
+        cores_ignicao = {'on': [0, 255, 0], 'off': [255, 0, 0]}
+
+        # O evento "Posição" parece ser o evento principal para ON/OFF
+        df_on = df_mapa[df_mapa['Evento'].str.contains("Posição", case=False, na=False) & (df_mapa['Ignição'] == 'on')]
+        df_off = df_mapa[df_mapa['Evento'].str.contains("Posição", case=False, na=False) & (df_mapa['Ignição'] == 'off')]
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Dispositivos com Posição e Ignição ON", len(df_on))
+            if not df_on.empty:
+                exibir_mapa(df_on, key="mapa_cps_on", coluna_status='Ignição', cores_status=cores_ignicao)
+            else:
+                st.info("Nenhum dispositivo com 'Posição' e ignição 'ON' encontrado.")
         
-        # Garante que as coordenadas são numéricas
-        df_mapa['lat'] = pd.to_numeric(df_mapa['lat'])
-        df_mapa['lon'] = pd.to_numeric(df_mapa['lon'])
+        with col2:
+            st.metric("Dispositivos com Posição e Ignição OFF", len(df_off))
+            if not df_off.empty:
+                exibir_mapa(df_off, key="mapa_cps_off", coluna_status='Ignição', cores_status=cores_ignicao)
+            else:
+                st.info("Nenhum dispositivo com 'Posição' e ignição 'OFF' encontrado.")
 
-        num_geocoded = len(df_mapa)
-        num_total = len(df_geocoded)
-        st.success(f"{num_geocoded} de {num_total} endereços foram geocodificados com sucesso.")
+        # MAPA 2: Status de Evento
+        st.markdown("---")
+        st.subheader("Mapa de Dispositivos por Status de Evento")
+        
+        # Criar colunas para os filtros
+        col1_filter, col2_filter = st.columns(2)
 
-        if num_geocoded > 0:
-            # MAPA 1: Evento Posição (ON/OFF)
-            st.markdown("---")
-            st.subheader("Mapa de Dispositivos por Posição (ON/OFF)")
+        with col1_filter:
+            # Filtro de Eventos
+            eventos = df_mapa['Evento'].dropna().unique()
+            # Remove 'on' e 'off' se estiverem na lista de eventos, para evitar redundância
+            eventos_filtrados = [e for e in eventos if str(e).lower() not in ['on', 'off']]
+            evento_selecionado = st.selectbox("Selecione um Evento:", options=['Todos'] + sorted(eventos_filtrados), key="cps_evento", persist_state="session")
 
-            df_mapa['Ignição'] = df_mapa['Ignição'].str.lower()
-            
-            # Adicionando uma coluna de cor para a legenda do mapa
-            def get_color(status):
-                if status == 'on':
-                    return [0, 255, 0]  # Green
-                elif status == 'off':
-                    return [255, 0, 0]  # Red
-                else:
-                    return [128, 128, 128] # Gray
-
-            df_mapa['color'] = df_mapa['Ignição'].apply(get_color)
-
-            # O evento "Posição" parece ser o evento principal para ON/OFF
-            df_on = df_mapa[df_mapa['Evento'].str.contains("Posição", case=False, na=False) & (df_mapa['Ignição'] == 'on')]
-            df_off = df_mapa[df_mapa['Evento'].str.contains("Posição", case=False, na=False) & (df_mapa['Ignição'] == 'off')]
-
-            col1, col2 = st.columns(2)
-            with col1:
-                st.metric("Dispositivos com Posição e Ignição ON", len(df_on))
-                if not df_on.empty:
-                    st.map(df_on, latitude='lat', longitude='lon', color='color')
-                else:
-                    st.info("Nenhum dispositivo com 'Posição' e ignição 'ON' encontrado.")
-            
-            with col2:
-                st.metric("Dispositivos com Posição e Ignição OFF", len(df_off))
-                if not df_off.empty:
-                    st.map(df_off, latitude='lat', longitude='lon', color='color')
-                else:
-                    st.info("Nenhum dispositivo com 'Posição' e ignição 'OFF' encontrado.")
-
-            # MAPA 2: Status de Evento
-            st.markdown("---")
-            st.subheader("Mapa de Dispositivos por Status de Evento")
+        with col2_filter:
+            # Filtro de Ignição
+            ignicao_selecionada = st.selectbox("Selecione a Ignição:", options=['Ambas', 'On', 'Off'], key="cps_ignicao", persist_state="session")
+
+        # Aplicar filtros
+        df_filtrado = df_mapa.copy()
+
+        # Filtro por evento selecionado
+        if evento_selecionado != 'Todos':
+            df_filtrado = df_filtrado[df_filtrado['Evento'] == evento_selecionado]
+
+        # Filtro por ignição selecionada
+        if ignicao_selecionada != 'Ambas':
+            df_filtrado = df_filtrado[df_filtrado['Ignição'].str.lower() == ignicao_selecionada.lower()]
+
+        st.metric(f"Dispositivos Encontrados", len(df_filtrado))
+
+        if not df_filtrado.empty:
+            # 'Placa / Identificação' e 'Data/Hora Evento' foram fornecidas pelo usuário
+            display_cols = [col for col in ['Placa / Identificação', 'Data/Hora Evento', 'Evento', 'Ignição', 'Localização', 'odometro', 'odometro_can'] if col in df_filtrado.columns]
             
-            # Criar colunas para os filtros
-            col1_filter, col2_filter = st.columns(2)
-
-            with col1_filter:
-                # Filtro de Eventos
-                eventos = df_mapa['Evento'].dropna().unique()
-                # Remove 'on' e 'off' se estiverem na lista de eventos, para evitar redundância
-                eventos_filtrados = [e for e in eventos if str(e).lower() not in ['on', 'off']]
-                evento_selecionado = st.selectbox("Selecione um Evento:", options=['Todos'] + sorted(eventos_filtrados))
-
-            with col2_filter:
-                # Filtro de Ignição
-                ignicao_selecionada = st.selectbox("Selecione a Ignição:", options=['Ambas', 'On', 'Off'])
-
-            # Aplicar filtros
-            df_filtrado = df_mapa.copy()
-
-            # Filtro por evento selecionado
-            if evento_selecionado != 'Todos':
-                df_filtrado = df_filtrado[df_filtrado['Evento'] == evento_selecionado]
-
-            # Filtro por ignição selecionada
-            if ignicao_selecionada != 'Ambas':
-                df_filtrado = df_filtrado[df_filtrado['Ignição'].str.lower() == ignicao_selecionada.lower()]
-
-            st.metric(f"Dispositivos Encontrados", len(df_filtrado))
-
-            if not df_filtrado.empty:
-                # 'Placa / Identificação' e 'Data/Hora Evento' foram fornecidas pelo usuário
-                display_cols = [col for col in ['Placa / Identificação', 'Data/Hora Evento', 'Evento', 'Ignição', 'Localização', 'odometro', 'odometro_can'] if col in df_filtrado.columns]
-                
-                st.map(df_filtrado, latitude='lat', longitude='lon', color='color')
-                st.dataframe(df_filtrado[display_cols])
-            else:
-                st.info("Nenhum dispositivo encontrado para os filtros selecionados.")
+            exibir_mapa(df_filtrado, key="mapa_cps_eventos", coluna_status='Ignição', cores_status=cores_ignicao)
+            st.dataframe(df_filtrado[display_cols])
         else:
-            st.warning("Nenhum endereço pôde ser exibido no mapa.")
+            st.info("Nenhum dispositivo encontrado para os filtros selecionados.")
+    else:
+        st.warning("Nenhum endereço pôde ser exibido no mapa.")
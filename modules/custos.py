@@ -2,17 +2,16 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-from modules.utils import safe_to_numeric, convert_df_to_csv
+from modules.utils import safe_to_numeric
+from modules.exportacao import botao_download
 from modules.tutorial_helper import tutorial_button
 import datetime 
-from haversine import haversine, Unit
+from modules.geo import haversine_km
+from modules.gazetteer import normalizar_cidade
+from modules.data_loader import obter_rt_index
+from modules.carregamento_tardio import modulo_disponivel
  
-
-try:
-    from geopy.distance import geodesic
-    GEOPY_AVAILABLE = True
-except ImportError:
-    GEOPY_AVAILABLE = False
+GEOPY_AVAILABLE = modulo_disponivel("geopy")
 # Variáveis chave padronizadas para o merge
 MAP_REP_KEY = 'MERGE_REP_KEY'
 MAP_CITY_KEY = 'MERGE_CITY_KEY'
@@ -121,7 +120,8 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
         d_sel = col1.date_input("Filtrar por Data (Geral):", 
                                 value=(min_d, max_d), 
                                 min_value=min_d, 
-                                max_value=max_d)
+                                max_value=max_d,
+                                key="custos_periodo", persist_state="session")
         if len(d_sel) == 2:
             start, end = d_sel
             df_filtrado = df_filtrado[(df_filtrado['DATA_ANALISE'] >= start) & (df_filtrado['DATA_ANALISE'] <= end)]
@@ -130,7 +130,7 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
         st.info("Filtro de Data indisponível: Nenhum dado de 'Data de Fechamento' encontrado.")
 
     reps = sorted(df_filtrado[rep_col_p].dropna().unique())
-    reps_sel = col2.multiselect("Filtrar por Representante (Geral):", options=reps)
+    reps_sel = col2.multiselect("Filtrar por Representante (Geral):", options=reps, key="custos_representantes", persist_state="session")
     if reps_sel:
         df_filtrado = df_filtrado[df_filtrado[rep_col_p].isin(reps_sel)]
 
@@ -225,30 +225,27 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
 
         if all(required_map_cols):
             
-            # --- FUNÇÃO DE CÁLCULO DE DISTÂNCIA (KM_IDA) (MANTIDA APENAS PARA A ORDENAÇÃO DO MAPA) ---
-            def calcular_distancia_os_rt(row):
-                """Calcula a distância Haversine entre a O.S. (lat/lon_os_pag) e o RT (lat/lon_rt_pag)."""
-                lat_os, lon_os = row.get('lat_os_pag'), row.get('lon_os_pag')
-                lat_rt, lon_rt = row.get('lat_rt_pag'), row.get('lon_rt_pag')
-                
-                if pd.isna(lat_os) or pd.isna(lon_os) or pd.isna(lat_rt) or pd.isna(lon_rt):
-                    return np.nan
-                
-                try:
-                    # Seção 3 (Roterização) usará este KM_IDA_CALCULADO para ranking
-                    return haversine((lat_os, lon_os), (lat_rt, lon_rt), unit=Unit.KILOMETERS)
-                except Exception:
-                    return np.nan
-
-            # O KM CALCULADO É MANTIDO PARA A LÓGICA DE ROTERIZAÇÃO (SEÇÃO 3)
-            df_analise['KM_IDA_CALCULADO'] = df_analise.apply(calcular_distancia_os_rt, axis=1)
+            # --- CÁLCULO DE DISTÂNCIA (KM_IDA) (MANTIDO APENAS PARA A ORDENAÇÃO DO MAPA) ---
+            # RTs sem coordenada no Pagamento usam a base cadastrada no índice espacial do Mapeamento
+            lat_rt = df_analise['lat_rt_pag'].to_numpy(dtype=float)
+            lon_rt = df_analise['lon_rt_pag'].to_numpy(dtype=float)
+            rt_index = obter_rt_index(df_mapeamento)
+            sem_coord_rt = np.isnan(lat_rt) | np.isnan(lon_rt)
+            if rt_index is not None and sem_coord_rt.any():
+                lat_idx, lon_idx = rt_index.coordenadas_de(df_analise.loc[sem_coord_rt, rep_col_p])
+                lat_rt[sem_coord_rt], lon_rt[sem_coord_rt] = lat_idx, lon_idx
+
+            # O KM CALCULADO É MANTIDO PARA A LÓGICA DE ROTERIZAÇÃO (SEÇÃO 3); NaN quando faltar coordenada
+            df_analise['KM_IDA_CALCULADO'] = haversine_km(
+                df_analise['lat_os_pag'].to_numpy(dtype=float), df_analise['lon_os_pag'].to_numpy(dtype=float), lat_rt, lon_rt
+            )
 
             # --- PREPARAÇÃO DO DATAFRAME DE MERGE DO MAPA ---
             
             # 1. Renomeia e Normaliza as colunas de chave no df_map_norm
             df_map_norm = df_mapeamento.copy()
             df_map_norm[MAP_REP_KEY] = df_map_norm[map_rep_col].astype(str).str.strip().str.upper()
-            df_map_norm[MAP_CITY_KEY] = df_map_norm[map_city_col].astype(str).str.strip().str.upper() 
+            df_map_norm[MAP_CITY_KEY] = normalizar_cidade(df_map_norm[map_city_col]).to_numpy()
             
             df_map_norm.rename(columns={
                 map_km_col: 'KM_IDA_MAP',
@@ -267,7 +264,7 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
             
             # 2. Renomeia e Normaliza as colunas de chave no df_analise (Custos)
             df_analise[MAP_REP_KEY] = df_analise[rep_col_p].astype(str).str.strip().str.upper()
-            df_analise[MAP_CITY_KEY] = df_analise[cidade_os_p].astype(str).str.strip().str.upper()
+            df_analise[MAP_CITY_KEY] = normalizar_cidade(df_analise[cidade_os_p]).to_numpy()
             
             # 3. Faz o merge usando as chaves padronizadas (MAP_REP_KEY, MAP_CITY_KEY)
             df_analise = pd.merge(df_analise, df_map_taxa, on=[MAP_REP_KEY, MAP_CITY_KEY], how='left', indicator=True)
@@ -303,12 +300,10 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
                 st.dataframe(capilaridade_df, use_container_width=True)
 
                 # Botão de download
-                csv_capilaridade = convert_df_to_csv(capilaridade_df)
-                st.download_button(
+                botao_download(
                     label="📥 Exportar Análise de Capilaridade (.csv)",
-                    data=csv_capilaridade,
+                    df=capilaridade_df,
                     file_name="analise_capilaridade.csv",
-                    mime="text/csv",
                     key="download_capilaridade"
                 )
 
@@ -411,8 +406,7 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
             }
             
             st.dataframe(df_display.style.applymap(lambda x: 'background-color: #791616' if isinstance(x, str) and 'ZERAR CUSTO' in x else '', subset=['AÇÃO RECOMENDADA']).format(format_dict), use_container_width=True)
-            csv = convert_df_to_csv(duplicadas)
-            st.download_button("📥 Exportar Duplicidades (.csv)", csv, "duplicidades.csv", "text/csv", key="download_duplicadas")
+            botao_download("📥 Exportar Duplicidades (.csv)", duplicadas, file_name="duplicidades.csv", key="download_duplicadas")
     except Exception as e:
         st.error(f"Erro ao processar Duplicidade: {e}")
 
@@ -489,7 +483,7 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
             col_rot1, col_rot2 = st.columns(2)
             datas_rot = df_analise['DATA_ANALISE'].dropna().unique()
             options_data = sorted(list(datas_rot)) if len(datas_rot) > 0 else []
-            data_roteiro = col_rot1.selectbox("Selecione a Data do Roteiro:", options=[None] + options_data, index=0, format_func=lambda x: x.strftime('%d/%m/%Y') if x and hasattr(x, 'strftime') else 'Selecione a Data...')
+            data_roteiro = col_rot1.selectbox("Selecione a Data do Roteiro:", options=[None] + options_data, index=0, format_func=lambda x: x.strftime('%d/%m/%Y') if x and hasattr(x, 'strftime') else 'Selecione a Data...', key="custos_data_roteiro", persist_state="session")
 
             if data_roteiro is None:
                 st.info("Selecione uma data acima para visualizar os roteiros daquele dia.")
@@ -497,7 +491,7 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
                 df_diario = df_analise[df_analise['DATA_ANALISE'] == data_roteiro].copy().dropna(subset=[rep_col_p, tec_col_p])
                 grupos_rot = df_diario.groupby([rep_col_p, tec_col_p]).size().reset_index(name='count')
                 grupos_rot['RT_TECNICO'] = grupos_rot[rep_col_p] + ' / ' + grupos_rot[tec_col_p]
-                rt_selecionado = col_rot2.selectbox("Selecione o RT/Técnico:", options=[None] + grupos_rot['RT_TECNICO'].tolist(), index=0)
+                rt_selecionado = col_rot2.selectbox("Selecione o RT/Técnico:", options=[None] + grupos_rot['RT_TECNICO'].tolist(), index=0, key="custos_rt_roteiro", persist_state="session")
 
                 if rt_selecionado is None:
                     st.info("Selecione um RT/Técnico para ver o roteiro e o custo.")
@@ -588,8 +582,7 @@ def analisar_custos(df_pagamento, df_agendamentos=None, df_mapeamento=None):
                         'DIFERENCA': 'R$ {:,.2f}',
                     }), use_container_width=True)
                     
-                    csv_rota = convert_df_to_csv(df_roterizado_clean)
-                    st.download_button("📥 Exportar Detalhe do Roteiro (.csv)", csv_rota, "detalhe_roteiro.csv", "text/csv", key="download_roteiro_detalhe")
+                    botao_download("📥 Exportar Detalhe do Roteiro (.csv)", df_roterizado_clean, file_name="detalhe_roteiro.csv", key="download_roteiro_detalhe")
     except Exception as e:
         st.error(f"Ocorreu um erro inesperado no Otimizador (Seção 3): {e}")
         import traceback
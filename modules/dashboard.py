@@ -1,9 +1,11 @@
 # modules/dashboard.py
 import streamlit as st
 import pandas as pd
-import plotly.express as px
+from modules.carregamento_tardio import modulo_tardio
 from modules.tutorial_helper import tutorial_button # Importando o tutorial
 
+px = modulo_tardio("plotly.express")
+
 # --- Cached Data Computation Functions ---
 
 @st.cache_data
@@ -2,7 +2,14 @@
 import streamlit as st
 import pandas as pd
 import io
-from modules.utils import convert_df_to_csv, adicionar_mensagem_assistente
+import hashlib
+from modules.geo import RTIndex
+import os
+from modules.gazetteer import Gazetteer, GazetteerMunicipios
+from modules.geocodificacao_reversa import GeocodificadorReverso
+from modules.geocodificacao import Geocodificador, PROVEDORES, ProvedorNominatim
+from modules.posicao_processada import hash_conteudo_bytes, limpar_cache_posicao
+from modules.utils import adicionar_mensagem_assistente
 from modules.resumo_relatorios import (
     gerar_resumo_ultima_posicao,
     gerar_resumo_generico,
@@ -68,6 +75,18 @@ def carregar_dataframe(arquivo, separador_padrao=',', forcar_cabecalho_relatorio
         forcar_cabecalho_relatorio=forcar_cabecalho_relatorio
     )
 
+def carregar_dataframe_bytes(conteudo, nome_arquivo, separador_padrao=',', forcar_cabecalho_relatorio=False):
+    """
+    Mesma leitura dos uploads a partir dos bytes de um arquivo em disco
+    (ex.: temp_summary.py), para que o resultado e o cache coincidam com os do app.
+    """
+    return _carregar_dataframe_from_bytes(
+        conteudo,
+        os.path.basename(nome_arquivo),
+        separador_padrao=separador_padrao,
+        forcar_cabecalho_relatorio=forcar_cabecalho_relatorio
+    )
+
 def _post_resumo_no_chat(resumo_texto, file_obj, resumo_key):
     if not resumo_texto or file_obj is None:
         return
@@ -82,7 +101,135 @@ def _render_botao_resumo(resumo_texto, button_key):
     if resumo_texto and st.button("Gerar resumo no chat", key=button_key, use_container_width=True):
         adicionar_mensagem_assistente(resumo_texto)
 
+@st.cache_resource(max_entries=4)
+def _construir_rt_index(hash_conteudo, _df_mapeamento):
+    """
+    Constrói o índice espacial dos RTs uma única vez por conteúdo de Mapeamento.
+    O DataFrame não entra na chave do cache; o hash do arquivo identifica o upload.
+    """
+    return RTIndex.from_mapeamento(_df_mapeamento, hash_conteudo)
+
+@st.cache_resource(max_entries=4)
+def _construir_gazetteer(hash_conteudo, _df_mapeamento):
+    """ Gazetteer de cidades do Mapeamento, construído uma vez por conteúdo de arquivo. """
+    return Gazetteer.from_mapeamento(_df_mapeamento, hash_conteudo)
+
+@st.cache_resource
+def obter_geocodificador_reverso():
+    """ Serviço de geocodificação reversa único por processo (árvore e cache compartilhados entre sessões). """
+    return GeocodificadorReverso()
+
+@st.cache_resource
+def obter_geocodificador():
+    """
+    Geocodificador de endereços único por processo (cache SQLite e gazetteer de
+    municípios compartilhados entre sessões). O provedor vem de
+    MERCURIO_GEOCODIFICADOR (padrão: nominatim; 'offline' usa só os municípios).
+    """
+    provedor = PROVEDORES.get(os.environ.get("MERCURIO_GEOCODIFICADOR", ""), ProvedorNominatim)
+    return Geocodificador(provedor(), GazetteerMunicipios.carregar())
+
+# Intervalo (s) entre as atualizações da aba enquanto a geocodificação roda
+INTERVALO_ATUALIZACAO_GEOCODIFICACAO = 2
+
+def iniciar_geocodificacao(chave, enderecos):
+    """
+    Inicia (ou retoma) em segundo plano a geocodificação dos endereços e guarda
+    a tarefa em st.session_state[chave]; a aba segue livre durante a execução.
+    """
+    st.session_state[chave] = obter_geocodificador().iniciar_tarefa(enderecos)
+
+def acompanhar_geocodificacao(chave, exibir):
+    """
+    Chama exibir(coordenadas) com as coordenadas já obtidas pela tarefa da
+    sessão (DataFrame 'lat', 'lon', 'origem' indexado pelo endereço). Enquanto
+    a tarefa roda, o trecho é um fragmento que se atualiza sozinho, com barra de
+    progresso e botão para interromper; ao terminar, a página é recarregada.
+    """
+    tarefa = st.session_state.get(chave)
+    if tarefa is None:
+        return
+    ativa_no_inicio = tarefa.ativa
+
+    def _exibir():
+        situacao = tarefa.situacao()
+        if situacao['ativa']:
+            total = max(situacao['total'], 1)
+            st.progress(situacao['feitos'] / total, text=f"Geocodificando endereços em segundo plano... {situacao['feitos']}/{situacao['total']}")
+            if st.button("Interromper geocodificação", key=f"{chave}_interromper"):
+                tarefa.cancelar()
+        elif ativa_no_inicio:
+            st.rerun()
+        elif situacao['erro']:
+            st.error(f"A geocodificação foi interrompida por um erro: {situacao['erro']}")
+        elif situacao['cancelada']:
+            st.warning(f"Geocodificação interrompida ({situacao['feitos']} de {situacao['total']} endereços novos). Clique novamente para continuar de onde parou.")
+        exibir(tarefa.resultado())
+
+    st.fragment(_exibir, run_every=INTERVALO_ATUALIZACAO_GEOCODIFICACAO if ativa_no_inicio else None)()
+
+def _hash_mapeamento(df_mapeamento):
+    """ Hash do conteúdo do Mapeamento na sessão (calculado a partir do DataFrame se preciso). """
+    if st.session_state.get('mapeamento_hash') is None or st.session_state.get('df_mapeamento') is not df_mapeamento:
+        return hashlib.md5(pd.util.hash_pandas_object(df_mapeamento, index=False).values.tobytes()).hexdigest()
+    return st.session_state.mapeamento_hash
+
+def obter_rt_index(df_mapeamento=None):
+    """
+    Retorna o RTIndex do Mapeamento carregado. Se o índice ainda não existir na
+    sessão (ex.: DataFrame carregado por outro caminho), ele é montado a partir
+    do DataFrame informado.
+    """
+    indice = st.session_state.get('rt_index')
+    if indice is not None:
+        return indice
+    if df_mapeamento is None:
+        df_mapeamento = st.session_state.get('df_mapeamento')
+    if df_mapeamento is None:
+        return None
+    hash_conteudo = _hash_mapeamento(df_mapeamento)
+    indice = _construir_rt_index(hash_conteudo, df_mapeamento)
+    st.session_state.rt_index = indice
+    st.session_state.mapeamento_hash = hash_conteudo
+    return indice
+
+def obter_gazetteer(df_mapeamento=None):
+    """ Retorna o Gazetteer de cidades do Mapeamento carregado (mesma lógica de obter_rt_index). """
+    gazetteer = st.session_state.get('gazetteer')
+    if gazetteer is not None:
+        return gazetteer
+    if df_mapeamento is None:
+        df_mapeamento = st.session_state.get('df_mapeamento')
+    if df_mapeamento is None:
+        return None
+    hash_conteudo = _hash_mapeamento(df_mapeamento)
+    gazetteer = _construir_gazetteer(hash_conteudo, df_mapeamento)
+    st.session_state.gazetteer = gazetteer
+    st.session_state.mapeamento_hash = hash_conteudo
+    return gazetteer
+
 # --- COMPONENTES DE UPLOAD (ATUALIZADOS) ---
+def manter_arquivos_enviados(chave, arquivos, rotulo="Arquivo em uso"):
+    """
+    Mantém na sessão o(s) arquivo(s) de um st.file_uploader de dentro de uma aba.
+    Só a aba aberta é renderizada, e o uploader perde o arquivo quando o usuário
+    troca de aba; a última seleção fica em st.session_state[chave] até ser
+    substituída ou removida. Retorna os arquivos atuais (ou None / lista vazia).
+    """
+    if arquivos:
+        st.session_state[chave] = arquivos
+        return arquivos
+    guardados = st.session_state.get(chave)
+    if not guardados:
+        return arquivos
+    nomes = [a.name for a in guardados] if isinstance(guardados, list) else [guardados.name]
+    col_nome, col_remover = st.columns([4, 1])
+    col_nome.caption(f"{rotulo}: {', '.join(nomes)}")
+    if col_remover.button("Remover", key=f"{chave}_remover"):
+        del st.session_state[chave]
+        return arquivos
+    return guardados
+
 def uploader_agendamentos(key=None):
     data_file = st.file_uploader("1. 📊 O.S (Agendamentos)", type=["csv", "xlsx", "xls"], key=key)
     if data_file:
@@ -101,6 +248,11 @@ def uploader_mapeamento(key=None):
     if map_file:
         try:
             st.session_state.df_mapeamento = carregar_dataframe(map_file, separador_padrao=',')
+            # Índice espacial dos RTs e gazetteer de cidades: construídos uma vez por conteúdo de arquivo
+            hash_conteudo = hashlib.md5(map_file.getvalue()).hexdigest()
+            st.session_state.mapeamento_hash = hash_conteudo
+            st.session_state.rt_index = _construir_rt_index(hash_conteudo, st.session_state.df_mapeamento)
+            st.session_state.gazetteer = _construir_gazetteer(hash_conteudo, st.session_state.df_mapeamento)
             st.success("Mapeamento carregado!")
             resumo = gerar_resumo_generico(st.session_state.df_mapeamento, "Mapeamento de RTs", map_file.name)
             st.session_state.resumo_mapeamento = resumo
@@ -167,8 +319,13 @@ def uploader_ultimaposicao(key=None):
     if posicao_file:
         try:
             st.session_state.df_ultimaposicao = carregar_dataframe(posicao_file, forcar_cabecalho_relatorio=True)
+            # Chave do processamento em cache, compartilhado entre o resumo e a aba Posição
+            st.session_state.ultimaposicao_hash = hash_conteudo_bytes(posicao_file.getvalue())
+            # Deixa a árvore de geocodificação reversa pronta para quando a aba Posição for aberta
+            obter_geocodificador_reverso().pre_carregar()
             st.success("Relatório de Última Posição carregado!")
-            resumo = gerar_resumo_ultima_posicao(st.session_state.df_ultimaposicao, posicao_file.name)
+            resumo = gerar_resumo_ultima_posicao(st.session_state.df_ultimaposicao, posicao_file.name,
+                                                 st.session_state.ultimaposicao_hash)
             st.session_state.resumo_ultimaposicao = resumo
             _post_resumo_no_chat(resumo, posicao_file, "ultimaposicao")
             _render_botao_resumo(resumo, f"btn_resumo_ultimaposicao_{key or 'default'}")
@@ -180,6 +337,11 @@ def uploader_cps(key=None):
     if cps_file:
         try:
             st.session_state.df_cps = carregar_dataframe(cps_file, forcar_cabecalho_relatorio=True)
+            # Arquivo novo: a geocodificação do anterior não vale para ele
+            hash_cps = hash_conteudo_bytes(cps_file.getvalue())
+            if st.session_state.get('cps_hash') != hash_cps:
+                st.session_state.pop('tarefa_geo_cps', None)
+                st.session_state.cps_hash = hash_cps
             st.success("Relatório CPS carregado!")
             resumo = gerar_resumo_cps(st.session_state.df_cps, cps_file.name)
             st.session_state.resumo_cps = resumo
@@ -204,9 +366,14 @@ def uploader_ordens_pendentes(key=None):
 # --- FUNÇÃO DE LIMPEZA (Atualizada para limpar o chat) ---
 def limpar_tudo():
     st.cache_data.clear()
+    _construir_rt_index.clear()
+    _construir_gazetteer.clear()
+    limpar_cache_posicao()
     chaves_para_limpar = [
-        "df_agendamentos", "df_mapeamento", "df_devolucao", 
-        "df_pagamento", "df_ativos", "df_backlog", "df_ultimaposicao", "df_cps",
+        "df_agendamentos", "df_mapeamento", "mapeamento_hash", "rt_index", "gazetteer", "df_devolucao", 
+        "df_pagamento", "df_ativos", "df_backlog", "df_ultimaposicao", "ultimaposicao_hash", "df_cps",
+        "df_backlog_resultado", "backlog_blocos", "backlog_pendente",
+        "pos_arquivo_ativos", "distancia_arquivos", "cps_hash", "tarefa_geo_cps", "tarefa_geo_viagens",
         "df_ordens_pendentes", # Adicionado para limpar o novo dataframe
         "display_history", "chat_history", # Limpa o chat tamb?m
         "resumo_agendamentos", "resumo_mapeamento", "resumo_devolucao", "resumo_pagamento",
@@ -1,7 +1,7 @@
 # modules/devolucao.py
 import streamlit as st
 import pandas as pd
-from modules.utils import convert_df_to_csv
+from modules.exportacao import botao_download
 from modules.tutorial_helper import tutorial_button # <-- NOVO IMPORT
 
 def ferramenta_devolucao(df):
@@ -25,10 +25,9 @@ def ferramenta_devolucao(df):
     st.warning(f"Foram encontradas {len(vencidas)} ordens vencidas.")
     
     clientes = sorted(vencidas[cliente_col].dropna().unique())
-    cliente = st.selectbox("Selecione o cliente:", options=clientes, index=None, placeholder="Pesquisar cliente...")
+    cliente = st.selectbox("Selecione o cliente:", options=clientes, index=None, placeholder="Pesquisar cliente...", key="dev_cliente", persist_state="session")
     
     if cliente:
         filtrado = vencidas[vencidas[cliente_col] == cliente]
         st.dataframe(filtrado)
-        csv = convert_df_to_csv(filtrado)
-        st.download_button(f"📥 Exportar {len(filtrado)} ordens de {cliente}", csv, f"vencidas_{cliente}.csv", "text/csv")
\ No newline at end of file
+        botao_download(f"📥 Exportar {len(filtrado)} ordens de {cliente}", filtrado, file_name=f"vencidas_{cliente}.csv")
\ No newline at end of file
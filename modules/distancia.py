@@ -1,11 +1,11 @@
 # modules/distancia.py
 import streamlit as st
 import pandas as pd
-from modules.utils import safe_to_numeric, convert_df_to_csv, convert_df_to_excel # Import convert_df_to_csv and convert_df_to_excel for download
+from modules.utils import safe_to_numeric
+from modules.exportacao import botao_download
 from modules.tutorial_helper import tutorial_button
-from geopy.geocoders import Nominatim
-from geopy.extra.rate_limiter import RateLimiter
-import pydeck as pdk
+from modules.data_loader import iniciar_geocodificacao, acompanhar_geocodificacao, manter_arquivos_enviados
+from modules.mapas import exibir_mapa
 
 # Helper function to find column names flexibly
 def _find_column(df_columns, possible_names):
@@ -19,35 +19,6 @@ def _find_column(df_columns, possible_names):
                 return col
     return None
 
-@st.cache_data
-def geocode_addresses(addresses):
-    """
-    Converte uma lista de endereços em coordenadas (latitude, longitude)
-    usando Nominatim e exibe uma barra de progresso.
-    """
-    geolocator = Nominatim(user_agent="mercurio_app")
-    geocode = RateLimiter(geolocator.geocode, min_delay_seconds=1)
-    
-    coords = {}
-    
-    progress_bar = st.progress(0, text="Geocodificando endereços...")
-    total = len(addresses)
-    
-    for i, address in enumerate(addresses):
-        try:
-            location = geocode(address)
-            if location:
-                coords[address] = {'lat': location.latitude, 'lon': location.longitude}
-            else:
-                coords[address] = {'lat': None, 'lon': None}
-        except Exception as e:
-            # st.warning(f"Não foi possível geocodificar o endereço '{address}': {e}") # Suppress warning for each failure
-            coords[address] = {'lat': None, 'lon': None}
-        
-        progress_bar.progress((i + 1) / total)
-    progress_bar.empty() # Clear the progress bar after completion
-    return coords
-
 def analisar_distancia_percorrida():
     """
     Seção para analisar e consolidar relatórios de distância percorrida.
@@ -61,6 +32,7 @@ def analisar_distancia_percorrida():
         accept_multiple_files=True,
         key="distancia_uploader"
     )
+    uploaded_files = manter_arquivos_enviados('distancia_arquivos', uploaded_files, "Relatórios em uso")
 
     if uploaded_files:
         if st.button("Analisar Distância Percorrida", use_container_width=True):
@@ -202,11 +174,6 @@ def analisar_distancia_percorrida():
                         df_filtered['Tempo Viagem'] = df_filtered['Tempo Viagem'].apply(parse_time_string)
                         
                         all_dfs.append(df_filtered)
-
-                        # Store geocoded data for mapping
-                        st.session_state.df_viagens_geocoded = pd.DataFrame() # Initialize
-                        st.session_state.df_viagens_geocoded_start = pd.DataFrame()
-                        st.session_state.df_viagens_geocoded_end = pd.DataFrame()
                     except Exception as e:
                         st.error(f"Erro ao processar o arquivo '{file.name}': {e}")
             
@@ -220,6 +187,7 @@ def analisar_distancia_percorrida():
             # --- Consolidação e Agregação ---
             df_final = pd.concat(all_dfs, ignore_index=True)
             st.session_state.df_distancia_detalhada = df_final.copy() # Store detailed trips
+            st.session_state.pop('tarefa_geo_viagens', None) # Coordenadas da análise anterior
             
             # Agrupar por placa e proprietário para somar a distância e o tempo totais de todo o período.
             df_agregado = df_final.groupby([col_placa_id, col_proprietario]).agg(
@@ -233,41 +201,6 @@ def analisar_distancia_percorrida():
             df_agregado = df_agregado.sort_values(by='Distancia_Total_Km', ascending=False)            
             st.session_state.df_distancia_agregada = df_agregado.copy()
 
-            # --- Geocodificação para Mapas ---
-            st.markdown("---")
-            st.subheader("Geocodificação de Localizações para Mapas")
-            st.info("As localizações inicial e final serão geocodificadas para exibição no mapa. Este processo pode levar alguns minutos.")
-            
-            if st.button("Geocodificar Localizações e Gerar Mapas", use_container_width=True):
-                with st.spinner("Geocodificando endereços..."):
-                    all_locations = pd.concat([df_final['Localização Inicial'].dropna(), df_final['Localização Final'].dropna()]).unique()
-                    
-                    if len(all_locations) > 0:
-                        address_coords = geocode_addresses(tuple(all_locations))
-                        
-                        df_final['lat_inicio'] = df_final['Localização Inicial'].map(lambda x: address_coords.get(x, {}).get('lat'))
-                        df_final['lon_inicio'] = df_final['Localização Inicial'].map(lambda x: address_coords.get(x, {}).get('lon'))
-                        df_final['lat_fim'] = df_final['Localização Final'].map(lambda x: address_coords.get(x, {}).get('lat'))
-                        df_final['lon_fim'] = df_final['Localização Final'].map(lambda x: address_coords.get(x, {}).get('lon'))
-
-                        st.session_state.df_viagens_geocoded = df_final.copy()
-                        
-                        # Prepare data for start and end point maps
-                        df_start_points = df_final.dropna(subset=['lat_inicio', 'lon_inicio']).rename(columns={'lat_inicio': 'lat', 'lon_inicio': 'lon'})
-                        df_end_points = df_final.dropna(subset=['lat_fim', 'lon_fim']).rename(columns={'lat_fim': 'lat', 'lon_fim': 'lon'})
-                        
-                        # Add tooltips for pydeck
-                        df_start_points['tooltip'] = df_start_points.apply(lambda row: f"Início: {row['Localização Inicial']}<br>Placa: {row[col_placa_id]}<br>Motorista: {row['Motorista']}", axis=1)
-                        df_end_points['tooltip'] = df_end_points.apply(lambda row: f"Fim: {row['Localização Final']}<br>Placa: {row[col_placa_id]}<br>Motorista: {row['Motorista']}", axis=1)
-
-                        st.session_state.df_viagens_geocoded_start = df_start_points
-                        st.session_state.df_viagens_geocoded_end = df_end_points
-                        st.success("Geocodificação concluída e dados de mapa preparados!")
-                    else:
-                        st.info("Nenhuma localização para geocodificar.")
-            else:
-                st.info("Clique no botão acima para geocodificar as localizações e visualizar os mapas.")
-
     # --- Display Results ---
     if 'df_distancia_agregada' in st.session_state and st.session_state.df_distancia_agregada is not None:
         # --- Helper functions for formatting ---
@@ -340,11 +273,10 @@ def analisar_distancia_percorrida():
         df_download_agregado = df_agregado.copy() # Use the aggregated DF for download
         df_download_agregado['Tempo_Total_Horas'] = df_download_agregado['Tempo_Total_Viagem'].dt.total_seconds() / 3600
         df_download_agregado['Tempo_Total_Viagem'] = df_download_agregado['Tempo_Total_Viagem'].apply(format_timedelta_with_days)
-        st.download_button(
+        botao_download(
             label="📥 Baixar Resumo Consolidado (CSV)",
-            data=convert_df_to_csv(df_download_agregado),
+            df=df_download_agregado,
             file_name='distancia_consolidada_resumo.csv',
-            mime='text/csv',
             key='download_consolidado'
         )
 
@@ -381,82 +313,69 @@ def analisar_distancia_percorrida():
         # Download for detailed trips
         df_download_detalhada = df_detalhada.copy() # Re-added this line
         df_download_detalhada['Tempo Viagem'] = df_download_detalhada['Tempo Viagem'].apply(format_timedelta_with_days)
-        st.download_button(
+        botao_download(
             label="📥 Baixar Detalhes das Viagens (XLSX)",
-            data=convert_df_to_excel(df_download_detalhada),
+            df=df_download_detalhada,
+            tipo='xlsx', opcoes={'sheet_name': 'Sheet1'},
             file_name='distancia_consolidada_detalhes.xlsx',
-            mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
             key='download_detalhes'
         )
 
-    # --- Map Display Section ---
-    if 'df_viagens_geocoded' in st.session_state and not st.session_state.df_viagens_geocoded.empty:
+    # --- Geocodificação para Mapas ---
+    if st.session_state.get('df_distancia_detalhada') is not None:
         st.markdown("---")
-        st.subheader("Mapas de Localizações de Viagem")
-        
-        df_start_points = st.session_state.df_viagens_geocoded_start
-        df_end_points = st.session_state.df_viagens_geocoded_end
-
-        if not df_start_points.empty:
-            st.markdown("#### Localizações Iniciais das Viagens")
-            # Filter out invalid coordinates (e.g., 0,0 or outside typical ranges)
-            df_start_points_valid = df_start_points[
-                (df_start_points['lat'].between(-90, 90)) &
-                (df_start_points['lon'].between(-180, 180)) &
-                ((df_start_points['lat'] != 0) | (df_start_points['lon'] != 0))
-            ]
-            if not df_start_points_valid.empty:
-                view_state_start = pdk.ViewState(
-                    latitude=df_start_points_valid['lat'].mean(),
-                    longitude=df_start_points_valid['lon'].mean(),
-                    zoom=8,
-                    pitch=0
-                )
-                layer_start = pdk.Layer(
-                    "ScatterplotLayer",
-                    data=df_start_points_valid,
-                    get_position=['lon', 'lat'],
-                    get_color=[0, 128, 255, 160], # Blue
-                    get_radius=100,
-                    pickable=True,
-                    tooltip={"html": "{tooltip}"}
-                )
-                st.pydeck_chart(pdk.Deck(
-                    map_style='mapbox://styles/mapbox/light-v9',
-                    initial_view_state=view_state_start,
-                    layers=[layer_start]
-                ))
+        st.subheader("Geocodificação de Localizações para Mapas")
+        st.info("As localizações inicial e final serão geocodificadas em segundo plano; os mapas são atualizados conforme as coordenadas chegam.")
+
+        df_viagens = st.session_state.df_distancia_detalhada
+        if st.button("Geocodificar Localizações e Gerar Mapas", use_container_width=True):
+            all_locations = pd.concat([df_viagens['Localização Inicial'].dropna(), df_viagens['Localização Final'].dropna()]).unique()
+            if len(all_locations) > 0:
+                iniciar_geocodificacao('tarefa_geo_viagens', all_locations)
             else:
-                st.info("Nenhuma localização inicial válida para exibir no mapa.")
-
-        if not df_end_points.empty:
-            st.markdown("#### Localizações Finais das Viagens")
-            # Filter out invalid coordinates
-            df_end_points_valid = df_end_points[
-                (df_end_points['lat'].between(-90, 90)) &
-                (df_end_points['lon'].between(-180, 180)) &
-                ((df_end_points['lat'] != 0) | (df_end_points['lon'] != 0))
-            ]
-            if not df_end_points_valid.empty:
-                view_state_end = pdk.ViewState(
-                    latitude=df_end_points_valid['lat'].mean(),
-                    longitude=df_end_points_valid['lon'].mean(),
-                    zoom=8,
-                    pitch=0
-                )
-                layer_end = pdk.Layer(
-                    "ScatterplotLayer",
-                    data=df_end_points_valid,
-                    get_position=['lon', 'lat'],
-                    get_color=[255, 0, 0, 160], # Red
-                    get_radius=100,
-                    pickable=True,
-                    tooltip={"html": "{tooltip}"}
-                )
-                st.pydeck_chart(pdk.Deck(
-                    map_style='mapbox://styles/mapbox/light-v9',
-                    initial_view_state=view_state_end,
-                    layers=[layer_end]
-                ))
-            else:
-                st.info("Nenhuma localização final válida para exibir no mapa.")
+                st.info("Nenhuma localização para geocodificar.")
+
+        if 'tarefa_geo_viagens' in st.session_state:
+            acompanhar_geocodificacao('tarefa_geo_viagens', lambda coordenadas: _exibir_mapas_viagens(df_viagens, coordenadas))
+        else:
+            st.info("Clique no botão acima para geocodificar as localizações e visualizar os mapas.")
+
+
+def _exibir_mapas_viagens(df_viagens, coordenadas):
+    """ Mapas dos pontos inicial e final das viagens com as coordenadas obtidas até o momento. """
+    col_placa_id = 'Placa / Identificação'
+    df_final = df_viagens.copy()
+    df_final['lat_inicio'] = df_final['Localização Inicial'].map(coordenadas['lat'])
+    df_final['lon_inicio'] = df_final['Localização Inicial'].map(coordenadas['lon'])
+    df_final['lat_fim'] = df_final['Localização Final'].map(coordenadas['lat'])
+    df_final['lon_fim'] = df_final['Localização Final'].map(coordenadas['lon'])
+
+    # Prepare data for start and end point maps
+    df_start_points = df_final.dropna(subset=['lat_inicio', 'lon_inicio']).rename(columns={'lat_inicio': 'lat', 'lon_inicio': 'lon'})
+    df_end_points = df_final.dropna(subset=['lat_fim', 'lon_fim']).rename(columns={'lat_fim': 'lat', 'lon_fim': 'lon'})
+
+    # Tooltips do mapa
+    sufixo_inicio = "<br>Placa: " + df_start_points[col_placa_id].astype(str) + "<br>Motorista: " + df_start_points['Motorista'].astype(str)
+    sufixo_fim = "<br>Placa: " + df_end_points[col_placa_id].astype(str) + "<br>Motorista: " + df_end_points['Motorista'].astype(str)
+    df_start_points['tooltip'] = "Início: " + df_start_points['Localização Inicial'].astype(str) + sufixo_inicio
+    df_end_points['tooltip'] = "Fim: " + df_end_points['Localização Final'].astype(str) + sufixo_fim
+
+    if df_start_points.empty and df_end_points.empty:
+        return
+
+    st.markdown("---")
+    st.subheader("Mapas de Localizações de Viagem")
+
+    if not df_start_points.empty:
+        st.markdown("#### Localizações Iniciais das Viagens")
+        exibir_mapa(
+            df_start_points, key="mapa_viagens_inicio", cor=[0, 128, 255], coluna_rotulo='tooltip',
+            raio_metros=100, zoom=8, map_style='mapbox://styles/mapbox/light-v9',
+        )
+
+    if not df_end_points.empty:
+        st.markdown("#### Localizações Finais das Viagens")
+        exibir_mapa(
+            df_end_points, key="mapa_viagens_fim", cor=[255, 0, 0], coluna_rotulo='tooltip',
+            raio_metros=100, zoom=8, map_style='mapbox://styles/mapbox/light-v9',
+        )
@@ -0,0 +1,188 @@
+# modules/exportacao.py
+"""
+Exportação de DataFrames para Excel (.xlsx) com xlsxwriter.
+
+O destaque visual é feito por regras de formatação condicional aplicadas a
+faixas inteiras (colunas ou linhas), sem estilizar célula por célula. As
+linhas são gravadas em ordem; acima de LINHAS_ARQUIVO_TEMPORARIO o workbook é
+montado em modo constant_memory num arquivo temporário em disco, mantendo
+apenas uma linha por vez em memória.
+
+botao_download é o ponto de entrada das telas: o download só serializa os
+dados quando clicado.
+"""
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+from functools import partial
+
+import pandas as pd
+import streamlit as st
+
+from modules.carregamento_tardio import modulo_tardio
+from modules.utils import convert_df_to_csv_em_blocos
+
+# xlsxwriter só é importado na primeira exportação .xlsx
+xlsxwriter = modulo_tardio("xlsxwriter")
+xlsxwriter_utility = modulo_tardio("xlsxwriter.utility")
+
+# Acima deste nº de linhas o arquivo é montado em disco (constant_memory)
+LINHAS_ARQUIVO_TEMPORARIO = 50000
+# Linhas convertidas por vez (limita a cópia em objetos Python)
+LINHAS_POR_BLOCO = 10000
+
+# Cores usadas nas exportações do app
+COR_CINZA_CLARO = '#E0E0E0'
+COR_AMARELO_CLARO = '#FFFFE0'
+
+# Mesmo cabeçalho gerado pelo pandas.to_excel
+FORMATO_CABECALHO = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+
+def _linhas_para_escrita(df):
+    """Linhas do DataFrame como objetos Python, com NaN/NaT convertidos em célula vazia."""
+    for inicio in range(0, len(df), LINHAS_POR_BLOCO):
+        bloco = df.iloc[inicio:inicio + LINHAS_POR_BLOCO]
+        yield from bloco.astype(object).where(bloco.notna(), None).to_numpy()
+
+
+def df_para_excel(df, sheet_name='Planilha', colunas_destaque=None, cor_colunas=COR_CINZA_CLARO,
+                  linha_destaque=None, cor_linhas=COR_AMARELO_CLARO, linhas_arquivo_temporario=LINHAS_ARQUIVO_TEMPORARIO):
+    """
+    Converte o DataFrame em bytes de um arquivo .xlsx.
+
+    colunas_destaque: colunas preenchidas com cor_colunas (cabeçalho e dados).
+    linha_destaque: tupla (coluna, valor); as linhas em que a coluna é igual ao
+    valor são preenchidas com cor_linhas em todas as colunas.
+    """
+    usar_disco = len(df) > linhas_arquivo_temporario
+    opcoes = {
+        'strings_to_formulas': False, 'strings_to_urls': False,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    }
+    if usar_disco:
+        arquivo = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+        arquivo.close()
+        destino = arquivo.name
+        opcoes['constant_memory'] = True
+    else:
+        destino = io.BytesIO()
+        opcoes['in_memory'] = True
+
+    try:
+        workbook = xlsxwriter.Workbook(destino, opcoes)
+        worksheet = workbook.add_worksheet(sheet_name[:31])
+        formato_cabecalho = workbook.add_format(FORMATO_CABECALHO)
+
+        n_linhas, n_colunas = len(df), len(df.columns)
+        worksheet.write_row(0, 0, [str(c) for c in df.columns], formato_cabecalho)
+        for i, linha in enumerate(_linhas_para_escrita(df), start=1):
+            worksheet.write_row(i, 0, linha)
+
+        if colunas_destaque:
+            formato_coluna = workbook.add_format({'bg_color': cor_colunas, 'pattern': 1})
+            for coluna in colunas_destaque:
+                if coluna in df.columns:
+                    idx = df.columns.get_loc(coluna)
+                    worksheet.conditional_format(0, idx, n_linhas, idx, {
+                        'type': 'formula', 'criteria': 'TRUE', 'format': formato_coluna,
+                    })
+
+        if linha_destaque and linha_destaque[0] in df.columns and n_linhas > 0 and n_colunas > 0:
+            coluna, valor = linha_destaque
+            letra = xlsxwriter_utility.xl_col_to_name(df.columns.get_loc(coluna))
+            valor_formula = '"{}"'.format(str(valor).replace('"', '""')) if isinstance(valor, str) else valor
+            formato_linha = workbook.add_format({'bg_color': cor_linhas, 'pattern': 1})
+            worksheet.conditional_format(1, 0, n_linhas, n_colunas - 1, {
+                'type': 'formula', 'criteria': f'=${letra}2={valor_formula}', 'format': formato_linha,
+            })
+
+        workbook.close()
+        if not usar_disco:
+            return destino.getvalue()
+        with open(destino, 'rb') as f:
+            return f.read()
+    finally:
+        if usar_disco and os.path.exists(destino):
+            os.remove(destino)
+
+
+# --- Serviço de exportação sob demanda ---
+# Os botões recebem uma função em vez dos bytes: a serialização só acontece no
+# clique e o resultado fica em cache por (hash do conteúdo, tipo, opções).
+
+MIME_TIPOS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'zip': 'application/zip',
+}
+
+EXPORTADORES = {
+    'csv': lambda df, **opcoes: convert_df_to_csv_em_blocos(df),
+    'xlsx': df_para_excel,
+}
+_EXTENSOES = {'csv': 'csv', 'xlsx': 'xlsx'}
+
+
+def registrar_exportador(tipo, funcao, extensao='xlsx'):
+    """Registra um formato de exportação (funcao(df, **opcoes) -> bytes) com a extensão do arquivo."""
+    EXPORTADORES[tipo] = funcao
+    MIME_TIPOS.setdefault(tipo, MIME_TIPOS.get(extensao, 'application/octet-stream'))
+    _EXTENSOES[tipo] = extensao
+
+
+def hash_dataframe(df):
+    """Hash do conteúdo (colunas, valores e índice) do DataFrame."""
+    h = hashlib.md5(repr(list(df.columns)).encode('utf-8'))
+    try:
+        h.update(pd.util.hash_pandas_object(df).to_numpy().tobytes())
+    except TypeError:
+        # Células não hasheáveis (listas, dicts...): usa a representação textual
+        h.update(pd.util.hash_pandas_object(df.astype(str)).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _exportar_em_cache(hash_dados, tipo, chave_opcoes, _df, _opcoes):
+    return EXPORTADORES[tipo](_df, **_opcoes)
+
+
+def exportar(df, tipo='csv', **opcoes):
+    """Bytes do DataFrame no formato pedido, reaproveitando exportações idênticas já feitas."""
+    return _exportar_em_cache(hash_dataframe(df), tipo, repr(sorted(opcoes.items())), df, opcoes)
+
+
+def exportar_formatos(df, tipos, nome_base='dados', **opcoes):
+    """Vários formatos numa única execução, empacotados num .zip (nome_base.<extensão>)."""
+    hash_dados = hash_dataframe(df)
+    chave_opcoes = repr(sorted(opcoes.items()))
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as arquivo_zip:
+        for tipo in tipos:
+            dados = _exportar_em_cache(hash_dados, tipo, chave_opcoes, df, opcoes)
+            arquivo_zip.writestr(f"{nome_base}.{_EXTENSOES.get(tipo, tipo)}", dados)
+    return saida.getvalue()
+
+
+def botao_download(label, df, tipo='csv', file_name=None, opcoes=None, **kwargs):
+    """
+    st.download_button que só serializa o DataFrame quando clicado.
+
+    tipo: 'csv', 'xlsx', um tipo registrado ou uma tupla de tipos (gera um .zip
+    com todos os formatos). opcoes: repassadas ao exportador (ex.: sheet_name).
+    Demais argumentos vão direto para st.download_button.
+    """
+    opcoes = opcoes or {}
+    if isinstance(tipo, (tuple, list)):
+        nome_base = os.path.splitext(file_name or 'dados.zip')[0]
+        dados = partial(exportar_formatos, df, tuple(tipo), nome_base, **opcoes)
+        mime = MIME_TIPOS['zip']
+    else:
+        dados = partial(exportar, df, tipo, **opcoes)
+        mime = MIME_TIPOS.get(tipo, 'application/octet-stream')
+    kwargs.setdefault('mime', mime)
+    # on_click="ignore": o clique não reexecuta o script (o botão continua válido dentro de blocos de st.button)
+    kwargs.setdefault('on_click', 'ignore')
+    return st.download_button(label=label, data=dados, file_name=file_name, **kwargs)
@@ -0,0 +1,290 @@
+# modules/gazetteer.py
+import csv
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from modules.geo import para_float
+
+
+def normalizar_cidade(serie):
+    """
+    Chave de cidade para cruzamentos: sem acentos, maiúsculas e com espaços
+    internos colapsados ("São  Paulo " -> "SAO PAULO").
+    """
+    return (
+        pd.Series(serie).astype(str)
+        .str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+        .str.upper().str.split().str.join(' ')
+    )
+
+
+def normalizar_cidade_valor(cidade):
+    """Versão escalar de normalizar_cidade."""
+    texto = unicodedata.normalize('NFKD', str(cidade)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(texto.upper().split())
+
+
+def _chave_uf(cidade_norm, uf_norm):
+    return cidade_norm + '/' + uf_norm
+
+
+def identificar_colunas_atendimento(df_map):
+    """Colunas de cidade, UF e coordenadas de atendimento do Mapeamento."""
+    colunas_lower = {str(c).lower().strip(): c for c in df_map.columns}
+    cidade = colunas_lower.get('nm_cidade_atendimento', next((c for k, c in colunas_lower.items() if 'cidade' in k and 'atendimento' in k), None))
+    uf = next((c for k, c in colunas_lower.items() if ('uf' in k or 'estado' in k) and 'atendimento' in k), None)
+    lat = next((c for k, c in colunas_lower.items() if ('latitude' in k or 'lat' in k) and 'atendimento' in k), None)
+    lon = next((c for k, c in colunas_lower.items() if ('longitude' in k or 'lon' in k) and 'atendimento' in k), None)
+    return {'cidade': cidade, 'uf': uf, 'lat': lat, 'lon': lon}
+
+
+class Gazetteer:
+    """
+    Índice de cidades do Mapeamento: chave normalizada (sem acento, maiúscula,
+    qualificada pela UF quando houver) -> coordenada de atendimento e linhas
+    do Mapeamento. Construído uma vez por upload (ver data_loader.obter_gazetteer).
+
+    A coordenada de cada cidade é a da primeira linha válida do Mapeamento.
+    """
+
+    def __init__(self, cidades, lat, lon, ufs=None, hash_conteudo=None):
+        self.hash_conteudo = hash_conteudo
+        df = pd.DataFrame({
+            'CIDADE_KEY': normalizar_cidade(cidades).to_numpy(),
+            'UF_KEY': normalizar_cidade(ufs).to_numpy() if ufs is not None else '',
+            'lat': para_float(pd.Series(lat)).to_numpy(),
+            'lon': para_float(pd.Series(lon)).to_numpy(),
+        })
+        df['LINHA'] = np.arange(len(df))
+        df = df[df['CIDADE_KEY'].ne('') & df['CIDADE_KEY'].ne('NAN')]
+        validas = df.dropna(subset=['lat', 'lon'])
+
+        # Linhas do Mapeamento por chave (cidade e cidade/UF)
+        self.linhas_por_chave = {chave: linhas.to_numpy() for chave, linhas in df.groupby('CIDADE_KEY')['LINHA']}
+        com_uf = df[df['UF_KEY'].ne('') & df['UF_KEY'].ne('NAN')]
+        chaves_uf = com_uf['CIDADE_KEY'] + '/' + com_uf['UF_KEY']
+        self.linhas_por_chave.update({chave: linhas.to_numpy() for chave, linhas in com_uf['LINHA'].groupby(chaves_uf.to_numpy())})
+
+        # Coordenadas: primeira linha válida por cidade e por cidade/UF
+        primeiras = validas.drop_duplicates(subset=['CIDADE_KEY'])
+        self.pontos = primeiras.set_index('CIDADE_KEY')[['lat', 'lon', 'LINHA']]
+        validas_uf = validas[validas['UF_KEY'].ne('') & validas['UF_KEY'].ne('NAN')]
+        pontos_uf = validas_uf.assign(CHAVE=validas_uf['CIDADE_KEY'] + '/' + validas_uf['UF_KEY']).drop_duplicates(subset=['CHAVE'])
+        self.pontos_uf = pontos_uf.set_index('CHAVE')[['lat', 'lon', 'LINHA']]
+
+        self._dict_pontos = {k: tuple(v) for k, v in zip(self.pontos.index, self.pontos[['lat', 'lon']].to_numpy())}
+        self._dict_pontos.update({k: tuple(v) for k, v in zip(self.pontos_uf.index, self.pontos_uf[['lat', 'lon']].to_numpy())})
+
+    @classmethod
+    def from_mapeamento(cls, df_map, hash_conteudo=None):
+        """Monta o gazetteer a partir do Mapeamento. Retorna None se faltarem colunas."""
+        cols = identificar_colunas_atendimento(df_map)
+        if not all([cols['cidade'], cols['lat'], cols['lon']]):
+            return None
+        ufs = df_map[cols['uf']] if cols['uf'] else None
+        return cls(df_map[cols['cidade']], df_map[cols['lat']], df_map[cols['lon']], ufs=ufs, hash_conteudo=hash_conteudo)
+
+    def __len__(self):
+        return len(self.pontos)
+
+    def __contains__(self, cidade):
+        return normalizar_cidade_valor(cidade) in self._dict_pontos
+
+    def lookup(self, cidade, uf=None):
+        """Coordenada (lat, lon) da cidade em O(1); usa a UF quando informada. None se não encontrada."""
+        chave = normalizar_cidade_valor(cidade)
+        if uf is not None and not pd.isna(uf):
+            encontrado = self._dict_pontos.get(_chave_uf(chave, normalizar_cidade_valor(uf)))
+            if encontrado is not None:
+                return encontrado
+        return self._dict_pontos.get(chave)
+
+    def linhas(self, cidade, uf=None):
+        """Posições (linhas) do Mapeamento para a cidade (e UF, se informada)."""
+        chave = normalizar_cidade_valor(cidade)
+        if uf is not None and not pd.isna(uf):
+            chave = _chave_uf(chave, normalizar_cidade_valor(uf))
+        return self.linhas_por_chave.get(chave, np.array([], dtype=np.int64))
+
+    def lookup_series(self, cidades, ufs=None):
+        """
+        Busca vetorizada: DataFrame alinhado à entrada com lat, lon e LINHA
+        (primeira linha do Mapeamento). Com UF, a chave cidade/UF tem prioridade
+        e a cidade sozinha serve de fallback.
+        """
+        cidades = pd.Series(cidades)
+        chaves = normalizar_cidade(cidades)
+        resultado = self.pontos.reindex(chaves.to_numpy())
+        resultado.index = cidades.index
+        if ufs is not None:
+            chaves_uf = chaves + '/' + normalizar_cidade(pd.Series(ufs).fillna('')).to_numpy()
+            por_uf = self.pontos_uf.reindex(chaves_uf.to_numpy())
+            por_uf.index = cidades.index
+            resultado = por_uf.fillna(resultado)
+        return resultado
+
+
+# --- Municípios brasileiros (fallback offline da geocodificação de endereços) ---
+
+# Planilha completa do IBGE (colunas nome, latitude, longitude e uf ou codigo_uf), se disponível
+CAMINHO_MUNICIPIOS = os.environ.get("MERCURIO_MUNICIPIOS_CSV", os.path.join("dados", "municipios.csv"))
+
+CODIGOS_UF = {
+    11: 'RO', 12: 'AC', 13: 'AM', 14: 'RR', 15: 'PA', 16: 'AP', 17: 'TO', 21: 'MA', 22: 'PI',
+    23: 'CE', 24: 'RN', 25: 'PB', 26: 'PE', 27: 'AL', 28: 'SE', 29: 'BA', 31: 'MG', 32: 'ES',
+    33: 'RJ', 35: 'SP', 41: 'PR', 42: 'SC', 43: 'RS', 50: 'MS', 51: 'MT', 52: 'GO', 53: 'DF',
+}
+ESTADOS = {
+    'RONDONIA': 'RO', 'ACRE': 'AC', 'AMAZONAS': 'AM', 'RORAIMA': 'RR', 'PARA': 'PA', 'AMAPA': 'AP',
+    'TOCANTINS': 'TO', 'MARANHAO': 'MA', 'PIAUI': 'PI', 'CEARA': 'CE', 'RIO GRANDE DO NORTE': 'RN',
+    'PARAIBA': 'PB', 'PERNAMBUCO': 'PE', 'ALAGOAS': 'AL', 'SERGIPE': 'SE', 'BAHIA': 'BA',
+    'MINAS GERAIS': 'MG', 'ESPIRITO SANTO': 'ES', 'RIO DE JANEIRO': 'RJ', 'SAO PAULO': 'SP',
+    'PARANA': 'PR', 'SANTA CATARINA': 'SC', 'RIO GRANDE DO SUL': 'RS', 'MATO GROSSO DO SUL': 'MS',
+    'MATO GROSSO': 'MT', 'GOIAS': 'GO', 'DISTRITO FEDERAL': 'DF', 'FEDERAL DISTRICT': 'DF',
+}
+SIGLAS_UF = set(CODIGOS_UF.values())
+
+# Partes de um endereço: vírgula, ponto e vírgula, barra e " - " (o hífen sem espaços faz parte de nomes)
+_SEPARADORES_ENDERECO = re.compile(r"\s*(?:[,;/|]|\s-\s)\s*")
+_CIDADE_HIFEN_UF = re.compile(r"^(.+?)\s*-\s*([A-Z]{2})$")
+_SEM_CIDADE = re.compile(r"^[\d\s.-]*$")  # CEP, número
+
+
+def _uf_da_parte(parte):
+    if parte in SIGLAS_UF:
+        return parte
+    return ESTADOS.get(parte)
+
+
+def partes_endereco(endereco):
+    """
+    Partes normalizadas de um endereço, sem país, CEP e números, com
+    "Cidade-UF" separado em duas partes.
+    """
+    partes = []
+    for parte in _SEPARADORES_ENDERECO.split(normalizar_cidade_valor(endereco)):
+        if _SEM_CIDADE.match(parte) or parte in ('BRASIL', 'BRAZIL'):
+            continue
+        cidade_uf = _CIDADE_HIFEN_UF.match(parte)
+        if cidade_uf and cidade_uf.group(2) in SIGLAS_UF:
+            partes.extend(cidade_uf.groups())
+        else:
+            partes.append(parte)
+    return partes
+
+
+def _posicao_uf(partes):
+    """Índice e sigla da última parte que é uma UF (sigla ou nome do estado); (None, None) se não houver."""
+    for i in range(len(partes) - 1, -1, -1):
+        uf = _uf_da_parte(partes[i])
+        if uf:
+            return i, uf
+    return None, None
+
+
+def extrair_cidade_uf(endereco):
+    """
+    (cidade, UF) lidos do texto do endereço ("Rua X, 10 - Centro, Campinas - SP, 13010-000"):
+    a última parte que é uma UF e a parte anterior a ela. None onde não for possível identificar.
+    """
+    partes = partes_endereco(endereco)
+    i, uf = _posicao_uf(partes)
+    if uf is None:
+        return None, None
+    return (partes[i - 1] if i > 0 and partes[i - 1] not in SIGLAS_UF else None), uf
+
+
+class GazetteerMunicipios:
+    """
+    Coordenadas de municípios brasileiros por nome normalizado e UF, para
+    localizar um endereço pela cidade escrita no texto quando o provedor de
+    geocodificação não o encontra (ou está indisponível).
+
+    Fonte: a planilha do IBGE em CAMINHO_MUNICIPIOS, quando existir (coordenada
+    da sede); senão, as localidades brasileiras da base offline do
+    reverse_geocoder (localidades com mais de 1000 habitantes, cerca de 1.950
+    municípios), em que a coordenada é a da localidade homônima do município
+    ou, na falta dela, a de um de seus distritos: uma aproximação.
+    """
+
+    def __init__(self, nomes, ufs, lat, lon, fonte=""):
+        self.fonte = fonte
+        self._por_cidade_uf = {}
+        contagem = {}
+        primeiro = {}
+        for nome, uf, la, lo in zip(nomes, ufs, lat, lon):
+            cidade = normalizar_cidade_valor(nome)
+            chave = _chave_uf(cidade, uf)
+            if chave in self._por_cidade_uf:
+                continue
+            self._por_cidade_uf[chave] = (float(la), float(lo))
+            contagem[cidade] = contagem.get(cidade, 0) + 1
+            primeiro.setdefault(cidade, (float(la), float(lo)))
+        # Sem UF, só vale o nome que existe em um único estado
+        self._por_cidade = {cidade: primeiro[cidade] for cidade, n in contagem.items() if n == 1}
+
+    @classmethod
+    def from_csv(cls, caminho=CAMINHO_MUNICIPIOS):
+        df = pd.read_csv(caminho)
+        df.columns = [str(c).strip().lower() for c in df.columns]
+        if 'uf' in df.columns:
+            ufs = normalizar_cidade(df['uf'])
+        else:
+            ufs = df['codigo_uf'].map(CODIGOS_UF)
+        df = df.assign(uf=ufs, latitude=para_float(df['latitude']), longitude=para_float(df['longitude']))
+        df = df.dropna(subset=['nome', 'uf', 'latitude', 'longitude'])
+        return cls(df['nome'], df['uf'], df['latitude'], df['longitude'], fonte=os.path.basename(caminho))
+
+    @classmethod
+    def from_reverse_geocoder(cls):
+        import reverse_geocoder
+        caminho = os.path.join(os.path.dirname(reverse_geocoder.__file__), 'rg_cities1000.csv')
+        localidades = []
+        with open(caminho, encoding='utf-8') as f:
+            for linha in csv.DictReader(f):
+                uf = ESTADOS.get(normalizar_cidade_valor(linha['admin1'])) if linha['cc'] == 'BR' else None
+                if uf:
+                    # admin2 é o município; a localidade (name) pode ser um distrito dele
+                    municipio = linha['admin2'] or linha['name']
+                    homonima = normalizar_cidade_valor(linha['name']) == normalizar_cidade_valor(municipio)
+                    localidades.append((not homonima, municipio, uf, linha['lat'], linha['lon']))
+        # A localidade com o nome do município (em geral a sede) vem antes dos distritos;
+        # sem ela, vale a primeira listada, que pode ficar longe da sede
+        localidades.sort(key=lambda item: item[0])
+        _, nomes, ufs, lat, lon = zip(*localidades) if localidades else ((),) * 5
+        return cls(nomes, ufs, lat, lon, fonte="reverse_geocoder")
+
+    @classmethod
+    def carregar(cls):
+        """Planilha do IBGE se existir; senão a base do reverse_geocoder."""
+        if os.path.exists(CAMINHO_MUNICIPIOS):
+            return cls.from_csv(CAMINHO_MUNICIPIOS)
+        return cls.from_reverse_geocoder()
+
+    def __len__(self):
+        return len(self._por_cidade_uf)
+
+    def localizar(self, endereco):
+        """
+        (lat, lon) do município citado no endereço, ou None. Com UF no texto,
+        procura da direita para a esquerda uma parte que seja município dessa
+        UF e, por último, a própria parte da UF ("São Paulo"); sem UF, uma
+        parte que seja o nome de um município único no país.
+        """
+        partes = partes_endereco(endereco)
+        i, uf = _posicao_uf(partes)
+        if uf is not None:
+            for parte in partes[:i][::-1] + [partes[i]]:
+                encontrado = self._por_cidade_uf.get(_chave_uf(parte, uf))
+                if encontrado is not None:
+                    return encontrado
+            return None
+        for parte in reversed(partes):
+            encontrado = self._por_cidade.get(parte)
+            if encontrado is not None:
+                return encontrado
+        return None
@@ -0,0 +1,244 @@
+# modules/geo.py
+import re
+
+import numpy as np
+import pandas as pd
+
+from modules.carregamento_tardio import modulo_disponivel
+
+# O scikit-learn (~1 s de importação) só é carregado ao montar o primeiro índice
+SKLEARN_AVAILABLE = modulo_disponivel("sklearn")
+
+# Mesmo raio médio usado pela biblioteca haversine (Unit.KILOMETERS)
+RAIO_TERRA_KM = 6371.0088
+
+# Limite de memória (em bytes) da matriz de distâncias de cada bloco
+MEMORIA_BLOCO_BYTES = 64 * 1024 * 1024
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Distância Haversine em km entre arrays de coordenadas (graus).
+    Aceita broadcasting do NumPy: (n, 1) x (1, m) gera a matriz n x m.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon * 0.5) ** 2
+    return 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def k_mais_proximos(lat_q, lon_q, lat_ref, lon_ref, k, tamanho_bloco=None):
+    """
+    Para cada ponto de consulta, retorna os índices e as distâncias (km) dos k
+    pontos de referência mais próximos, em ordem crescente de distância.
+
+    O cálculo é feito em blocos de linhas para limitar a memória da matriz
+    de distâncias (blocos x referências).
+    """
+    lat_q = np.asarray(lat_q, dtype=np.float64)
+    lon_q = np.asarray(lon_q, dtype=np.float64)
+    lat_ref = np.asarray(lat_ref, dtype=np.float64)
+    lon_ref = np.asarray(lon_ref, dtype=np.float64)
+
+    n, m = len(lat_q), len(lat_ref)
+    k = min(int(k), m)
+    indices = np.empty((n, k), dtype=np.int64)
+    distancias = np.empty((n, k), dtype=np.float64)
+    if n == 0 or k == 0:
+        return indices, distancias
+
+    if tamanho_bloco is None:
+        tamanho_bloco = max(1, MEMORIA_BLOCO_BYTES // (8 * m))
+
+    # Radianos e cossenos calculados uma única vez; o ranking usa o termo "a" do
+    # haversine (monotônico com a distância) e só os k escolhidos viram km.
+    lat_q_rad, lon_q_rad = np.radians(lat_q), np.radians(lon_q)
+    lat_ref_rad, lon_ref_rad = np.radians(lat_ref)[np.newaxis, :], np.radians(lon_ref)[np.newaxis, :]
+    cos_q, cos_ref = np.cos(lat_q_rad), np.cos(lat_ref_rad)
+    for inicio in range(0, n, tamanho_bloco):
+        fim = min(inicio + tamanho_bloco, n)
+        dlat = lat_ref_rad - lat_q_rad[inicio:fim, np.newaxis]
+        dlon = lon_ref_rad - lon_q_rad[inicio:fim, np.newaxis]
+        a = np.sin(dlat * 0.5) ** 2 + cos_q[inicio:fim, np.newaxis] * cos_ref * np.sin(dlon * 0.5) ** 2
+        if k < m:
+            candidatos = np.argpartition(a, k - 1, axis=1)[:, :k]
+        else:
+            candidatos = np.broadcast_to(np.arange(m), a.shape)
+        a_candidatos = np.take_along_axis(a, candidatos, axis=1)
+        # Desempate pela ordem original do RT (mesmo critério do nsmallest)
+        ordem = np.lexsort((candidatos, a_candidatos), axis=1)
+        indices[inicio:fim] = np.take_along_axis(candidatos, ordem, axis=1)
+        a_ordenado = np.take_along_axis(a_candidatos, ordem, axis=1)
+        distancias[inicio:fim] = 2 * RAIO_TERRA_KM * np.arcsin(np.sqrt(np.clip(a_ordenado, 0.0, 1.0)))
+
+    return indices, distancias
+
+
+def rts_mais_proximos(df_os, lat_col, lon_col, indice, k=2, busca=None):
+    """
+    Calcula, de uma só vez, os k RTs mais próximos de cada O.S. usando o RTIndex.
+
+    Retorna um DataFrame com k linhas por O.S. contendo RANKING, REPRESENTANTE,
+    CIDADE_RT e DISTANCIA_KM seguidos das colunas originais da O.S.
+    (exceto as de coordenadas). `busca` substitui indice.k_mais_proximos por
+    uma busca equivalente (ex.: paralelo.BuscaParalela sobre o mesmo índice).
+    """
+    if df_os.empty or indice is None or len(indice) == 0:
+        return pd.DataFrame()
+
+    buscar = (busca or indice).k_mais_proximos
+    indices, distancias = buscar(df_os[lat_col].to_numpy(), df_os[lon_col].to_numpy(), k)
+    k_efetivo = indices.shape[1]
+
+    info_os = df_os.drop(columns=[lat_col, lon_col])
+    df_final = info_os.iloc[np.repeat(np.arange(len(info_os)), k_efetivo)].reset_index(drop=True)
+
+    indices_planos = indices.ravel()
+    colunas_rt = {
+        'RANKING': np.tile(np.arange(1, k_efetivo + 1), len(info_os)),
+        'REPRESENTANTE': indice.nomes[indices_planos],
+        'CIDADE_RT': indice.cidades[indices_planos],
+        'DISTANCIA_KM': distancias.ravel(),
+    }
+    # Colunas da O.S. com o mesmo nome prevalecem (mesmo comportamento do dict.update anterior)
+    for posicao, (nome, valores) in enumerate(c for c in colunas_rt.items() if c[0] not in df_final.columns):
+        df_final.insert(posicao, nome, valores)
+    return df_final
+
+
+def para_float(serie):
+    """Converte uma coluna de coordenadas (aceitando vírgula decimal) em float64."""
+    if pd.api.types.is_numeric_dtype(serie):
+        return serie.astype(np.float64)
+    return pd.to_numeric(serie.astype(str).str.strip().str.replace(',', '.', regex=False), errors='coerce')
+
+
+def identificar_colunas_rt(df_map):
+    """Identifica, de forma flexível, as colunas do RT (nome, base e contato) no Mapeamento."""
+    colunas_lower = {str(c).lower().strip(): c for c in df_map.columns}
+    rep = colunas_lower.get('nm_representante', next((c for k, c in colunas_lower.items() if 'representante' in k and 'nome' in k), None))
+    lat = next((c for k, c in colunas_lower.items() if ('latitude' in k or 'lat' in k) and ('representante' in k or 'rt' in k)), None)
+    lon = next((c for k, c in colunas_lower.items() if ('longitude' in k or 'lon' in k) and ('representante' in k or 'rt' in k)), None)
+    cidade = next((c for k, c in colunas_lower.items() if ('cidade' in k and ('representante' in k or 'rt' in k)) and ('nome' in k or 'nm' in k)), None)
+    if not cidade:
+        cidade = next((c for k, c in colunas_lower.items() if 'cidade' in k and ('representante' in k or 'rt' in k)), None)
+    uf = next((c for k, c in colunas_lower.items() if ('uf' in k or 'estado' in k) and ('representante' in k or 'rt' in k)), None)
+    telefone = next((c for c in df_map.columns if 'telefone' in str(c).lower()), None)
+    return {'rep': rep, 'lat': lat, 'lon': lon, 'cidade': cidade, 'uf': uf, 'telefone': telefone}
+
+
+def normalizar_nomes_rt(nomes):
+    """Chave de busca dos nomes de RT: texto sem espaços nas pontas, em maiúsculas."""
+    return pd.Series(nomes).astype(str).str.strip().str.upper()
+
+
+class RTIndex:
+    """
+    Índice espacial das bases dos RTs (um registro por representante).
+
+    Guarda as coordenadas em arrays float64 compactos e, quando o scikit-learn
+    está disponível, uma BallTree com métrica haversine. Deve ser construído uma
+    vez por upload do Mapeamento (ver data_loader.obter_rt_index).
+    `nomes` são os nomes como escritos no Mapeamento (para exibição); as
+    buscas por nome usam `chaves` (sem espaços nas pontas, em maiúsculas).
+    """
+
+    def __init__(self, hash_conteudo, nomes, lat, lon, cidades=None, ufs=None, telefones=None, chaves=None):
+        self.hash_conteudo = hash_conteudo
+        self.nomes = np.asarray(nomes, dtype=object)
+        self.chaves = np.asarray(chaves if chaves is not None else normalizar_nomes_rt(self.nomes), dtype=object)
+        self.lat = np.ascontiguousarray(lat, dtype=np.float64)
+        self.lon = np.ascontiguousarray(lon, dtype=np.float64)
+        n = len(self.nomes)
+        self.cidades = np.asarray(cidades, dtype=object) if cidades is not None else np.full(n, "N/A", dtype=object)
+        self.ufs = np.asarray(ufs, dtype=object) if ufs is not None else np.full(n, "N/A", dtype=object)
+        self.telefones = np.asarray(telefones, dtype=object) if telefones is not None else np.full(n, "N/A", dtype=object)
+        self.posicao_por_nome = {chave: i for i, chave in enumerate(self.chaves)}
+        self._subconjuntos = {}
+        self.arvore = None
+        if SKLEARN_AVAILABLE and n > 0:
+            from sklearn.neighbors import BallTree
+            self.arvore = BallTree(np.radians(np.column_stack([self.lat, self.lon])), metric='haversine')
+
+    @classmethod
+    def from_mapeamento(cls, df_map, hash_conteudo=None):
+        """Monta o índice a partir do DataFrame de Mapeamento. Retorna None se faltarem colunas."""
+        cols = identificar_colunas_rt(df_map)
+        if not all([cols['rep'], cols['lat'], cols['lon']]):
+            return None
+
+        df_rts = pd.DataFrame({
+            'nome': df_map[cols['rep']],
+            'chave': normalizar_nomes_rt(df_map[cols['rep']]),
+            'lat': para_float(df_map[cols['lat']]),
+            'lon': para_float(df_map[cols['lon']]),
+            'cidade': df_map[cols['cidade']] if cols['cidade'] else "N/A",
+            'uf': df_map[cols['uf']] if cols['uf'] else "N/A",
+            'telefone': df_map[cols['telefone']] if cols['telefone'] else "N/A",
+        })
+        df_rts = df_rts.dropna(subset=['lat', 'lon'])
+        df_rts = df_rts[df_rts['lat'].between(-90, 90) & df_rts['lon'].between(-180, 180)]
+        df_rts = df_rts.drop_duplicates(subset=['chave'])
+        return cls(hash_conteudo, df_rts['nome'], df_rts['lat'], df_rts['lon'],
+                   df_rts['cidade'], df_rts['uf'], df_rts['telefone'], df_rts['chave'])
+
+    def __len__(self):
+        return len(self.nomes)
+
+    def subconjunto(self, termos_excluidos=()):
+        """Índice sem os RTs cujo nome contém algum dos termos (ex.: contratos especiais). Memoizado."""
+        chave = tuple(sorted(t.upper() for t in termos_excluidos))
+        if not chave:
+            return self
+        if chave not in self._subconjuntos:
+            manter = ~pd.Series(self.nomes).str.contains('|'.join(map(re.escape, chave)), case=False, na=False).to_numpy()
+            self._subconjuntos[chave] = RTIndex(
+                self.hash_conteudo, self.nomes[manter], self.lat[manter], self.lon[manter],
+                self.cidades[manter], self.ufs[manter], self.telefones[manter], self.chaves[manter]
+            )
+        return self._subconjuntos[chave]
+
+    def k_mais_proximos(self, lat, lon, k):
+        """Índices e distâncias (km) dos k RTs mais próximos de cada ponto, em ordem crescente."""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        k = min(int(k), len(self))
+        if self.arvore is None or k == 0 or len(lat) == 0:
+            return k_mais_proximos(lat, lon, self.lat, self.lon, k)
+        distancias, indices = self.arvore.query(np.radians(np.column_stack([lat, lon])), k=k)
+        return indices, distancias * RAIO_TERRA_KM
+
+    def no_raio(self, lat, lon, raio_km):
+        """Para cada ponto, índices e distâncias (km) dos RTs dentro do raio, ordenados por distância."""
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        if self.arvore is not None and len(lat) > 0:
+            indices, distancias = self.arvore.query_radius(
+                np.radians(np.column_stack([lat, lon])), r=raio_km / RAIO_TERRA_KM,
+                return_distance=True, sort_results=True
+            )
+            return list(indices), [d * RAIO_TERRA_KM for d in distancias]
+        resultado_idx, resultado_dist = [], []
+        for la, lo in zip(lat, lon):
+            dist = self.distancias_para(la, lo)
+            dentro = np.flatnonzero(dist <= raio_km)
+            ordem = dentro[np.argsort(dist[dentro], kind='stable')]
+            resultado_idx.append(ordem)
+            resultado_dist.append(dist[ordem])
+        return resultado_idx, resultado_dist
+
+    def distancias_para(self, lat, lon):
+        """Distância (km) de um único ponto até todos os RTs do índice."""
+        return haversine_km(float(lat), float(lon), self.lat, self.lon)
+
+    def coordenadas_de(self, nomes):
+        """Lat/Lon da base de cada RT informado (NaN para RTs fora do índice)."""
+        nomes_norm = normalizar_nomes_rt(nomes)
+        posicoes = nomes_norm.map(self.posicao_por_nome)
+        validos = posicoes.notna().to_numpy()
+        lat = np.full(len(nomes_norm), np.nan)
+        lon = np.full(len(nomes_norm), np.nan)
+        idx = posicoes[validos].astype(np.int64).to_numpy()
+        lat[validos], lon[validos] = self.lat[idx], self.lon[idx]
+        return lat, lon
@@ -0,0 +1,344 @@
+# modules/geocodificacao.py
+"""
+Geocodificação de endereços (texto -> coordenada) das abas CPS e Viagens.
+
+Os resultados ficam num cache SQLite compartilhado entre sessões, pela
+chave normalizada do endereço (sem acentos, maiúsculas, espaços colapsados)
+e pelo provedor; cada chamada só envia ao provedor os endereços que ainda
+não estão no cache. Quando o provedor não encontra o endereço, ou falha, a
+coordenada vem do município citado no texto (gazetteer.GazetteerMunicipios).
+Falhas do provedor não são gravadas, para que o endereço seja consultado de
+novo na próxima vez.
+
+O provedor é plugável (PROVEDORES), como em matriz_distancias: o Nominatim
+aceita outra URL (NOMINATIM_URL), por exemplo um servidor local de testes.
+
+A geocodificação roda em segundo plano (TarefaGeocodificacao), fora da
+thread do script do Streamlit: um rerun da página não a interrompe, e a aba
+consulta o andamento e as coordenadas parciais. Cada provedor tem um limite
+de taxa (BaldeTokens) compartilhado por todas as tarefas do processo e um
+número de requisições simultâneas (`concorrencia`). Como os resultados vão
+para o cache em lotes, uma tarefa reiniciada (ou interrompida pela queda do
+processo) continua de onde parou.
+"""
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from modules.gazetteer import normalizar_cidade_valor
+
+CAMINHO_PADRAO = os.path.join("cache", "geocodificacao.sqlite")
+
+# Origem de cada coordenada gravada
+ORIGEM_PROVEDOR = "provedor"
+ORIGEM_GAZETTEER = "gazetteer"
+ORIGEM_NAO_ENCONTRADO = "nao_encontrado"
+
+
+def normalizar_endereco(endereco):
+    """Chave do endereço no cache."""
+    return normalizar_cidade_valor(endereco).strip(' ,;-')
+
+
+class BaldeTokens:
+    """
+    Limite de taxa por token bucket: até `capacidade` requisições seguidas,
+    com os tokens repostos a `taxa` por segundo. Seguro entre threads.
+    """
+
+    def __init__(self, taxa, capacidade=1):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self._tokens = float(capacidade)
+        self._instante = time.monotonic()
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        """Bloqueia até haver um token disponível e o consome."""
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self._tokens = min(self.capacidade, self._tokens + (agora - self._instante) * self.taxa)
+                self._instante = agora
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                espera = (1 - self._tokens) / self.taxa
+            time.sleep(espera)
+
+
+class ProvedorNominatim:
+    """
+    API /search de um servidor Nominatim (público ou local). O intervalo
+    mínimo entre requisições (1 s na política do servidor público) vira a taxa
+    do balde de tokens; servidores próprios podem liberar requisições
+    simultâneas (NOMINATIM_CONCORRENCIA) e um intervalo menor.
+    """
+    nome = "nominatim"
+
+    def __init__(self, url_base=None, user_agent="mercurio_app", intervalo_minimo=None, concorrencia=None, rajada=1, timeout=10):
+        self.url_base = (url_base or os.environ.get("NOMINATIM_URL", "https://nominatim.openstreetmap.org")).rstrip("/")
+        self.user_agent = user_agent
+        if intervalo_minimo is None:
+            intervalo_minimo = float(os.environ.get("NOMINATIM_INTERVALO", "1.0"))
+        self.concorrencia = max(1, int(os.environ.get("NOMINATIM_CONCORRENCIA", "1")) if concorrencia is None else concorrencia)
+        self.timeout = timeout
+        self.balde = BaldeTokens(1.0 / intervalo_minimo, rajada) if intervalo_minimo > 0 else None
+
+    def geocodificar(self, endereco):
+        """(lat, lon) do endereço, ou None se não encontrado. Erros de rede/HTTP são propagados."""
+        if self.balde is not None:
+            self.balde.aguardar()
+        parametros = urllib.parse.urlencode({'q': endereco, 'format': 'json', 'limit': 1})
+        requisicao = urllib.request.Request(f"{self.url_base}/search?{parametros}", headers={'User-Agent': self.user_agent})
+        with urllib.request.urlopen(requisicao, timeout=self.timeout) as resposta:
+            dados = json.load(resposta)
+        if not dados:
+            return None
+        return float(dados[0]['lat']), float(dados[0]['lon'])
+
+
+class ProvedorOffline:
+    """Sem requisições externas: só o gazetteer de municípios."""
+    nome = "offline"
+    concorrencia = 1
+
+    def geocodificar(self, endereco):
+        return None
+
+
+PROVEDORES = {
+    ProvedorNominatim.nome: ProvedorNominatim,
+    ProvedorOffline.nome: ProvedorOffline,
+}
+
+
+class TarefaGeocodificacao:
+    """
+    Geocodificação em segundo plano dos endereços fora do cache, com
+    `provedor.concorrencia` threads de trabalho. Criada por
+    Geocodificador.iniciar_tarefa; resultado() pode ser chamado a qualquer
+    momento e traz as coordenadas já obtidas.
+    """
+
+    def __init__(self, geocodificador, enderecos, chaves, coordenadas, pendentes, lote_gravacao=20):
+        self.geocodificador = geocodificador
+        self.lote_gravacao = lote_gravacao
+        self.total = len(pendentes)
+        self.feitos = 0
+        self.erro = None
+        self._enderecos = enderecos
+        self._chaves = chaves
+        self._coordenadas = coordenadas
+        self._a_gravar = []
+        self._fila = queue.SimpleQueue()
+        for item in pendentes:
+            self._fila.put(item)
+        self._lock = threading.Lock()
+        self._cancelada = threading.Event()
+        self._thread = threading.Thread(target=self._executar, name="geocodificacao", daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+        return self
+
+    @property
+    def ativa(self):
+        return self._thread.is_alive()
+
+    @property
+    def cancelada(self):
+        return self._cancelada.is_set()
+
+    def cancelar(self):
+        """Interrompe a tarefa após as requisições em andamento; o que já foi obtido fica no cache."""
+        self._cancelada.set()
+
+    def aguardar(self, timeout=None):
+        self._thread.join(timeout)
+        return not self.ativa
+
+    def _gravar(self):
+        if self._a_gravar:
+            self.geocodificador.put_many(self._a_gravar)
+            self._a_gravar = []
+
+    def _trabalhar(self):
+        try:
+            while not self._cancelada.is_set():
+                try:
+                    chave, endereco = self._fila.get_nowait()
+                except queue.Empty:
+                    return
+                lat, lon, origem, gravar = self.geocodificador._resolver(endereco)
+                with self._lock:
+                    self._coordenadas[chave] = (lat, lon, origem)
+                    self.feitos += 1
+                    if gravar:
+                        self._a_gravar.append((chave, lat, lon, origem))
+                    if len(self._a_gravar) >= self.lote_gravacao:
+                        self._gravar()
+        except Exception as e:
+            self.erro = e
+            self._cancelada.set()
+
+    def _executar(self):
+        trabalhadores = [
+            threading.Thread(target=self._trabalhar, name=f"geocodificacao-{i}", daemon=True)
+            for i in range(min(self.geocodificador.provedor.concorrencia, self.total))
+        ]
+        for trabalhador in trabalhadores:
+            trabalhador.start()
+        for trabalhador in trabalhadores:
+            trabalhador.join()
+        with self._lock:
+            try:
+                self._gravar()
+            except Exception as e:
+                self.erro = e
+
+    def situacao(self):
+        """Andamento da tarefa: feitos, total, ativa, cancelada e erro (texto ou None)."""
+        return {
+            'feitos': self.feitos, 'total': self.total, 'ativa': self.ativa,
+            'cancelada': self.cancelada, 'erro': None if self.erro is None else str(self.erro),
+        }
+
+    def resultado(self):
+        """
+        DataFrame indexado pelos endereços com 'lat', 'lon' e 'origem' (NaN
+        nos que ainda não foram consultados).
+        """
+        with self._lock:
+            coordenadas = dict(self._coordenadas)
+        resultado = pd.DataFrame.from_dict(coordenadas, orient='index', columns=['lat', 'lon', 'origem'])
+        resultado = resultado.reindex(self._chaves.to_numpy())
+        resultado.index = self._enderecos.to_numpy()
+        resultado[['lat', 'lon']] = resultado[['lat', 'lon']].astype(float)
+        return resultado
+
+
+class Geocodificador:
+    """Geocodificação incremental de endereços com cache em SQLite e fallback pelo município."""
+
+    def __init__(self, provedor, gazetteer=None, caminho=CAMINHO_PADRAO):
+        self.provedor = provedor
+        self.gazetteer = gazetteer
+        self.caminho = caminho
+        if os.path.dirname(caminho):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        self._lock = threading.Lock()
+        self._lock_tarefas = threading.Lock()
+        self._tarefas = {}
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("""
+            CREATE TABLE IF NOT EXISTS enderecos (
+                provedor TEXT NOT NULL,
+                chave TEXT NOT NULL,
+                lat REAL, lon REAL,
+                origem TEXT NOT NULL,
+                atualizado_em REAL NOT NULL,
+                PRIMARY KEY (provedor, chave)
+            ) WITHOUT ROWID
+        """)
+        self._conexao.commit()
+
+    def get_many(self, chaves):
+        """Linhas gravadas (lat, lon, origem) para as chaves informadas, indexadas pela chave."""
+        chaves = list(dict.fromkeys(chaves))
+        if not chaves:
+            return pd.DataFrame(columns=['lat', 'lon', 'origem'])
+        with self._lock:
+            self._conexao.execute("CREATE TEMP TABLE IF NOT EXISTS consulta (chave TEXT PRIMARY KEY)")
+            self._conexao.execute("DELETE FROM consulta")
+            self._conexao.executemany("INSERT INTO consulta VALUES (?)", ((c,) for c in chaves))
+            encontrados = pd.read_sql_query(
+                """SELECT e.chave, e.lat, e.lon, e.origem FROM consulta c
+                   JOIN enderecos e ON e.provedor = ? AND e.chave = c.chave""",
+                self._conexao, params=(self.provedor.nome,)
+            )
+        return encontrados.set_index('chave')
+
+    def put_many(self, registros):
+        """Grava (ou substitui) registros (chave, lat, lon, origem)."""
+        agora = time.time()
+        linhas = [(self.provedor.nome, chave, lat, lon, origem, agora) for chave, lat, lon, origem in registros]
+        with self._lock:
+            self._conexao.executemany("INSERT OR REPLACE INTO enderecos VALUES (?, ?, ?, ?, ?, ?)", linhas)
+            self._conexao.commit()
+
+    def _resolver(self, endereco):
+        """Consulta o provedor e, se preciso, o gazetteer. Retorna (lat, lon, origem, gravar)."""
+        try:
+            coordenada = self.provedor.geocodificar(endereco)
+            falhou = False
+        except Exception:
+            coordenada, falhou = None, True
+        if coordenada is not None:
+            return coordenada[0], coordenada[1], ORIGEM_PROVEDOR, True
+        local = self.gazetteer.localizar(endereco) if self.gazetteer is not None else None
+        if local is not None:
+            return local[0], local[1], ORIGEM_GAZETTEER, not falhou
+        return np.nan, np.nan, ORIGEM_NAO_ENCONTRADO, not falhou
+
+    def iniciar_tarefa(self, enderecos, lote_gravacao=20):
+        """
+        Inicia a geocodificação em segundo plano dos endereços distintos (ver
+        TarefaGeocodificacao). Os que já estão no cache não vão ao provedor;
+        se o mesmo conjunto de endereços já está sendo geocodificado, devolve
+        a tarefa em andamento em vez de abrir outra.
+        """
+        enderecos = pd.Series(pd.unique(pd.Series(list(enderecos), dtype=object).dropna()), dtype=object)
+        chaves = enderecos.map(normalizar_endereco)
+        identificador = hashlib.md5("\n".join(sorted(set(chaves))).encode()).hexdigest()
+        # Verificação e registro num único trecho protegido: duas sessões pedindo
+        # o mesmo conjunto não abrem tarefas duplicadas
+        with self._lock_tarefas:
+            tarefa = self._tarefas.get(identificador)
+            if tarefa is not None and tarefa.ativa:
+                return tarefa
+            # Tarefas encerradas não precisam mais ser lembradas
+            self._tarefas = {k: t for k, t in self._tarefas.items() if t.ativa}
+
+            gravados = self.get_many(chaves)
+            coordenadas = dict(zip(gravados.index, zip(gravados['lat'], gravados['lon'], gravados['origem'])))
+            # Um endereço por chave (grafias que normalizam igual são consultadas uma vez)
+            pendentes = {}
+            for chave, endereco in zip(chaves, enderecos):
+                if chave not in coordenadas and chave not in pendentes:
+                    pendentes[chave] = endereco
+            tarefa = TarefaGeocodificacao(self, enderecos, chaves, coordenadas, list(pendentes.items()), lote_gravacao)
+            self._tarefas[identificador] = tarefa
+            return tarefa.iniciar()
+
+    def geocodificar(self, enderecos, progresso=None, lote_gravacao=20, intervalo_progresso=0.2):
+        """
+        Versão bloqueante de iniciar_tarefa: DataFrame indexado pelos endereços
+        distintos com 'lat', 'lon' e 'origem'. progresso(feitos, total) é
+        chamado na thread de quem chamou enquanto a tarefa roda.
+        """
+        tarefa = self.iniciar_tarefa(enderecos, lote_gravacao)
+        while not tarefa.aguardar(intervalo_progresso):
+            if progresso is not None:
+                progresso(tarefa.feitos, tarefa.total)
+        if progresso is not None and tarefa.total:
+            progresso(tarefa.feitos, tarefa.total)
+        return tarefa.resultado()
+
+    def estatisticas(self):
+        """Endereços gravados por origem, para o provedor atual."""
+        with self._lock:
+            linhas = self._conexao.execute(
+                "SELECT origem, COUNT(*) FROM enderecos WHERE provedor = ? GROUP BY origem", (self.provedor.nome,)
+            ).fetchall()
+        return dict(linhas)
@@ -0,0 +1,129 @@
+# modules/geocodificacao_reversa.py
+"""
+Geocodificação reversa (coordenada -> cidade/estado/país) com reverse_geocoder.
+
+A árvore do reverse_geocoder é carregada uma vez por processo do servidor
+(pre_carregar dispara o carregamento em segundo plano). As consultas são
+feitas em lote, só para as coordenadas distintas ainda não vistas; os
+resultados ficam em cache pela coordenada arredondada a `precisao` casas
+decimais (3 casas ~ 110 m), e o nome do país por código ISO é memoizado.
+"""
+import os
+import threading
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+from modules.carregamento_tardio import modulo_tardio
+
+rg = modulo_tardio("reverse_geocoder")
+pycountry = modulo_tardio("pycountry")
+
+# Casas decimais usadas para arredondar as coordenadas antes da consulta/cache
+PRECISAO_PADRAO = int(os.environ.get("MERCURIO_RG_PRECISAO", "3"))
+
+
+@lru_cache(maxsize=None)
+def nome_pais(cc):
+    """Nome do país para o código ISO alpha-2 (None se desconhecido)."""
+    if not cc:
+        return None
+    try:
+        pais = pycountry.countries.get(alpha_2=cc)
+    except (KeyError, LookupError):
+        return None
+    return pais.name if pais else None
+
+
+class GeocodificadorReverso:
+    """
+    Serviço de geocodificação reversa em lote. O cache é uma tabela indexada
+    pela coordenada arredondada (codificada num inteiro), consultada de forma
+    vetorizada; acima de max_itens as entradas mais antigas são descartadas.
+    """
+
+    COLUNAS = ['cidade', 'estado', 'cc', 'pais']
+
+    def __init__(self, precisao=PRECISAO_PADRAO, max_itens=500000):
+        self.precisao = precisao
+        self.max_itens = max_itens
+        self._escala = 10 ** precisao
+        self._tabela = pd.DataFrame(columns=self.COLUNAS, dtype=object)
+        self._lock = threading.Lock()
+        self.carregado = False
+        self.hits = 0
+        self.misses = 0
+
+    def carregar(self):
+        """Carrega a árvore do reverse_geocoder (uma vez por processo)."""
+        with self._lock:
+            if not self.carregado:
+                # Modo 1 (um processo): evita abrir um pool a cada consulta dentro do servidor
+                rg.RGeocoder(mode=1, verbose=False)
+                self.carregado = True
+
+    def pre_carregar(self):
+        """Inicia o carregamento da árvore em segundo plano, sem bloquear a tela."""
+        if not self.carregado:
+            threading.Thread(target=self.carregar, daemon=True).start()
+
+    def buscar(self, lat, lon):
+        """
+        DataFrame com 'cidade', 'estado', 'cc' e 'pais' alinhado ao índice de
+        `lat`/`lon` (Series). Coordenadas ausentes ou fora da faixa válida ficam NaN.
+        """
+        lat = pd.to_numeric(lat, errors='coerce')
+        lon = pd.to_numeric(lon, errors='coerce')
+        validos = (lat.between(-90, 90) & lon.between(-180, 180)).to_numpy()
+        if not validos.any():
+            return pd.DataFrame(index=lat.index, columns=self.COLUNAS, dtype=object)
+
+        lat_i = np.round(lat.to_numpy(dtype=np.float64)[validos] * self._escala).astype(np.int64)
+        lon_i = np.round(lon.to_numpy(dtype=np.float64)[validos] * self._escala).astype(np.int64)
+        # |lon_i| <= 180 * escala, então a chave é única para cada par arredondado
+        chaves = lat_i * (360 * self._escala + 1) + lon_i
+        unicas, primeira, inversa = np.unique(chaves, return_index=True, return_inverse=True)
+
+        with self._lock:
+            encontrados = self._tabela.reindex(unicas)
+        faltantes = encontrados['cc'].isna().to_numpy()
+        self.hits += int((~faltantes).sum())
+        self.misses += int(faltantes.sum())
+
+        if faltantes.any():
+            self.carregar()
+            posicoes = primeira[faltantes]
+            coords = list(zip((lat_i[posicoes] / self._escala).tolist(), (lon_i[posicoes] / self._escala).tolist()))
+            resultados = rg.search(coords, mode=1, verbose=False)
+            novos = pd.DataFrame({
+                'cidade': [r.get('name', '') for r in resultados],
+                'estado': [r.get('admin1', '') for r in resultados],
+                'cc': [r.get('cc', '') for r in resultados],
+            }, index=unicas[faltantes])
+            novos['pais'] = novos['cc'].map(nome_pais)
+            encontrados.loc[novos.index, self.COLUNAS] = novos[self.COLUNAS]
+            with self._lock:
+                tabela = pd.concat([self._tabela, novos]) if len(self._tabela) else novos
+                self._tabela = tabela[~tabela.index.duplicated(keep='last')].iloc[-self.max_itens:]
+
+        saida = encontrados.iloc[inversa]
+        saida.index = lat.index[validos]
+        return saida.reindex(lat.index)
+
+    def limpar(self):
+        with self._lock:
+            self._tabela = pd.DataFrame(columns=self.COLUNAS, dtype=object)
+
+    def estatisticas(self):
+        """Resumo do uso do cache (mesmo formato de CacheLRU.estatisticas, para o painel Admin)."""
+        consultas = self.hits + self.misses
+        return {
+            'itens': len(self._tabela),
+            'max_itens': self.max_itens,
+            'hits': self.hits,
+            'misses': self.misses,
+            'taxa_acerto': (self.hits / consultas) if consultas else 0.0,
+            'precisao': self.precisao,
+            'carregado': self.carregado,
+        }
@@ -0,0 +1,102 @@
+# modules/indice_entidades.py
+"""
+Índice de equipamentos por serial e placa normalizados.
+
+A normalização (texto sem espaços nas pontas, em maiúsculas; vazio conta
+como ausente) é vetorizada, e as linhas são agrupadas por chave uma vez por
+conjunto de dados. Cruzar outro conjunto com o índice é uma busca em tabela
+hash por linha (Index.get_indexer) seguida de operações em arrays, sem
+merges nem apply linha a linha. Usado no cruzamento de odômetros Posição x
+CPS, no cruzamento com a base de ativos (aba Posição) e na análise de ativos
+sem posição (Otimizador).
+"""
+import numpy as np
+import pandas as pd
+
+# Ordem das camadas do cruzamento: primeiro serial, depois placa
+CAMPOS = ('serial', 'placa')
+
+
+def normalizar_chaves(serie):
+    """Serial/placa normalizados (strip + maiúsculas); ausentes ou vazios ficam NaN."""
+    texto = serie.astype(str).str.strip().str.upper()
+    return texto.where(serie.notna() & (texto != ''))
+
+
+class IndiceEntidades:
+    """
+    Linhas de um DataFrame agrupadas por serial e por placa normalizados.
+    As linhas são posicionais (0..n-1), para uso com .iloc/.take.
+    """
+
+    def __init__(self, df, coluna_serial='Serial', coluna_placa='Placa'):
+        self.tamanho = len(df)
+        self.chaves = {}
+        self._grupos = {}
+        for campo, coluna in zip(CAMPOS, (coluna_serial, coluna_placa)):
+            if coluna and coluna in df.columns:
+                chaves = normalizar_chaves(df[coluna])
+            else:
+                chaves = pd.Series(np.nan, index=df.index, dtype=object)
+            self.chaves[campo] = chaves.to_numpy(dtype=object)
+            codigos, unicas = pd.factorize(chaves)
+            # Linhas ordenadas por chave (estável: dentro da chave, na ordem original)
+            ordem = np.argsort(codigos, kind='stable')
+            linhas = ordem[codigos[ordem] >= 0]
+            contagem = np.bincount(codigos[codigos >= 0], minlength=len(unicas))
+            inicios = np.cumsum(contagem) - contagem
+            self._grupos[campo] = (pd.Index(unicas), linhas, inicios, contagem)
+
+    def _codigos(self, campo, chaves):
+        unicas = self._grupos[campo][0]
+        if not len(unicas):
+            return np.full(len(chaves), -1, dtype=np.int64)
+        return unicas.get_indexer(chaves)
+
+    def ultima_linha(self, campo, chaves):
+        """Para cada chave (já normalizada), a última linha do índice com ela; -1 quando não há."""
+        _, linhas, inicios, contagem = self._grupos[campo]
+        codigos = self._codigos(campo, chaves)
+        encontrados = codigos >= 0
+        saida = np.full(len(codigos), -1, dtype=np.int64)
+        cod = codigos[encontrados]
+        saida[encontrados] = linhas[inicios[cod] + contagem[cod] - 1]
+        return saida
+
+    def pares(self, campo, chaves, livres_consulta=None, livres_indice=None):
+        """
+        Todos os pares (linha da consulta, linha do índice) com a mesma chave,
+        na ordem de um merge inner: as linhas da consulta em ordem e, para
+        cada uma, as do índice em ordem. livres_* (máscaras booleanas)
+        restringem as linhas que podem participar.
+        """
+        _, linhas, inicios, contagem = self._grupos[campo]
+        codigos = self._codigos(campo, chaves)
+        if livres_consulta is not None:
+            codigos = np.where(livres_consulta, codigos, -1)
+        consulta = np.flatnonzero(codigos >= 0)
+        qtd = contagem[codigos[consulta]]
+        linhas_consulta = np.repeat(consulta, qtd)
+        # Posição de cada par dentro do grupo da sua chave
+        deslocamento = np.arange(qtd.sum()) - np.repeat(np.cumsum(qtd) - qtd, qtd)
+        linhas_indice = linhas[np.repeat(inicios[codigos[consulta]], qtd) + deslocamento]
+        if livres_indice is not None:
+            manter = livres_indice[linhas_indice]
+            linhas_consulta, linhas_indice = linhas_consulta[manter], linhas_indice[manter]
+        return linhas_consulta, linhas_indice
+
+    def cruzar(self, consulta, campos=CAMPOS):
+        """
+        Casamento em camadas de `consulta` (outro IndiceEntidades) com este
+        índice: primeiro por serial; as linhas que não casaram, dos dois lados,
+        tentam pela placa. DataFrame com 'linha_consulta', 'linha_indice' e 'campo'.
+        """
+        livres_consulta = np.ones(consulta.tamanho, dtype=bool)
+        livres_indice = np.ones(self.tamanho, dtype=bool)
+        partes = []
+        for campo in campos:
+            linhas_consulta, linhas_indice = self.pares(campo, consulta.chaves[campo], livres_consulta, livres_indice)
+            livres_consulta[linhas_consulta] = False
+            livres_indice[linhas_indice] = False
+            partes.append(pd.DataFrame({'linha_consulta': linhas_consulta, 'linha_indice': linhas_indice, 'campo': campo}))
+        return pd.concat(partes, ignore_index=True)
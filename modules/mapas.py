@@ -0,0 +1,231 @@
+# modules/mapas.py
+"""
+Mapas de muitos pontos com agregação no servidor.
+
+st.map e o pydeck enviam ao navegador todas as linhas (e colunas) do
+DataFrame em JSON; com centenas de milhares de equipamentos a página passa de
+dezenas de MB. exibir_mapa envia no máximo `limite_pontos` pontos: acima
+disso eles são agrupados numa grade regular em graus, com a contagem e o
+status predominante de cada célula, e o tamanho da célula é o menor que
+gera no máximo LIMITE_CELULAS células. Clicar numa célula aproxima o
+mapa naquela área, onde os pontos individuais voltam a ser exibidos quando
+cabem no limite.
+
+Só as colunas usadas pelas camadas são enviadas, com as coordenadas
+arredondadas a 5 casas (~1 m), e o JSON do Deck vai sem a indentação que o
+pydeck aplica (que sozinha triplica o tamanho). O transporte binário do
+pydeck só existe no widget do Jupyter; o st.pydeck_chart sempre envia JSON.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from modules.carregamento_tardio import modulo_tardio
+
+pdk = modulo_tardio("pydeck")
+
+LIMITE_PONTOS = 5000
+# Células levam mais campos que pontos (contagem, status, canto), por isso o limite é menor
+LIMITE_CELULAS = 2000
+# Tamanhos de célula testados, do mais grosso ao mais fino (graus)
+TAMANHOS_CELULA = (5.0, 2.0, 1.0, 0.5, 0.25, 0.1, 0.05, 0.02, 0.01, 0.005)
+CASAS_DECIMAIS = 5
+METROS_POR_GRAU = 111_320
+
+COR_PADRAO = [0, 128, 255]
+COR_SEM_STATUS = [128, 128, 128]
+PALETA = [
+    [0, 128, 255], [255, 0, 0], [0, 200, 0], [255, 165, 0], [148, 0, 211],
+    [0, 206, 209], [255, 20, 147], [139, 69, 19], [128, 128, 0], [70, 130, 180],
+]
+
+
+def coordenadas_validas(df, lat_col='lat', lon_col='lon'):
+    """Máscara das linhas com latitude/longitude numéricas, na faixa válida e diferentes de (0, 0)."""
+    lat = pd.to_numeric(df[lat_col], errors='coerce')
+    lon = pd.to_numeric(df[lon_col], errors='coerce')
+    return lat.between(-90, 90) & lon.between(-180, 180) & ((lat != 0) | (lon != 0))
+
+
+def _colunas_grade(tamanho):
+    return int(np.ceil(360 / tamanho)) + 1
+
+
+def _chaves_celula(lat, lon, tamanho):
+    """Número da célula da grade (linha * colunas + coluna) para cada ponto."""
+    linha = np.floor((lat + 90) / tamanho).astype(np.int64)
+    coluna = np.floor((lon + 180) / tamanho).astype(np.int64)
+    return linha * _colunas_grade(tamanho) + coluna
+
+
+def escolher_tamanho_celula(lat, lon, max_celulas=LIMITE_CELULAS):
+    """Menor tamanho de célula (em TAMANHOS_CELULA) que gera no máximo max_celulas células."""
+    escolhido = TAMANHOS_CELULA[0]
+    for tamanho in TAMANHOS_CELULA:
+        if len(np.unique(_chaves_celula(lat, lon, tamanho))) > max_celulas:
+            break
+        escolhido = tamanho
+    return escolhido
+
+
+def agregar_em_grade(lat, lon, tamanho, status=None):
+    """
+    Agrupa os pontos em células de `tamanho` graus. Retorna um DataFrame por
+    célula com o centróide dos pontos ('lat', 'lon'), a quantidade ('n'), o
+    canto sudoeste ('lat_min', 'lon_min') e, se `status` for informado, o
+    status predominante ('status') e sua participação em % ('pct').
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    colunas = _colunas_grade(tamanho)
+    unicas, inversa, contagem = np.unique(_chaves_celula(lat, lon, tamanho), return_inverse=True, return_counts=True)
+    celulas = pd.DataFrame({
+        'lat': np.bincount(inversa, weights=lat) / contagem,
+        'lon': np.bincount(inversa, weights=lon) / contagem,
+        'n': contagem,
+        'lat_min': (unicas // colunas) * tamanho - 90,
+        'lon_min': (unicas % colunas) * tamanho - 180,
+    })
+    if status is not None:
+        codigos, categorias = pd.factorize(np.asarray(status, dtype=object))
+        base = len(categorias) + 1
+        # Cada par (célula, status) vira um inteiro; o código -1 (status vazio) vira 0
+        pares, qtd = np.unique(inversa.astype(np.int64) * base + (codigos + 1), return_counts=True)
+        celula_do_par = pares // base
+        # Por célula, o par mais frequente vem primeiro (empate: status visto primeiro)
+        ordem = np.lexsort((-qtd, celula_do_par))
+        primeiro = np.r_[True, celula_do_par[ordem][1:] != celula_do_par[ordem][:-1]]
+        escolhidos = ordem[primeiro]
+        # O último elemento atende o código -1 (status vazio)
+        nomes = np.append(np.asarray(categorias, dtype=object), None)
+        celulas['status'] = nomes[pares[escolhidos] % base - 1]
+        celulas['pct'] = np.round(100 * qtd[escolhidos] / contagem).astype(int)
+    return celulas
+
+
+def _zoom_para(lat, lon):
+    extensao = max(float(np.ptp(lat)), float(np.ptp(lon)), 0.01)
+    return int(np.clip(np.log2(360 / extensao), 1, 15))
+
+
+def _cores(status, cores_status):
+    """Cor [r, g, b] para cada valor de status: a informada em cores_status ou da PALETA."""
+    cores = dict(cores_status or {})
+    novos = [s for s in pd.unique(status) if s not in cores and s is not None and not pd.isna(s)]
+    inicio = len(cores)
+    for i, s in enumerate(novos):
+        cores[s] = PALETA[(inicio + i) % len(PALETA)]
+    return [list(cores.get(s, COR_SEM_STATUS)) if s is not None and not pd.isna(s) else COR_SEM_STATUS for s in status]
+
+
+def _json_compacto(deck):
+    """Faz o Deck ser serializado sem indentação nem espaços (st.pydeck_chart chama deck.to_json())."""
+    to_json = deck.to_json
+    deck.to_json = lambda: json.dumps(json.loads(to_json()), separators=(',', ':'))
+    return deck
+
+
+def exibir_mapa(df, key, lat_col='lat', lon_col='lon', coluna_status=None, cores_status=None,
+                cor=COR_PADRAO, coluna_rotulo=None, raio_metros=200, zoom=None, map_style=None,
+                limite_pontos=LIMITE_PONTOS):
+    """
+    Mapa pydeck de `df`, agregado em grade quando há mais de `limite_pontos` pontos.
+
+    coluna_status define a cor dos pontos (cores_status: {status: [r, g, b]};
+    sem ela, `cor` para todos) e o status predominante das células;
+    coluna_rotulo é exibida no tooltip dos pontos (aceita HTML). `key` deve
+    ser único na página: guarda a área aproximada em st.session_state.
+    """
+    validos = coordenadas_validas(df, lat_col, lon_col).to_numpy()
+    if not validos.any():
+        st.info("Nenhuma coordenada válida para exibir no mapa.")
+        return
+    lat = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype=np.float64)[validos]
+    lon = pd.to_numeric(df[lon_col], errors='coerce').to_numpy(dtype=np.float64)[validos]
+    status = df[coluna_status].to_numpy(dtype=object)[validos] if coluna_status else None
+    rotulo = df[coluna_rotulo].astype(str).to_numpy()[validos] if coluna_rotulo else None
+
+    chave_foco, chave_versao = f"{key}_foco", f"{key}_versao"
+    foco = st.session_state.get(chave_foco)
+    if foco:
+        lat_min, lon_min, lat_max, lon_max = foco
+        na_area = (lat >= lat_min) & (lat < lat_max) & (lon >= lon_min) & (lon < lon_max)
+        if na_area.any():
+            lat, lon = lat[na_area], lon[na_area]
+            status = status[na_area] if status is not None else None
+            rotulo = rotulo[na_area] if rotulo is not None else None
+        else:
+            # Os dados mudaram (filtro ou novo upload) e a área ficou vazia
+            foco = None
+            st.session_state.pop(chave_foco, None)
+    if foco:
+        col_info, col_voltar = st.columns([3, 1])
+        col_info.caption(f"Área aproximada: {len(lat):,} pontos.".replace(',', '.'))
+        if col_voltar.button("Voltar à visão geral", key=f"{key}_voltar", use_container_width=True):
+            st.session_state.pop(chave_foco, None)
+            st.session_state[chave_versao] = st.session_state.get(chave_versao, 0) + 1
+            st.rerun()
+
+    agregado = len(lat) > limite_pontos
+    if agregado:
+        tamanho = escolher_tamanho_celula(lat, lon)
+        dados = agregar_em_grade(lat, lon, tamanho, status)
+        st.caption(
+            f"{len(lat):,} pontos agrupados em {len(dados):,} células de {tamanho:g}°. "
+            "Clique numa célula para aproximar e ver os pontos.".replace(',', '.')
+        )
+        # Área do círculo proporcional à quantidade, sem passar da metade da célula
+        dados['raio'] = ((tamanho * METROS_POR_GRAU / 2) * np.sqrt(dados['n'] / dados['n'].max())).round().astype(int)
+        dados['cor'] = _cores(dados['status'], cores_status) if status is not None else [list(cor)] * len(dados)
+        if status is not None:
+            dados['status'] = dados['status'].fillna('Sem status').astype(str)
+            html = "<b>{n}</b> pontos<br>Predominante: {status} ({pct}%)"
+        else:
+            html = "<b>{n}</b> pontos"
+        camada = pdk.Layer(
+            "ScatterplotLayer", id="celulas", data=dados.round(CASAS_DECIMAIS),
+            get_position=['lon', 'lat'], get_fill_color='cor', get_radius='raio',
+            opacity=0.6, radius_min_pixels=3, pickable=True,
+        )
+    else:
+        dados = pd.DataFrame({'lat': np.round(lat, CASAS_DECIMAIS), 'lon': np.round(lon, CASAS_DECIMAIS)})
+        if status is not None:
+            dados['cor'] = _cores(status, cores_status)
+        if rotulo is not None:
+            dados['rotulo'] = rotulo
+        camada = pdk.Layer(
+            "ScatterplotLayer", id="pontos", data=dados,
+            get_position=['lon', 'lat'], get_fill_color='cor' if status is not None else list(cor),
+            get_radius=raio_metros, opacity=0.7, radius_min_pixels=3, pickable=rotulo is not None,
+        )
+        html = "{rotulo}" if rotulo is not None else None
+
+    deck_args = {}
+    if map_style:
+        deck_args['map_style'] = map_style
+    deck = pdk.Deck(
+        layers=[camada],
+        initial_view_state=pdk.ViewState(
+            latitude=float(np.mean(lat)), longitude=float(np.mean(lon)),
+            zoom=zoom if zoom is not None and not foco else _zoom_para(lat, lon), pitch=0,
+        ),
+        tooltip={"html": html, "style": {"backgroundColor": "steelblue", "color": "white"}} if html else False,
+        **deck_args,
+    )
+    _json_compacto(deck)
+    # A versão muda a cada troca de área, para que a seleção anterior não seja reaplicada
+    chave_grafico = f"{key}_{st.session_state.get(chave_versao, 0)}"
+    if not agregado:
+        st.pydeck_chart(deck, key=chave_grafico)
+        return
+    evento = st.pydeck_chart(deck, on_select="rerun", selection_mode="single-object", key=chave_grafico)
+    selecionadas = (evento.selection.get('objects') or {}).get('celulas') if evento else None
+    if selecionadas:
+        celula = selecionadas[0]
+        st.session_state[chave_foco] = (
+            celula['lat_min'], celula['lon_min'], celula['lat_min'] + tamanho, celula['lon_min'] + tamanho,
+        )
+        st.session_state[chave_versao] = st.session_state.get(chave_versao, 0) + 1
+        st.rerun()
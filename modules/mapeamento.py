@@ -2,6 +2,7 @@
 import streamlit as st
 import pandas as pd
 from modules.tutorial_helper import tutorial_button # <-- NOVO IMPORT
+from modules.mapas import exibir_mapa
 
 def ferramenta_mapeamento(df):
     # 🚨 NOVO: Chamada do botão de tutorial
@@ -13,8 +14,8 @@ def ferramenta_mapeamento(df):
         return
 
     col1, col2 = st.columns(2)
-    cidade = col1.selectbox("Filtrar por Cidade:", sorted(df[city_col].dropna().unique()), index=None, placeholder="Selecione...")
-    rep = col2.selectbox("Filtrar por Representante:", sorted(df[rep_col].dropna().unique()), index=None, placeholder="Selecione...")
+    cidade = col1.selectbox("Filtrar por Cidade:", sorted(df[city_col].dropna().unique()), index=None, placeholder="Selecione...", key="map_cidade", persist_state="session")
+    rep = col2.selectbox("Filtrar por Representante:", sorted(df[rep_col].dropna().unique()), index=None, placeholder="Selecione...", key="map_representante", persist_state="session")
 
     filtrado = df.copy()
     if cidade:
@@ -24,5 +25,4 @@ def ferramenta_mapeamento(df):
 
     st.dataframe(filtrado[[rep_col, city_col, km_col] + [c for c in filtrado.columns if c not in [rep_col, city_col, km_col]]])
 
-    map_data = filtrado.rename(columns={lat_col: 'lat', lon_col: 'lon'})
-    st.map(map_data)
\ No newline at end of file
+    exibir_mapa(filtrado, key="mapa_mapeamento", lat_col=lat_col, lon_col=lon_col, coluna_rotulo=city_col)
\ No newline at end of file
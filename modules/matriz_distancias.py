@@ -0,0 +1,157 @@
+# modules/matriz_distancias.py
+"""
+Armazenamento persistente (SQLite) de distâncias RT -> cidade por provedor.
+
+Cada par é identificado pelas coordenadas de origem/destino (arredondadas a
+5 casas, ~1 m) e pelo nome do provedor. Os pares ausentes são calculados em
+lote pelo provedor escolhido e gravados, de modo que auditorias repetidas
+não recalculam nem refazem requisições para o mesmo par.
+"""
+import json
+import os
+import sqlite3
+import threading
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+from modules.geo import haversine_km
+
+CAMINHO_PADRAO = os.path.join("cache", "distancias.sqlite")
+ESCALA_COORD = 100000  # 5 casas decimais
+
+
+class ProvedorHaversine:
+    """Distância em linha reta (sem requisições externas)."""
+    nome = "haversine"
+
+    def distancias_pares(self, lat_o, lon_o, lat_d, lon_d):
+        return haversine_km(lat_o, lon_o, lat_d, lon_d)
+
+
+class ProvedorOSRM:
+    """
+    Distância rodoviária via API /table de um servidor compatível com OSRM
+    (OSRM local ou stand-in compatível). As requisições são feitas em
+    matrizes de até `lote` origens para cada destino.
+    """
+    nome = "osrm"
+
+    def __init__(self, url_base=None, perfil="driving", lote=100, timeout=30):
+        self.url_base = (url_base or os.environ.get("OSRM_URL", "http://localhost:5000")).rstrip("/")
+        self.perfil = perfil
+        self.lote = lote
+        self.timeout = timeout
+
+    def _tabela(self, origens, destino):
+        """Distâncias (km) de várias origens [(lat, lon)] para um destino (lat, lon)."""
+        pontos = list(origens) + [destino]
+        coords = ";".join(f"{lon:.6f},{lat:.6f}" for lat, lon in pontos)
+        fontes = ";".join(str(i) for i in range(len(origens)))
+        url = (f"{self.url_base}/table/v1/{self.perfil}/{coords}"
+               f"?sources={fontes}&destinations={len(origens)}&annotations=distance")
+        with urllib.request.urlopen(url, timeout=self.timeout) as resposta:
+            dados = json.load(resposta)
+        if dados.get("code") != "Ok":
+            raise RuntimeError(f"OSRM respondeu '{dados.get('code')}': {dados.get('message', '')}")
+        return np.array([np.nan if linha[0] is None else linha[0] / 1000.0 for linha in dados["distances"]])
+
+    def distancias_pares(self, lat_o, lon_o, lat_d, lon_d):
+        df = pd.DataFrame({'lat_o': lat_o, 'lon_o': lon_o, 'lat_d': lat_d, 'lon_d': lon_d})
+        resultado = np.full(len(df), np.nan)
+        # Agrupa por destino (cidade): uma matriz N origens x 1 destino por lote
+        for (lat_dest, lon_dest), grupo in df.groupby(['lat_d', 'lon_d'], sort=False):
+            posicoes = grupo.index.to_numpy()
+            origens = list(zip(grupo['lat_o'], grupo['lon_o']))
+            for inicio in range(0, len(origens), self.lote):
+                resultado[posicoes[inicio:inicio + self.lote]] = self._tabela(origens[inicio:inicio + self.lote], (lat_dest, lon_dest))
+        return resultado
+
+
+PROVEDORES = {
+    ProvedorHaversine.nome: ProvedorHaversine,
+    ProvedorOSRM.nome: ProvedorOSRM,
+}
+
+
+class MatrizDistancias:
+    """Store de distâncias em SQLite com consulta e preenchimento vetorizados."""
+
+    def __init__(self, caminho=CAMINHO_PADRAO):
+        self.caminho = caminho
+        if os.path.dirname(caminho):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("""
+            CREATE TABLE IF NOT EXISTS distancias (
+                provedor TEXT NOT NULL,
+                lat_o INTEGER NOT NULL, lon_o INTEGER NOT NULL,
+                lat_d INTEGER NOT NULL, lon_d INTEGER NOT NULL,
+                km REAL,
+                PRIMARY KEY (provedor, lat_o, lon_o, lat_d, lon_d)
+            ) WITHOUT ROWID
+        """)
+        self._conexao.commit()
+
+    @staticmethod
+    def _chaves(lat_o, lon_o, lat_d, lon_d):
+        return pd.DataFrame({
+            'lat_o': np.round(np.asarray(lat_o, dtype=np.float64) * ESCALA_COORD).astype(np.int64),
+            'lon_o': np.round(np.asarray(lon_o, dtype=np.float64) * ESCALA_COORD).astype(np.int64),
+            'lat_d': np.round(np.asarray(lat_d, dtype=np.float64) * ESCALA_COORD).astype(np.int64),
+            'lon_d': np.round(np.asarray(lon_d, dtype=np.float64) * ESCALA_COORD).astype(np.int64),
+        })
+
+    def get_many(self, lat_o, lon_o, lat_d, lon_d, provedor="haversine"):
+        """Distâncias (km) gravadas para os pares informados; NaN para pares ausentes."""
+        chaves = self._chaves(lat_o, lon_o, lat_d, lon_d)
+        if chaves.empty:
+            return np.array([], dtype=np.float64)
+        unicas = chaves.drop_duplicates()
+        with self._lock:
+            self._conexao.execute("CREATE TEMP TABLE IF NOT EXISTS consulta (lat_o INTEGER, lon_o INTEGER, lat_d INTEGER, lon_d INTEGER)")
+            self._conexao.execute("DELETE FROM consulta")
+            self._conexao.executemany("INSERT INTO consulta VALUES (?, ?, ?, ?)", unicas.itertuples(index=False, name=None))
+            encontrados = pd.read_sql_query(
+                """SELECT c.lat_o, c.lon_o, c.lat_d, c.lon_d, d.km FROM consulta c
+                   JOIN distancias d ON d.provedor = ? AND d.lat_o = c.lat_o AND d.lon_o = c.lon_o
+                                    AND d.lat_d = c.lat_d AND d.lon_d = c.lon_d""",
+                self._conexao, params=(provedor,)
+            )
+        return chaves.merge(encontrados, on=['lat_o', 'lon_o', 'lat_d', 'lon_d'], how='left')['km'].to_numpy(dtype=np.float64)
+
+    def put_many(self, lat_o, lon_o, lat_d, lon_d, km, provedor="haversine"):
+        """Grava (ou substitui) as distâncias dos pares informados."""
+        chaves = self._chaves(lat_o, lon_o, lat_d, lon_d)
+        chaves['km'] = np.asarray(km, dtype=np.float64)
+        chaves = chaves.dropna(subset=['km'])
+        linhas = ((provedor, *linha) for linha in chaves.itertuples(index=False, name=None))
+        with self._lock:
+            self._conexao.executemany("INSERT OR REPLACE INTO distancias VALUES (?, ?, ?, ?, ?, ?)", linhas)
+            self._conexao.commit()
+
+    def obter(self, lat_o, lon_o, lat_d, lon_d, provedor):
+        """
+        Distâncias dos pares pelo provedor informado (instância de Provedor*):
+        lê o que já existe e calcula/grava apenas os pares ausentes, em lote.
+        """
+        km = self.get_many(lat_o, lon_o, lat_d, lon_d, provedor.nome)
+        faltantes = np.isnan(km)
+        if faltantes.any():
+            pares = pd.DataFrame({
+                'lat_o': np.asarray(lat_o, dtype=np.float64)[faltantes], 'lon_o': np.asarray(lon_o, dtype=np.float64)[faltantes],
+                'lat_d': np.asarray(lat_d, dtype=np.float64)[faltantes], 'lon_d': np.asarray(lon_d, dtype=np.float64)[faltantes],
+            })
+            unicos = pares.drop_duplicates().reset_index(drop=True)
+            unicos['km'] = provedor.distancias_pares(unicos['lat_o'].to_numpy(), unicos['lon_o'].to_numpy(),
+                                                     unicos['lat_d'].to_numpy(), unicos['lon_d'].to_numpy())
+            self.put_many(unicos['lat_o'], unicos['lon_o'], unicos['lat_d'], unicos['lon_d'], unicos['km'], provedor.nome)
+            km[faltantes] = pares.merge(unicos, on=['lat_o', 'lon_o', 'lat_d', 'lon_d'], how='left')['km'].to_numpy()
+        return km
+
+    def total_pares(self):
+        with self._lock:
+            return dict(self._conexao.execute("SELECT provedor, COUNT(*) FROM distancias GROUP BY provedor").fetchall())
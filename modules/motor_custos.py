@@ -0,0 +1,224 @@
+# modules/motor_custos.py
+import numpy as np
+import pandas as pd
+
+from modules.gazetteer import normalizar_cidade
+from modules.geo import MEMORIA_BLOCO_BYTES, haversine_km
+
+TERMOS_RTS_ESPECIAIS = ('STELLANTIS', 'CEABS', 'FCA CHRYSLER')
+
+COLUNAS_DIST = [
+    'Representante', 'Distancia (km)', 'KM_Fixo_Custo', 'Valor_KM', 'Abrangencia',
+    'Telefone', 'Cidade RT', 'UF RT', 'KM_TOTAL_BASE', 'KM_A_PAGAR', 'Custo_Correto_R$'
+]
+
+
+class MotorCustos:
+    """
+    Motor de custos do Otimizador.
+
+    Normaliza o Mapeamento uma única vez numa tabela de rotas
+    (Representante, cidade) -> KM fixo, valor do KM e abrangência; a coordenada
+    de atendimento de cada cidade vem do Gazetteer do Mapeamento.
+    A partir delas calcula, de forma vetorizada, as distâncias e o
+    Custo_Correto_R$ de todos os RTs para todas as cidades pedidas.
+    """
+
+    def __init__(self, df_map, rt_index, gazetteer, map_rep_col, map_city_col,
+                 map_km_col=None, map_valor_km_col=None, map_abrang_col=None, incluir_especiais=False,
+                 cache=None, matriz_distancias=None, provedor=None):
+        self.indice = rt_index if incluir_especiais else rt_index.subconjunto(TERMOS_RTS_ESPECIAIS)
+        # Cache por cidade (opcional) compartilhado entre execuções; chave = (hash do Mapeamento, cidade, especiais)
+        self.cache = cache
+        self.hash_mapeamento = rt_index.hash_conteudo
+        self.incluir_especiais = incluir_especiais
+        # Distância de fallback (sem KM fixo): store persistente + provedor; sem provedor, Haversine
+        self.matriz_distancias = matriz_distancias
+        self.provedor = provedor
+        self.nome_provedor = provedor.nome if provedor is not None else 'haversine'
+        self.aviso_provedor = None
+
+        def _numerico(col):
+            return pd.to_numeric(df_map[col], errors='coerce') if col else np.nan
+
+        rotas = pd.DataFrame({
+            'Representante': df_map[map_rep_col].astype(str).str.strip().str.upper(),
+            'CIDADE_KEY': normalizar_cidade(df_map[map_city_col]),
+            'KM_Fixo_Map': _numerico(map_km_col),
+            'Valor_KM': _numerico(map_valor_km_col),
+            'Abrangencia': _numerico(map_abrang_col),
+        })
+        # A primeira linha de cada par (RT, cidade) prevalece, como no filtro por rota anterior
+        self.rotas = rotas.drop_duplicates(subset=['Representante', 'CIDADE_KEY'])
+
+        # Ponto de atendimento por cidade (chave sem acento): primeira linha válida do Mapeamento
+        self.pontos = gazetteer.pontos[['lat', 'lon']]
+
+    def _aplicar_custos(self, df):
+        """Cruza (RT, cidade) com as rotas e aplica a regra (KM Fixo * 2 - Abrangência) * Valor KM."""
+        df = df.merge(self.rotas, on=['Representante', 'CIDADE_KEY'], how='left')
+        # Se o KM Fixo não for um número válido, usa a distância do provedor (Haversine por padrão) como fallback
+        km_fixo = df['KM_Fixo_Map']
+        df['KM_Fixo_Custo'] = km_fixo.where(km_fixo > 0, self._distancias_fallback(df, ~(km_fixo > 0)))
+        df['Valor_KM'] = df['Valor_KM'].fillna(0)
+        df['Abrangencia'] = df['Abrangencia'].fillna(0)
+        df['KM_TOTAL_BASE'] = df['KM_Fixo_Custo'] * 2
+        df['KM_A_PAGAR'] = (df['KM_TOTAL_BASE'] - df['Abrangencia']).clip(lower=0)
+        df['Custo_Correto_R$'] = df['KM_A_PAGAR'] * df['Valor_KM']
+        return df
+
+    def _distancias_fallback(self, df, sem_km_fixo):
+        """
+        Distância usada no lugar do KM fixo. Com um provedor configurado, consulta
+        o store persistente (calculando só os pares ausentes); se o provedor
+        falhar, registra o aviso em self.aviso_provedor e mantém o Haversine.
+        """
+        distancia = df['Distancia (km)']
+        if self.provedor is None or self.matriz_distancias is None or self.nome_provedor == 'haversine' or not sem_km_fixo.any():
+            return distancia
+        pares = df.loc[sem_km_fixo, ['Representante', 'CIDADE_KEY']]
+        lat_rt, lon_rt = self.indice.coordenadas_de(pares['Representante'])
+        pontos = self.pontos.reindex(pares['CIDADE_KEY'].to_numpy())
+        lat_cid, lon_cid = pontos['lat'].to_numpy(), pontos['lon'].to_numpy()
+        validos = ~(np.isnan(lat_rt) | np.isnan(lat_cid))
+        km = np.full(len(pares), np.nan)
+        try:
+            km[validos] = self.matriz_distancias.obter(lat_rt[validos], lon_rt[validos], lat_cid[validos], lon_cid[validos], self.provedor)
+        except Exception as e:
+            self.aviso_provedor = f"Provedor de distâncias '{self.nome_provedor}' indisponível ({e}). Usando distância Haversine."
+            return distancia
+        resultado = distancia.copy()
+        resultado.loc[sem_km_fixo] = pd.Series(km, index=pares.index).fillna(distancia[sem_km_fixo])
+        return resultado
+
+    def matriz_custos(self, cidades):
+        """
+        DataFrame longo (cidade x RT) com distâncias e custos de todos os RTs
+        para as cidades informadas. Cidades sem ponto no Mapeamento ficam de fora.
+        """
+        chaves = pd.unique(normalizar_cidade(cidades))
+        pontos = self.pontos.loc[self.pontos.index.intersection(chaves)]
+        n_rts = len(self.indice)
+        if pontos.empty or n_rts == 0:
+            return pd.DataFrame(columns=['CIDADE_KEY'] + COLUNAS_DIST)
+
+        passo = max(1, MEMORIA_BLOCO_BYTES // (8 * n_rts))
+        blocos = []
+        for inicio in range(0, len(pontos), passo):
+            bloco = pontos.iloc[inicio:inicio + passo]
+            dist = haversine_km(bloco['lat'].to_numpy()[:, np.newaxis], bloco['lon'].to_numpy()[:, np.newaxis],
+                                self.indice.lat[np.newaxis, :], self.indice.lon[np.newaxis, :])
+            blocos.append(pd.DataFrame({
+                'CIDADE_KEY': np.repeat(bloco.index.to_numpy(), n_rts),
+                'Representante': np.tile(self.indice.chaves, len(bloco)),
+                'Distancia (km)': dist.ravel(),
+                'Telefone': np.tile(self.indice.telefones, len(bloco)),
+                'Cidade RT': np.tile(self.indice.cidades, len(bloco)),
+                'UF RT': np.tile(self.indice.ufs, len(bloco)),
+            }))
+        df = self._aplicar_custos(pd.concat(blocos, ignore_index=True))
+        return df[['CIDADE_KEY'] + COLUNAS_DIST]
+
+    def _chave_cache(self, chave):
+        return (self.hash_mapeamento, chave, self.incluir_especiais, self.nome_provedor)
+
+    def custos_cidades(self, cidades):
+        """
+        Retorna {chave da cidade: (df_dist, rt_sugerido)} no mesmo formato do
+        cálculo por cidade: um registro por RT e o RT mais próximo como sugestão.
+        Cidades já presentes no cache não são recalculadas; as demais são
+        calculadas juntas numa única passada vetorizada.
+        """
+        chaves = pd.unique(normalizar_cidade(cidades))
+        resultado, faltantes = {}, []
+        for chave in chaves:
+            em_cache = self.cache.get(self._chave_cache(chave)) if self.cache is not None else None
+            if em_cache is None:
+                faltantes.append(chave)
+            elif em_cache[1] is not None:
+                resultado[chave] = em_cache
+        if not faltantes:
+            return resultado
+
+        self.aviso_provedor = None
+        df = self.matriz_custos(faltantes)
+        calculados = {}
+        for chave, grupo in df.groupby('CIDADE_KEY', sort=False):
+            df_dist = grupo[COLUNAS_DIST].reset_index(drop=True)
+            calculados[chave] = (df_dist, df_dist.loc[df_dist['Distancia (km)'].idxmin()])
+        resultado.update(calculados)
+        # Resultados calculados com Haversine por falha do provedor não vão para o cache
+        if self.cache is not None and self.aviso_provedor is None:
+            # Cidades sem ponto no Mapeamento também entram no cache (resultado vazio)
+            for chave in faltantes:
+                self.cache.set(self._chave_cache(chave), calculados.get(chave, (pd.DataFrame(), None)))
+        return resultado
+
+    def sugeridos_por_cidade(self, cidades):
+        """
+        RT sugerido (mais próximo) de cada cidade, já com o custo calculado.
+        Retorna um DataFrame indexado pela chave da cidade com as colunas de COLUNAS_DIST.
+        """
+        chaves = pd.unique(normalizar_cidade(cidades))
+        # Cidades já calculadas (ex.: pela visão da seleção) reaproveitam o RT sugerido do cache
+        em_cache = {}
+        if self.cache is not None:
+            for chave in chaves:
+                item = self.cache.get(self._chave_cache(chave))
+                if item is not None and item[1] is not None:
+                    em_cache[chave] = item[1]
+        pontos = self.pontos.loc[self.pontos.index.intersection(chaves).difference(list(em_cache))]
+        if pontos.empty or len(self.indice) == 0:
+            return self._juntar_sugeridos(pd.DataFrame(columns=COLUNAS_DIST, index=pd.Index([], name='CIDADE_KEY')), em_cache)
+
+        self.aviso_provedor = None
+        indices, distancias = self.indice.k_mais_proximos(pontos['lat'].to_numpy(), pontos['lon'].to_numpy(), 1)
+        mais_proximo = indices[:, 0]
+        df = pd.DataFrame({
+            'CIDADE_KEY': pontos.index.to_numpy(),
+            'Representante': self.indice.chaves[mais_proximo],
+            'Distancia (km)': distancias[:, 0],
+            'Telefone': self.indice.telefones[mais_proximo],
+            'Cidade RT': self.indice.cidades[mais_proximo],
+            'UF RT': self.indice.ufs[mais_proximo],
+        })
+        return self._juntar_sugeridos(self._aplicar_custos(df).set_index('CIDADE_KEY')[COLUNAS_DIST], em_cache)
+
+    @staticmethod
+    def _juntar_sugeridos(df_sugeridos, em_cache):
+        if not em_cache:
+            return df_sugeridos
+        df_cache = pd.DataFrame(list(em_cache.values()), index=pd.Index(list(em_cache), name='CIDADE_KEY'))[COLUNAS_DIST]
+        if df_sugeridos.empty:
+            return df_cache
+        return pd.concat([df_sugeridos, df_cache])
+
+    def dados_pares(self, cidades, representantes):
+        """
+        Distância e contato de cada par (cidade, RT) informado, alinhados à entrada.
+        Pares cujo RT não está no índice (ou cuja cidade não tem ponto) ficam com
+        distância NaN e "N/A" nos demais campos.
+        """
+        chaves = normalizar_cidade(cidades).to_numpy()
+        nomes = pd.Series(representantes).astype(str).str.strip().str.upper()
+        posicoes = nomes.map(self.indice.posicao_por_nome).to_numpy(dtype=float)
+        pontos = self.pontos.reindex(chaves)
+
+        validos = ~np.isnan(posicoes) & pontos['lat'].notna().to_numpy()
+        pos = posicoes[validos].astype(np.int64)
+        distancia = np.full(len(chaves), np.nan)
+        distancia[validos] = haversine_km(pontos['lat'].to_numpy()[validos], pontos['lon'].to_numpy()[validos],
+                                          self.indice.lat[pos], self.indice.lon[pos])
+
+        def _atributo(valores):
+            saida = np.full(len(chaves), "N/A", dtype=object)
+            saida[validos] = valores[pos]
+            return saida
+
+        return pd.DataFrame({
+            'Distancia (km)': distancia,
+            'Telefone': _atributo(self.indice.telefones),
+            'Cidade RT': _atributo(self.indice.cidades),
+            'UF RT': _atributo(self.indice.ufs),
+            'RT_ENCONTRADO': validos,
+        })
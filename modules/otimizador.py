@@ -1,8 +1,15 @@
 # modules/otimizador.py (CÓDIGO CORRIGIDO PARA KEYERROR DE COORDENADAS)
 import streamlit as st
 import pandas as pd
-from haversine import haversine, Unit
-from modules.utils import convert_df_to_csv 
+import numpy as np
+from functools import partial
+from modules.cache import CacheLRU
+from modules.gazetteer import normalizar_cidade, normalizar_cidade_valor
+from modules.motor_custos import MotorCustos
+from modules.matriz_distancias import MatrizDistancias, PROVEDORES
+from modules.data_loader import obter_rt_index, obter_gazetteer
+from modules.exportacao import botao_download
+from modules.indice_entidades import IndiceEntidades, normalizar_chaves
 from modules.tutorial_helper import tutorial_button
 
 # --- FUNÇÃO HELPER (DD/MM/AAAA) ---
@@ -14,93 +21,29 @@ def format_date_safe(t):
     return dt.strftime('%d/%m/%Y')
 # --- FIM DA FUNÇÃO HELPER ---
 
-@st.cache_data
-def _calcular_distancias_e_custos(df_map, cidade_atendimento, ponto, map_rep_col, map_city_col, map_valor_km_col, 
-                                  map_tel_col, map_abrang_col, map_km_col, map_rep_lat, map_rep_lon, map_rep_city_col, map_rep_uf_col, incluir_especiais):
+# Limites do cache de custos por cidade (cada item guarda a tabela de todos os RTs para a cidade)
+CACHE_CUSTOS_MAX_CIDADES = 500
+CACHE_CUSTOS_TTL_SEGUNDOS = 6 * 3600
+
+@st.cache_resource
+def obter_cache_custos():
+    """ Cache de custos por cidade, único no servidor e preservado entre reruns. """
+    return CacheLRU(max_itens=CACHE_CUSTOS_MAX_CIDADES, ttl_segundos=CACHE_CUSTOS_TTL_SEGUNDOS)
+
+@st.cache_resource
+def obter_matriz_distancias():
+    """ Store persistente (SQLite) de distâncias RT -> cidade, compartilhado entre sessões. """
+    return MatrizDistancias()
+
+@st.cache_resource(max_entries=8)
+def _obter_motor_custos(mapeamento_hash, colunas_map, incluir_especiais, nome_provedor, _df_map, _rt_index, _gazetteer):
     """
-    Calcula distâncias (Haversine para ranking), custos (KM Fixo para regra) e RT sugerido para um único ponto (cidade).
-    Retorna o dataframe de distâncias e o RT sugerido.
+    Motor de custos (Mapeamento normalizado em rotas e pontos) reutilizado entre execuções.
+    A chave é o hash do Mapeamento + colunas identificadas + filtro de RTs especiais + provedor de distâncias.
     """
-    distancias = []
-    
-    try:
-        ponto_lat = float(str(ponto[0]).replace(',', '.'))
-        ponto_lon = float(str(ponto[1]).replace(',', '.'))
-        ponto_limpo = (ponto_lat, ponto_lon)
-    except (ValueError, TypeError, IndexError):
-        # Este erro é crítico, mas não deve parar a aplicação
-        return pd.DataFrame(), None # Retorna vazio
-
-    # 🚨 CORREÇÃO CRÍTICA: Filtra os RTs especiais ANTES de qualquer cálculo
-    df_map_filtrado = df_map.copy()
-    if not incluir_especiais:
-        termos_excluidos = ['STELLANTIS', 'CEABS', 'FCA CHRYSLER']
-        mascara = ~df_map_filtrado[map_rep_col].str.contains('|'.join(termos_excluidos), case=False, na=False)
-        df_map_filtrado = df_map_filtrado[mascara]
-
-    # Pega a lista de RTs únicos para iterar
-    rts_unicos = df_map_filtrado.drop_duplicates(subset=[map_rep_col])
-
-    for _, rt_base in rts_unicos.iterrows():
-        try:
-            # 🚨 CORREÇÃO: Usando as variáveis flexíveis de Lat/Lon do RT
-            lat_rt = float(str(rt_base[map_rep_lat]).replace(',', '.'))
-            lon_rt = float(str(rt_base[map_rep_lon]).replace(',', '.'))
-            # 1. Distância Haversine: Usada APENAS para ranking (Otimização)
-            dist_haversine = haversine((lat_rt, lon_rt), ponto_limpo, unit=Unit.KILOMETERS)
-        except (ValueError, TypeError):
-            dist_haversine = float('inf') 
-        
-        # 2. KM Fixo: Usado para o CÁLCULO do custo (Regra de Negócio)
-        # 🚨 CORREÇÃO: Garante que o fallback para Haversine seja usado se o KM fixo for inválido ou ausente.
-        rt_nome = rt_base[map_rep_col]
-        rota_especifica = df_map_filtrado[
-            (df_map_filtrado[map_rep_col] == rt_nome) & 
-            (df_map_filtrado[map_city_col].str.upper() == cidade_atendimento.upper())
-        ]
-        
-        if not rota_especifica.empty:
-            dados_rota = rota_especifica.iloc[0]
-            km_fixo_custo = pd.to_numeric(dados_rota.get(map_km_col), errors='coerce')
-            valor_km = pd.to_numeric(dados_rota.get(map_valor_km_col), errors='coerce')
-            abrangencia = pd.to_numeric(dados_rota.get(map_abrang_col), errors='coerce')
-        else: # Se a rota específica não existe, zera os custos fixos
-            km_fixo_custo, valor_km, abrangencia = None, None, None
-
-        # Se o KM Fixo não for um número válido, usa a distância Haversine como fallback
-        if not (pd.notna(km_fixo_custo) and km_fixo_custo > 0):
-            km_fixo_custo = dist_haversine
-        
-        distancias.append({
-            'Representante': str(rt_nome), 
-            'Distancia (km)': dist_haversine, # Para ranking de proximidade
-            'KM_Fixo_Custo': km_fixo_custo, # Para o cálculo da regra
-            'Valor_KM': valor_km if pd.notna(valor_km) else 0,
-            'Abrangencia': abrangencia if pd.notna(abrangencia) else 0, 
-            'Telefone': rt_base[map_tel_col] if map_tel_col else "N/A",
-            'Cidade RT': rt_base[map_rep_city_col] if map_rep_city_col and map_rep_city_col in rt_base else "N/A",
-            'UF RT': rt_base[map_rep_uf_col] if map_rep_uf_col and map_rep_uf_col in rt_base else "N/A"
-        })
-        
-    df_dist = pd.DataFrame(distancias).drop_duplicates(subset=['Representante']).reset_index(drop=True)
-    df_dist = df_dist[df_dist['Distancia (km)'] != float('inf')] 
-    
-    df_dist['Valor_KM'] = pd.to_numeric(df_dist['Valor_KM'], errors='coerce').fillna(0)
-    df_dist['Abrangencia'] = pd.to_numeric(df_dist['Abrangencia'], errors='coerce').fillna(0)
-    df_dist['KM_Fixo_Custo'] = pd.to_numeric(df_dist['KM_Fixo_Custo'], errors='coerce')
-    
-    # --- CÁLCULO DO VALOR CORRETO PARA O RT SUGERIDO (KM Fixo * 2 - Abrangencia) ---
-    df_dist['KM_TOTAL_BASE'] = df_dist['KM_Fixo_Custo'] * 2
-    df_dist['KM_A_PAGAR'] = df_dist['KM_TOTAL_BASE'] - df_dist['Abrangencia']
-    df_dist['KM_A_PAGAR'] = df_dist['KM_A_PAGAR'].clip(lower=0) # Garante que o KM a pagar não seja negativo
-    df_dist['Custo_Correto_R$'] = df_dist['KM_A_PAGAR'] * df_dist['Valor_KM']
-    # --- FIM DO CÁLCULO ---
-        
-    rt_sugerido = None
-    if not df_dist.empty:
-        rt_sugerido = df_dist.sort_values(by='Distancia (km)').iloc[0]
-        
-    return df_dist, rt_sugerido
+    return MotorCustos(_df_map, _rt_index, _gazetteer, incluir_especiais=incluir_especiais, cache=obter_cache_custos(),
+                       matriz_distancias=obter_matriz_distancias(), provedor=PROVEDORES[nome_provedor](),
+                       **dict(colunas_map))
 
 def _arredondar_relatorio(df_report):
     """ Arredonda as colunas de custo e km para 2 casas decimais antes de exportar. """
@@ -112,10 +55,207 @@ def _arredondar_relatorio(df_report):
             df_report_export[col] = pd.to_numeric(df_report_export[col], errors='coerce').round(decimals)
     return df_report_export
 
-def _analisar_proximidade_agendamentos(df, data_col, rep_col, city_col, id_col, cliente_col, valor_desloc_col, pedagio_col, tel_cliente_col):
+def _montar_relatorio_economia(df_otim, motor, os_id_col, os_uf_col, os_cliente_col, os_tel_cliente_col, os_agendado_por_col,
+                               os_rep_col, os_city_col, os_status_col, valor_desloc_col, pedagio_col,
+                               economia_somente_rt_mapeado=False):
+    """
+    Monta o relatório de economia com junções vetorizadas:
+    ordens ⋈ RT sugerido por cidade ⋈ (cidade, RT agendado).
+    Ordens sem cidade ou cuja cidade não tem ponto/RT no Mapeamento ficam de fora.
+    O índice do resultado é o índice original das ordens.
+
+    economia_somente_rt_mapeado=True reproduz a visão da seleção, em que a economia
+    só é calculada quando o RT agendado existe no Mapeamento.
+    """
+    ordens = df_otim[df_otim[os_city_col].notna()]
+    chaves = normalizar_cidade(ordens[os_city_col])
+    sugeridos = motor.sugeridos_por_cidade(chaves)
+    com_sugestao = chaves.isin(sugeridos.index).to_numpy()
+    ordens, chaves = ordens[com_sugestao], chaves[com_sugestao]
+
+    sugerido = sugeridos.reindex(chaves.to_numpy())
+    agendado = motor.dados_pares(chaves, ordens[os_rep_col])
+
+    # "Valor Liberado" do Dashboard (Deslocamento + Pedágio) para cada O.S.
+    valor_agendado = np.zeros(len(ordens))
+    for col in (valor_desloc_col, pedagio_col):
+        if col and col in ordens.columns:
+            valor_agendado += pd.to_numeric(ordens[col], errors='coerce').fillna(0).to_numpy()
+    custo_sugerido = sugerido['Custo_Correto_R$'].to_numpy()
+    if economia_somente_rt_mapeado:
+        economia = np.where(agendado['RT_ENCONTRADO'].to_numpy(), valor_agendado - custo_sugerido, 0.0)
+    else:
+        economia = np.where(valor_agendado > 0, valor_agendado - custo_sugerido, 0.0)
+
+    def _coluna(col):
+        return ordens[col].to_numpy() if col and col in ordens.columns else "N/A"
+
+    return pd.DataFrame({
+        'Numero OS': _coluna(os_id_col),
+        'UF O.S': ordens[os_uf_col].fillna("N/A").to_numpy() if os_uf_col else "N/A",
+        'Cliente': _coluna(os_cliente_col),
+        'Telefone Cliente': _coluna(os_tel_cliente_col),
+        'data agendamento': _coluna('DATA_FORMATADA'),
+        'periodo': _coluna('PERIODO_FINAL'),
+        'Agendado Por': _coluna(os_agendado_por_col),
+        'RT Agendado': _coluna(os_rep_col),
+        'Cidade RT Agendado': agendado['Cidade RT'].to_numpy(),
+        'UF RT Agendado': agendado['UF RT'].to_numpy(),
+        'Cidade O.S': _coluna(os_city_col),
+        'Telefone RT Agendado': agendado['Telefone'].to_numpy(),
+        'Distancia Agendada (km)': agendado['Distancia (km)'].to_numpy(),
+        'Status': _coluna(os_status_col),
+        'Valor Agendado': valor_agendado, # Este é o valor liberado do dashboard
+        'RT Sugerido': sugerido['Representante'].to_numpy(),
+        'Cidade RT Sugerido': sugerido['Cidade RT'].to_numpy(),
+        'UF RT Sugerido': sugerido['UF RT'].to_numpy(),
+        'Distancia Sugerida (km)': sugerido['Distancia (km)'].to_numpy(),
+        'Telefone RT Sugerido': sugerido['Telefone'].to_numpy(),
+        'Valor Sugerido': custo_sugerido,
+        'Economia Potencial (R$)': economia,
+    }, index=ordens.index)
+
+COLUNAS_RELATORIO_SELECAO = [
+    'Numero OS', 'UF O.S', 'Cliente', 'Telefone Cliente', 'data agendamento', 'periodo', 'Agendado Por',
+    'RT Agendado', 'Cidade RT Agendado', 'UF RT Agendado', 'Cidade O.S', 'Telefone RT Agendado',
+    'Distancia Agendada (km)', 'Status', 'Valor Agendado', 'RT Sugerido', 'Distancia Sugerida (km)',
+    'Cidade RT Sugerido', 'UF RT Sugerido', 'Telefone RT Sugerido', 'Valor Sugerido', 'Economia Potencial (R$)'
+]
+
+def _gerar_log_calculo(os_id, cidade, rt_atual, custo_atual, rt_sugerido):
+    """ Log de cálculo de uma O.S.; chamado apenas quando o download é solicitado. """
+    custo_sugerido = rt_sugerido['Custo_Correto_R$']
+    log_content = []
+    log_content.append(f"--- LOG DE CÁLCULO DE CUSTO (OTIMIZADOR) ---")
+    log_content.append(f"OS: {os_id} | Cidade: {cidade}")
+    log_content.append("\n--- CUSTO RT AGENDADO (VALOR LIBERADO DASHBOARD) ---")
+    log_content.append(f"RT Agendado: {rt_atual}")
+    log_content.append(f"Valor Liberado (Deslocamento + Pedágio): R$ {custo_atual:,.2f}")
+    
+    log_content.append("\n--- CUSTO RT SUGERIDO (CÁLCULO MERCURIO) ---")
+    log_content.append(f"RT Sugerido: {rt_sugerido['Representante']}")
+    log_content.append(f"1. KM Fixo Base (Mapeamento ou Haversine): {rt_sugerido['KM_Fixo_Custo']:.2f} km")
+    log_content.append(f"2. Distância Total (Ida e Volta): {rt_sugerido['KM_Fixo_Custo']:.2f} * 2 = {rt_sugerido['KM_TOTAL_BASE']:.2f} km")
+    log_content.append(f"3. Abrangência do RT: {rt_sugerido['Abrangencia']:.2f} km")
+    log_content.append(f"4. Taxa por KM do RT: R$ {rt_sugerido['Valor_KM']:.2f}")
+    log_content.append(f"5. KM a Pagar (após franquia): max(0, {rt_sugerido['KM_TOTAL_BASE']:.2f} - {rt_sugerido['Abrangencia']:.2f}) = {rt_sugerido['KM_A_PAGAR']:.2f} km")
+    log_content.append(f"6. Custo Correto Final: {rt_sugerido['KM_A_PAGAR']:.2f} km * R$ {rt_sugerido['Valor_KM']:.2f} = R$ {custo_sugerido:,.2f}")
+    return "\n".join(log_content).encode('utf-8')
+
+def _render_card_custo(ordem, linha, df_dist, rt_sugerido, os_id_col, os_city_col, os_cliente_col, os_agendado_por_col):
+    """ Desenha o card (expander) de custo de uma O.S.: RT agendado x RT sugerido. """
+    rt_atual = linha['RT Agendado']
+    custo_atual = linha['Valor Agendado'] # O custo atual é o valor liberado do dashboard
+    periodo = linha['periodo']
+
+    expander_title = f"OS: {ordem[os_id_col]}"
+    if periodo != "N/A":
+        expander_title += f" ({periodo})" 
+    expander_title += f" | Data: {linha['data agendamento']} | Cliente: {ordem[os_cliente_col]}"
+    
+    agendado_por_val = "N/A"
+    if os_agendado_por_col and os_agendado_por_col in ordem and pd.notna(ordem[os_agendado_por_col]):
+        agendado_por_val = ordem[os_agendado_por_col]
+
+    with st.expander(expander_title):
+        st.caption(f"Agendado Por: {agendado_por_val}")
+        col1, col2 = st.columns(2) # Coluna para RT Agendado e Sugerido
+        dados_rt_atual = df_dist[df_dist['Representante'] == rt_atual]
+        dist_atual, economia_dist = float('inf'), 0.0
+
+        with col1:
+            if pd.isna(rt_atual) or str(rt_atual).strip() == "" or str(rt_atual).strip() == "NAN" or dados_rt_atual.empty:
+                st.info(f"**RT Agendado:** (Nenhum ou Não Mapeado)")
+                st.metric("Distância (Haversine)", "N/A")
+                st.metric("Custo Estimado (RT Agendado)", "N/A")
+            else:
+                st.info(f"**RT Agendado:** {rt_atual}")
+                dados_rt_atual_series = dados_rt_atual.iloc[0]
+                dist_atual = dados_rt_atual_series['Distancia (km)']
+                st.metric("Distância (Haversine)", f"{dist_atual:.1f} km") # A distância ainda é a do RT agendado
+                st.metric("Custo Estimado (RT Agendado)", f"R$ {custo_atual:.2f}")
+                st.caption(f"KM Fixo Base: {dados_rt_atual_series['KM_Fixo_Custo']:.1f} km")
+                st.caption(f"Telefone: {dados_rt_atual_series['Telefone']}")
+        
+        with col2:
+            st.success(f"**Sugestão (Mais Próximo):** {rt_sugerido['Representante']}")
+            dist_sugerida = rt_sugerido['Distancia (km)']
+            custo_sugerido = rt_sugerido['Custo_Correto_R$']
+            economia_custo = linha['Economia Potencial (R$)']
+            if dist_atual != float('inf'):
+                economia_dist = dist_atual - dist_sugerida # Economia de distância (ainda baseada em Haversine)
+            
+            st.metric("Distância (Haversine)", f"{dist_sugerida:.1f} km", delta=f"{-economia_dist:.1f} km")
+            st.metric("Custo Estimado (RT Sugerido)", f"R$ {custo_sugerido:.2f}", delta=f"R$ {-economia_custo:.2f}")
+            st.caption(f"KM Fixo Base: {rt_sugerido['KM_Fixo_Custo']:.1f} km")
+            st.caption(f"Telefone: {rt_sugerido['Telefone']}")
+
+            # Exibe o cálculo simplificado na tela
+            st.caption(f"Cálculo: ({rt_sugerido['KM_Fixo_Custo']:.1f}km * 2 - {rt_sugerido['Abrangencia']:.0f}km) * R$ {rt_sugerido['Valor_KM']:.2f} = R$ {custo_sugerido:.2f}")
+
+            # --- LOG DE CÁLCULO: gerado só quando o download é solicitado ---
+            st.download_button("Exportar Log de Cálculo (.txt)",
+                               data=partial(_gerar_log_calculo, ordem[os_id_col], ordem[os_city_col], rt_atual, custo_atual, rt_sugerido),
+                               file_name=f"log_otimizador_{ordem[os_id_col]}.txt", mime="text/plain",
+                               key=f"log_btn_{ordem[os_id_col]}", on_click="ignore")
+
+def _ir_para_os():
+    """ Callback do campo 'Ir para O.S.': guarda o destino para a paginação resolver. """
+    st.session_state.otim_ir_para_os = st.session_state.get("otim_busca_os", "").strip()
+
+def _render_cards_paginados(df_report_selecao, ordens_para_analise, motor, os_id_col, os_city_col,
+                            os_cliente_col, os_agendado_por_col):
+    """
+    Lista de cards de custo paginada: apenas as O.S. da página atual geram
+    widgets e têm seus custos por cidade calculados.
+    """
+    col_p1, col_p2, col_p3 = st.columns([2, 1, 2])
+    with col_p1:
+        ordenacao = st.selectbox("Ordenar por:", ["Maior economia potencial", "Ordem da planilha"], key="otim_ordenacao", persist_state="session")
+    with col_p2:
+        tamanho_pagina = st.selectbox("Cards por página:", [10, 25, 50], key="otim_tamanho_pagina", persist_state="session")
+    with col_p3:
+        st.text_input("Ir para O.S.:", key="otim_busca_os", on_change=_ir_para_os, persist_state="session")
+
+    df_ordenado = df_report_selecao
+    if ordenacao == "Maior economia potencial":
+        df_ordenado = df_report_selecao.sort_values('Economia Potencial (R$)', ascending=False, kind='mergesort')
+
+    total_paginas = max(1, -(-len(df_ordenado) // tamanho_pagina))
+    destino = st.session_state.pop("otim_ir_para_os", None)
+    if destino:
+        posicoes = np.flatnonzero(df_ordenado['Numero OS'].astype(str).str.strip().to_numpy() == destino)
+        if len(posicoes):
+            st.session_state.otim_pagina = int(posicoes[0] // tamanho_pagina) + 1
+        else:
+            st.warning(f"O.S. '{destino}' não está na seleção atual.")
+    if st.session_state.get("otim_pagina", 1) > total_paginas:
+        st.session_state.otim_pagina = total_paginas
+
+    pagina = st.number_input(f"Página (de {total_paginas}):", min_value=1, max_value=total_paginas, step=1, key="otim_pagina", persist_state="session")
+    inicio = (pagina - 1) * tamanho_pagina
+    df_pagina = df_ordenado.iloc[inicio:inicio + tamanho_pagina]
+    st.caption(f"Mostrando O.S. {inicio + 1} a {inicio + len(df_pagina)} de {len(df_ordenado)}.")
+
+    # Custos de todos os RTs apenas para as cidades da página visível
+    custos_por_cidade = motor.custos_cidades(df_pagina['Cidade O.S'])
+    for idx, linha in df_pagina.iterrows():
+        df_dist, _ = custos_por_cidade.get(normalizar_cidade_valor(linha['Cidade O.S']), (pd.DataFrame(), None))
+        if df_dist.empty:
+            continue
+        # Mesmo RT sugerido do relatório (o mais próximo da cidade)
+        rt_sugerido = df_dist[df_dist['Representante'] == linha['RT Sugerido']].iloc[0]
+        _render_card_custo(ordens_para_analise.loc[idx], linha, df_dist, rt_sugerido,
+                           os_id_col, os_city_col, os_cliente_col, os_agendado_por_col)
+
+def _analisar_proximidade_agendamentos(df, data_col, rep_col, city_col, id_col, cliente_col, valor_desloc_col, pedagio_col, tel_cliente_col,
+                                       dias_min=6, dias_max=7):
     """
     Analisa o dataframe para encontrar RTs agendados para a mesma cidade
-    em um intervalo de 6 a 7 dias.
+    em um intervalo de dias_min a dias_max dias (padrão: 6 a 7 dias).
+
+    Cada partição (RT, cidade) é ordenada por data e a janela de cada O.S. é
+    localizada por busca binária, em vez de comparar todos os pares.
     """
     if not all([data_col, rep_col, city_col, id_col, cliente_col]):
         st.warning("Não foi possível realizar a análise de proximidade por falta de colunas essenciais.")
@@ -132,83 +272,71 @@ def _analisar_proximidade_agendamentos(df, data_col, rep_col, city_col, id_col,
     
     df_analysis = df[cols_to_use].copy()
     
-    # Converte colunas de custo para numérico e preenche NaNs
-    if valor_desloc_col and valor_desloc_col in df_analysis.columns:
-        df_analysis[valor_desloc_col] = pd.to_numeric(df_analysis[valor_desloc_col], errors='coerce').fillna(0)
-    if pedagio_col and pedagio_col in df_analysis.columns:
-        df_analysis[pedagio_col] = pd.to_numeric(df_analysis[pedagio_col], errors='coerce').fillna(0)
+    # Converte colunas de custo para numérico e soma o custo total de cada O.S.
+    df_analysis['CUSTO_TOTAL'] = 0.0
+    for col in (valor_desloc_col, pedagio_col):
+        if col and col in df_analysis.columns:
+            df_analysis['CUSTO_TOTAL'] += pd.to_numeric(df_analysis[col], errors='coerce').fillna(0)
 
     df_analysis['DATA_DT'] = pd.to_datetime(df_analysis[data_col], errors='coerce')
     
     # Remove linhas onde informações cruciais são nulas
     df_analysis.dropna(subset=['DATA_DT', rep_col, city_col, id_col], inplace=True)
+    if df_analysis.empty:
+        return pd.DataFrame()
     df_analysis[id_col] = df_analysis[id_col].astype(str)
 
     # Ordena para garantir a lógica de comparação
-    df_analysis = df_analysis.sort_values(by=[rep_col, city_col, 'DATA_DT'])
-
-    pares_encontrados = []
+    df_analysis = df_analysis.sort_values(by=[rep_col, city_col, 'DATA_DT'], kind='mergesort').reset_index(drop=True)
+
+    # Chave ordenada = partição (RT, cidade) + instante em segundos: a janela de cada O.S.
+    # vira um intervalo contíguo [inicio, fim) encontrado com searchsorted.
+    particao = df_analysis.groupby([rep_col, city_col], sort=False).ngroup().to_numpy(dtype=np.int64)
+    segundos = df_analysis['DATA_DT'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+    chave = particao * 10**10 + (segundos - segundos.min())
+    inicio_janela = np.searchsorted(chave, chave + dias_min * 86400, side='left')
+    fim_janela = np.searchsorted(chave, chave + (dias_max + 1) * 86400, side='left')
+    inicio_janela = np.maximum(inicio_janela, np.arange(len(chave)) + 1)
+
+    ids = df_analysis[id_col].to_numpy()
+    custos = df_analysis['CUSTO_TOTAL'].to_numpy()
+    linhas_grupo, grupos = [], []
     processed_os_ids = set()
 
-    # Itera sobre o dataframe para formar pares
-    for i in range(len(df_analysis)):
-        # Pega a primeira OS do par potencial
-        os1 = df_analysis.iloc[i]
-        os1_id = os1[id_col]
-
+    for i in range(len(ids)):
         # Se esta OS já foi agrupada, pula para a próxima
-        if os1_id in processed_os_ids:
+        if ids[i] in processed_os_ids:
             continue
 
-        # Inicia um novo grupo com a OS atual
-        current_group = [os1]
-
-        # Compara com todas as OSs subsequentes
-        for j in range(i + 1, len(df_analysis)):
-            os2 = df_analysis.iloc[j]
-            os2_id = os2[id_col]
-
-            # Condições para formar um par: mesmo RT, mesma cidade
-            if (os1[rep_col] == os2[rep_col]) and (os1[city_col] == os2[city_col]):
-                # Calcula a diferença de dias
-                delta = (os2['DATA_DT'] - os1['DATA_DT']).days
-
-                # Se a diferença está no intervalo desejado e a OS ainda não foi processada
-                if delta in [6, 7] and os2_id not in processed_os_ids:
-                    current_group.append(os2)
-            # Se a cidade ou RT mudou, podemos parar de procurar pares para os1
-            elif (os1[rep_col] != os2[rep_col]) or (os1[city_col] != os2[city_col]):
-                break
-        
-        # Se encontramos um grupo (mais de uma OS)
-        if len(current_group) > 1:
-            group_id = f"Grupo_{len(pares_encontrados) + 1}"
-            for os_item in current_group:
-                # Calcula o custo (colunas já foram limpas)
-                custo_desloc = os_item.get(valor_desloc_col, 0)
-                custo_pedagio = os_item.get(pedagio_col, 0)
-                custo_total = custo_desloc + custo_pedagio
-
-                if custo_total <= 0:
-                    continue
-
-                pares_encontrados.append({
-                    'Grupo': group_id,
-                    'Representante': os_item[rep_col],
-                    'Cidade': os_item[city_col],
-                    'Numero OS': os_item[id_col],
-                    'Cliente': os_item[cliente_col],
-                    'Telefone Cliente': os_item.get(tel_cliente_col, "N/A"),
-                    'Data Agendamento': os_item['DATA_DT'].strftime('%d/%m/%Y'),
-                    'Custo Agendado (R$)': custo_total
-                })
-                # Marca a OS como processada para não ser incluída em outros grupos
-                processed_os_ids.add(os_item[id_col])
-
-    if not pares_encontrados:
+        # Grupo = OS atual + OSs ainda livres dentro da janela de dias
+        current_group = [i] + [j for j in range(inicio_janela[i], fim_janela[i]) if ids[j] not in processed_os_ids]
+        if len(current_group) <= 1:
+            continue
+
+        # A numeração segue o total de linhas já encontradas (mesmo critério do relatório anterior)
+        group_id = f"Grupo_{len(linhas_grupo) + 1}"
+        for k in current_group:
+            if custos[k] <= 0:
+                continue
+            linhas_grupo.append(k)
+            grupos.append(group_id)
+            # Marca a OS como processada para não ser incluída em outros grupos
+            processed_os_ids.add(ids[k])
+
+    if not linhas_grupo:
         return pd.DataFrame()
 
-    return pd.DataFrame(pares_encontrados)
+    encontrados = df_analysis.iloc[linhas_grupo]
+    return pd.DataFrame({
+        'Grupo': grupos,
+        'Representante': encontrados[rep_col].to_numpy(),
+        'Cidade': encontrados[city_col].to_numpy(),
+        'Numero OS': encontrados[id_col].to_numpy(),
+        'Cliente': encontrados[cliente_col].to_numpy(),
+        'Telefone Cliente': encontrados[tel_cliente_col].to_numpy() if tel_cliente_col and tel_cliente_col in encontrados.columns else "N/A",
+        'Data Agendamento': encontrados['DATA_DT'].dt.strftime('%d/%m/%Y').to_numpy(),
+        'Custo Agendado (R$)': encontrados['CUSTO_TOTAL'].to_numpy()
+    })
 
 def _filtrar_ordens_com_custo(df, valor_desloc_col, pedagio_col):
     if df is None or df.empty:
@@ -309,6 +437,17 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
             st.error(f"Colunas de Coordenada ou Chave não encontradas no Mapeamento: {', '.join(missing)}")
             return
 
+        # Índice espacial dos RTs (montado uma vez por upload do Mapeamento)
+        rt_index = obter_rt_index(df_map)
+        if rt_index is None or len(rt_index) == 0:
+            st.error("Nenhum RT com coordenadas válidas foi encontrado no Mapeamento.")
+            return
+        # Gazetteer de cidades (chaves sem acento/caixa) com as coordenadas de atendimento
+        gazetteer = obter_gazetteer(df_map)
+        if gazetteer is None:
+            st.error("O Mapeamento não contém as colunas de cidade e coordenadas de atendimento.")
+            return
+
         if not map_rep_city_col:
             st.warning("Coluna 'Cidade Representante' não encontrada no Mapeamento. O relatório será gerado sem essa informação.")
             
@@ -337,9 +476,21 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
         with col_f1:
             all_statuses = df_dados[os_status_col].dropna().unique().tolist()
             default_selection = [s for s in ['Agendada', 'Pendente', 'Aguardando Agendamento', 'Serviços realizados', 'Parcialmente realizado'] if s in all_statuses]
-            status_selecionados = st.multiselect("1. Selecione os status para análise:", options=all_statuses, default=default_selection)
+            status_selecionados = st.multiselect("1. Selecione os status para análise:", options=all_statuses, default=default_selection, key="otim_status", persist_state="session")
         with col_f2:
-            incluir_especiais = st.toggle("Incluir RTs Especiais", value=False, help="Marca esta opção para incluir RTs de contratos especiais (Ceabs, Stellantis, etc.) na análise.")
+            incluir_especiais = st.toggle("Incluir RTs Especiais", value=False, key="otim_incluir_especiais", persist_state="session", help="Marca esta opção para incluir RTs de contratos especiais (Ceabs, Stellantis, etc.) na análise.")
+            nome_provedor = st.selectbox(
+                "Distância sem KM Fixo:", options=list(PROVEDORES), index=0, key="otim_provedor_distancia", persist_state="session",
+                format_func=lambda nome: {'haversine': 'Linha reta (Haversine)', 'osrm': 'Rodoviária (OSRM)'}.get(nome, nome),
+                help="Usada quando o Mapeamento não traz KM Fixo para a rota. As distâncias ficam gravadas em disco e não são recalculadas. O servidor OSRM é definido pela variável de ambiente OSRM_URL."
+            )
+
+        # Motor de custos: Mapeamento normalizado uma única vez por (hash, colunas, filtro de especiais)
+        colunas_motor = (
+            ('map_rep_col', map_rep), ('map_city_col', map_city_col),
+            ('map_km_col', map_km_col), ('map_valor_km_col', map_valor_km_col), ('map_abrang_col', map_abrang_col),
+        )
+        motor = _obter_motor_custos(rt_index.hash_conteudo, colunas_motor, incluir_especiais, nome_provedor, df_map, rt_index, gazetteer)
 
         df_otim = df_dados[df_dados[os_status_col].isin(status_selecionados)].copy()
         if df_otim.empty:
@@ -369,16 +520,16 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
         if os_uf_col:
             with col_f3:
                 lista_ufs = sorted(df_otim[os_uf_col].dropna().unique())
-                uf_selecionado = st.selectbox("2. Filtrar por UF (Opcional):", options=["Todos"] + lista_ufs, index=0)
+                uf_selecionado = st.selectbox("2. Filtrar por UF (Opcional):", options=["Todos"] + lista_ufs, index=0, key="otim_uf", persist_state="session")
         
         if uf_selecionado and uf_selecionado != "Todos":
             df_filtrado_uf = df_otim[df_otim[os_uf_col] == uf_selecionado]
 
         with col_f4:
             lista_cidades = sorted(df_filtrado_uf[os_city_col].dropna().unique())
-            cidade_selecionada_otim = st.selectbox("3. Selecione a Cidade de Atendimento:", options=lista_cidades, index=None, placeholder="Selecione...")
+            cidade_selecionada_otim = st.selectbox("3. Selecione a Cidade de Atendimento:", options=lista_cidades, index=None, placeholder="Selecione...", key="otim_cidade", persist_state="session")
 
-        os_pesquisada_num = st.text_input("Ou digite o Número da O.S. para análise direta (ignora filtros acima):")
+        os_pesquisada_num = st.text_input("Ou digite o Número da O.S. para análise direta (ignora filtros acima):", key="otim_os_direta", persist_state="session")
         
         # --- LÓGICA DE FILTRAGEM (UF E CIDADE) ---
         ordens_para_analise = None
@@ -446,184 +597,33 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
         altura_df = min(max(300, len(df_display_ordens) * 35 + 38), 600)
         st.dataframe(df_display_ordens, use_container_width=True, height=altura_df)
 
-        # --- 4. EXIBIÇÃO E COLETA DE DADOS (EXPANDERS) ---
+        # --- 4. EXIBIÇÃO E COLETA DE DADOS (CARDS PAGINADOS) ---
         st.markdown("---")
         st.subheader("Análise de Custo (RT Agendado vs. Sugerido)")
-        
-        cache_cidades = {} # Cache interno para esta execução
-        report_data_selecao = []
-        total_economia_selecao = 0.0
 
-        # --- 🚨 LÓGICA DE ROLAGEM 🚨 ---
-        num_ordens = len(ordens_para_analise)
-        
-        if num_ordens > 10:
-            st.caption(f"Mostrando {num_ordens} ordens em uma lista com rolagem (600px).")
-            container_de_custo = st.container(height=600)
-        else:
-            container_de_custo = st.container() # Container normal (sem rolagem)
-
-        # Use o container (com ou sem rolagem) para desenhar os expanders
-        with container_de_custo:
-            for _, ordem in ordens_para_analise.iterrows():
-
-                # --- Início do Bloco de Custo (por linha) ---
-                cidade_da_ordem = ordem[os_city_col]
-
-                # Calcular o "Valor Liberado" do Dashboard para esta OS
-                valor_liberado_dashboard = 0.0
-                if valor_deslocamento_dashboard_col and valor_deslocamento_dashboard_col in ordem and pd.notna(ordem[valor_deslocamento_dashboard_col]):
-                    valor_desloc = pd.to_numeric(ordem[valor_deslocamento_dashboard_col], errors='coerce')
-                    valor_liberado_dashboard += valor_desloc if pd.notna(valor_desloc) else 0
-                if pedagio_dashboard_col and pedagio_dashboard_col in ordem and pd.notna(ordem[pedagio_dashboard_col]):
-                    valor_pedagio = pd.to_numeric(ordem[pedagio_dashboard_col], errors='coerce')
-                    valor_liberado_dashboard += valor_pedagio if pd.notna(valor_pedagio) else 0
-
-                # Este é o valor que o sistema da empresa "liberou" para o RT agendado
-                custo_agendado_para_comparacao = valor_liberado_dashboard
-                
-                # PULA A ANÁLISE SE O CUSTO AGENDADO FOR ZERO
-                if custo_agendado_para_comparacao == 0:
-                    continue
-
-                if pd.isna(cidade_da_ordem):
-                    continue
-                    
-                if cidade_da_ordem not in cache_cidades:
-                    cidade_info = df_map[df_map[map_city_col].str.upper() == cidade_da_ordem.upper()] # Garante case-insensitivity
-                    if cidade_info.empty:
-                        cache_cidades[cidade_da_ordem] = (pd.DataFrame(), None) 
-                        continue 
-
-                    # Acessando as colunas de Latitude/Longitude com as variáveis flexíveis
-                    ponto = (cidade_info.iloc[0][map_lat], cidade_info.iloc[0][map_lon])
-                    
-                    df_dist, rt_sugerido = _calcular_distancias_e_custos(df_map, cidade_da_ordem, ponto, map_rep, map_city_col, map_valor_km_col, 
-                                                                         map_tel_col, map_abrang_col, map_km_col, map_rep_lat, map_rep_lon, map_rep_city_col, map_rep_uf_col, incluir_especiais)
-                    cache_cidades[cidade_da_ordem] = (df_dist, rt_sugerido)
-                else:
-                    df_dist, rt_sugerido = cache_cidades[cidade_da_ordem]
-
-                if df_dist.empty or rt_sugerido is None:
-                    continue
-                # --- Fim do Bloco de Custo ---
-
-                rt_atual = ordem[os_rep_col] 
-                status_atual = ordem[os_status_col]
-                data_agendamento = ordem['DATA_FORMATADA']
-                periodo = ordem['PERIODO_FINAL']
-                
-                expander_title = f"OS: {ordem[os_id_col]}"
-                if periodo != "N/A":
-                    expander_title += f" ({periodo})" 
-                expander_title += f" | Data: {data_agendamento} | Cliente: {ordem[os_cliente_col]}"
-                
-                agendado_por_val = "N/A"
-                if os_agendado_por_col and os_agendado_por_col in ordem and pd.notna(ordem[os_agendado_por_col]):
-                    agendado_por_val = ordem[os_agendado_por_col]
-
-                with st.expander(expander_title):
-                    st.caption(f"Agendado Por: {agendado_por_val}")
-                    col1, col2 = st.columns(2) # Coluna para RT Agendado e Sugerido
-                    dist_atual, custo_atual, economia_dist, economia_custo = float('inf'), 0.0, 0.0, 0.0
-                    dist_atual, custo_atual, economia_dist, economia_custo, telefone_rt_agendado, cidade_rt_agendado, uf_rt_agendado = float('inf'), 0.0, 0.0, 0.0, "N/A", "N/A", "N/A"
-                    dados_rt_atual = df_dist[df_dist['Representante'] == rt_atual]
-
-                    with col1:
-                        if pd.isna(rt_atual) or str(rt_atual).strip() == "" or str(rt_atual).strip() == "NAN" or dados_rt_atual.empty:
-                            st.info(f"**RT Agendado:** (Nenhum ou Não Mapeado)")
-                            st.metric("Distância (Haversine)", "N/A")
-                            st.metric("Custo Estimado (RT Agendado)", "N/A")
-                            custo_agendado_relatorio = custo_agendado_para_comparacao # Mesmo que seja 0, usa o valor do dashboard
-                            dist_atual = float('inf')
-                        else:
-                            st.info(f"**RT Agendado:** {rt_atual}")
-                            dados_rt_atual_series = dados_rt_atual.iloc[0]
-                            dist_atual = dados_rt_atual_series['Distancia (km)']
-                            custo_atual = custo_agendado_para_comparacao # O custo atual é o valor liberado do dashboard
-                            st.metric("Distância (Haversine)", f"{dist_atual:.1f} km") # A distância ainda é a do RT agendado
-                            st.metric("Custo Estimado (RT Agendado)", f"R$ {custo_atual:.2f}")
-                            st.caption(f"KM Fixo Base: {dados_rt_atual_series['KM_Fixo_Custo']:.1f} km")
-                            telefone_rt_agendado = dados_rt_atual_series['Telefone']
-                            st.caption(f"Telefone: {dados_rt_atual_series['Telefone']}")
-                            cidade_rt_agendado = dados_rt_atual_series['Cidade RT']
-                            uf_rt_agendado = dados_rt_atual_series['UF RT']
-                            custo_agendado_relatorio = custo_atual
-                    
-                    with col2:
-                        st.success(f"**Sugestão (Mais Próximo):** {rt_sugerido['Representante']}")
-                        dist_sugerida = rt_sugerido['Distancia (km)']
-                        custo_sugerido = rt_sugerido['Custo_Correto_R$']
-                        
-                        if dist_atual != float('inf'):
-                            economia_dist = dist_atual - dist_sugerida # Economia de distância (ainda baseada em Haversine)
-                            economia_custo = custo_atual - custo_sugerido
-                            total_economia_selecao += economia_custo
-                        
-                        st.metric("Distância (Haversine)", f"{dist_sugerida:.1f} km", delta=f"{-economia_dist:.1f} km")
-                        st.metric("Custo Estimado (RT Sugerido)", f"R$ {custo_sugerido:.2f}", delta=f"R$ {-economia_custo:.2f}")
-                        st.caption(f"KM Fixo Base: {rt_sugerido['KM_Fixo_Custo']:.1f} km")
-                        st.caption(f"Telefone: {rt_sugerido['Telefone']}")
-
-                        # --- LOG DE CÁLCULO E BOTÃO DE EXPORTAÇÃO ---
-                        log_content = []
-                        log_content.append(f"--- LOG DE CÁLCULO DE CUSTO (OTIMIZADOR) ---")
-                        log_content.append(f"OS: {ordem[os_id_col]} | Cidade: {cidade_da_ordem}")
-                        log_content.append("\n--- CUSTO RT AGENDADO (VALOR LIBERADO DASHBOARD) ---")
-                        log_content.append(f"RT Agendado: {rt_atual}")
-                        log_content.append(f"Valor Liberado (Deslocamento + Pedágio): R$ {custo_atual:,.2f}")
-                        
-                        log_content.append("\n--- CUSTO RT SUGERIDO (CÁLCULO MERCURIO) ---")
-                        log_content.append(f"RT Sugerido: {rt_sugerido['Representante']}")
-                        log_content.append(f"1. KM Fixo Base (Mapeamento ou Haversine): {rt_sugerido['KM_Fixo_Custo']:.2f} km")
-                        log_content.append(f"2. Distância Total (Ida e Volta): {rt_sugerido['KM_Fixo_Custo']:.2f} * 2 = {rt_sugerido['KM_TOTAL_BASE']:.2f} km")
-                        log_content.append(f"3. Abrangência do RT: {rt_sugerido['Abrangencia']:.2f} km")
-                        log_content.append(f"4. Taxa por KM do RT: R$ {rt_sugerido['Valor_KM']:.2f}")
-                        log_content.append(f"5. KM a Pagar (após franquia): max(0, {rt_sugerido['KM_TOTAL_BASE']:.2f} - {rt_sugerido['Abrangencia']:.2f}) = {rt_sugerido['KM_A_PAGAR']:.2f} km")
-                        log_content.append(f"6. Custo Correto Final: {rt_sugerido['KM_A_PAGAR']:.2f} km * R$ {rt_sugerido['Valor_KM']:.2f} = R$ {custo_sugerido:,.2f}")
-                        
-                        # Exibe o cálculo simplificado na tela
-                        st.caption(f"Cálculo: ({rt_sugerido['KM_Fixo_Custo']:.1f}km * 2 - {rt_sugerido['Abrangencia']:.0f}km) * R$ {rt_sugerido['Valor_KM']:.2f} = R$ {custo_sugerido:.2f}")
-
-                        log_txt = "\n".join(log_content)
-                        st.download_button("Exportar Log de Cálculo (.txt)", data=log_txt.encode('utf-8'), 
-                                           file_name=f"log_otimizador_{ordem[os_id_col]}.txt", mime="text/plain",
-                                           key=f"log_btn_{ordem[os_id_col]}")
-                    
-                report_data_selecao.append({
-                    'Numero OS': ordem[os_id_col],
-                    'UF O.S': ordem[os_uf_col] if os_uf_col in ordem and pd.notna(ordem[os_uf_col]) else "N/A",
-                    'Cliente': ordem[os_cliente_col],
-                    'Telefone Cliente': ordem.get(os_tel_cliente_col, "N/A"),
-                    'data agendamento': data_agendamento,
-                    'periodo': periodo,
-                    'Agendado Por': ordem.get(os_agendado_por_col, "N/A"),
-                    'RT Agendado': rt_atual, 
-                    'Cidade RT Agendado': cidade_rt_agendado,
-                    'UF RT Agendado': uf_rt_agendado,
-                    'Cidade O.S': ordem[os_city_col],
-                    'Telefone RT Agendado': telefone_rt_agendado,
-                    'Distancia Agendada (km)': dist_atual if dist_atual != float('inf') else None,
-                    'Status': status_atual,
-                    'Valor Agendado': custo_agendado_relatorio, # Este é o valor liberado do dashboard
-                    'RT Sugerido': rt_sugerido['Representante'],
-                    'Distancia Sugerida (km)': dist_sugerida,
-                    'Cidade RT Sugerido': rt_sugerido['Cidade RT'],
-                    'UF RT Sugerido': rt_sugerido['UF RT'],
-                    'Telefone RT Sugerido': rt_sugerido['Telefone'],
-                    'Valor Sugerido': custo_sugerido,
-                    'Economia Potencial (R$)': economia_custo
-                })
-        # --- FIM DA LÓGICA DE ROLAGEM ---
-
-        # A métrica de economia TOTAL deve ficar FORA do container de rolagem.
+        # Relatório da seleção montado de uma vez; os cards só desenham a página visível
+        df_report_selecao = _montar_relatorio_economia(
+            ordens_para_analise, motor, os_id_col, os_uf_col, os_cliente_col, os_tel_cliente_col, os_agendado_por_col,
+            os_rep_col, os_city_col, os_status_col, valor_deslocamento_dashboard_col, pedagio_dashboard_col,
+            economia_somente_rt_mapeado=True
+        )
+        if motor.aviso_provedor:
+            st.warning(motor.aviso_provedor)
+        # PULA A ANÁLISE SE O CUSTO AGENDADO FOR ZERO
+        df_report_selecao = df_report_selecao[df_report_selecao['Valor Agendado'] != 0]
+        total_economia_selecao = df_report_selecao['Economia Potencial (R$)'].sum()
+
+        if not df_report_selecao.empty:
+            _render_cards_paginados(df_report_selecao, ordens_para_analise, motor, os_id_col, os_city_col,
+                                    os_cliente_col, os_agendado_por_col)
+
+        # A métrica de economia TOTAL deve ficar FORA da lista de cards.
         st.metric("Economia Total Estimada (na seleção acima)", f"R$ {total_economia_selecao:.2f}")
         
-        if report_data_selecao:
+        if not df_report_selecao.empty:
             st.markdown("---")
             st.subheader(f"Relatório de Exportação ({titulo_analise})")
-            df_report_selecao = pd.DataFrame(report_data_selecao)
-            df_report_selecao_export = _arredondar_relatorio(df_report_selecao)
+            df_report_selecao_export = _arredondar_relatorio(df_report_selecao[COLUNAS_RELATORIO_SELECAO].reset_index(drop=True))
 
             st.dataframe(df_report_selecao_export.style.format({
                 'Valor Agendado': 'R$ {:,.2f}', 
@@ -633,133 +633,39 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
                 'Distancia Agendada (km)': '{:,.1f} km'
             }), use_container_width=True)
             
-            csv_selecao = convert_df_to_csv(df_report_selecao_export)
-            st.download_button(
+            botao_download(
                 label=f"📥 Exportar Seleção ({titulo_analise})",
-                data=csv_selecao,
-                file_name=f"relatorio_otimizacao_{titulo_analise.replace(' ', '_')}.csv", 
-                mime="text/csv",
+                df=df_report_selecao_export,
+                file_name=f"relatorio_otimizacao_{titulo_analise.replace(' ', '_')}.csv",
             )
             
         st.markdown("---")
         st.subheader(f"Relatório Completo (Todos os Status Selecionados: {len(df_otim)} ordens)")
         
-        if st.button(f"Preparar Relatório Completo (pode demorar...)"):
-            with st.spinner(f"Analisando TODAS as {len(df_otim)} ordens... Isso pode levar alguns minutos."):
-                report_completo_data = []
-                cache_cidades_completo = {} 
-                progress_bar = st.progress(0, text="Analisando cidades...")
-                
-                cidades_unicas = df_otim[os_city_col].dropna().unique()
-                for i, cidade in enumerate(cidades_unicas):
-                    if cidade not in cache_cidades_completo:
-                        cidade_info = df_map[df_map[map_city_col] == cidade]
-                        if cidade_info.empty:
-                            cache_cidades_completo[cidade] = (pd.DataFrame(), None) 
-                            continue 
-
-                        # Acessando as colunas de Latitude/Longitude com as variáveis flexíveis
-                        ponto = (cidade_info.iloc[0][map_lat], cidade_info.iloc[0][map_lon])
-                        
-                        df_dist, rt_sugerido = _calcular_distancias_e_custos(df_map, cidade, ponto, map_rep, map_city_col, map_valor_km_col, 
-                                                                             map_tel_col, map_abrang_col, map_km_col, map_rep_lat, map_rep_lon, map_rep_city_col, map_rep_uf_col, incluir_especiais)
-                        cache_cidades_completo[cidade] = (df_dist, rt_sugerido)
-                    progress_bar.progress((i + 1) / len(cidades_unicas), text=f"Analisando cidade: {cidade}")
-
-                progress_bar.progress(1.0, text="Cidades analisadas! Gerando relatório de ordens...")
-
-                for _, ordem in df_otim.iterrows():
-                    cidade_ordem = ordem[os_city_col]
-                    if pd.isna(cidade_ordem) or cidade_ordem not in cache_cidades_completo:
-                        continue 
-
-                    df_dist_ordem, rt_sugerido_ordem = cache_cidades_completo[cidade_ordem]
-                    
-                    if df_dist_ordem.empty or rt_sugerido_ordem is None:
-                        continue 
-
-                    rt_atual = ordem[os_rep_col] 
-                    status_atual = ordem[os_status_col]
-                    dados_rt_atual_df = df_dist_ordem[df_dist_ordem['Representante'] == rt_atual]
-                    
-                    # Calcular o "Valor Liberado" do Dashboard para esta OS no relatório completo
-                    valor_liberado_dashboard_completo = 0.0
-                    if valor_deslocamento_dashboard_col and valor_deslocamento_dashboard_col in ordem and pd.notna(ordem[valor_deslocamento_dashboard_col]):
-                        valor_desloc_completo = pd.to_numeric(ordem[valor_deslocamento_dashboard_col], errors='coerce')
-                        valor_liberado_dashboard_completo += valor_desloc_completo if pd.notna(valor_desloc_completo) else 0
-                    if pedagio_dashboard_col and pedagio_dashboard_col in ordem and pd.notna(ordem[pedagio_dashboard_col]):
-                        valor_pedagio_completo = pd.to_numeric(ordem[pedagio_dashboard_col], errors='coerce')
-                        valor_liberado_dashboard_completo += valor_pedagio_completo if pd.notna(valor_pedagio_completo) else 0
-
-                    custo_agendado_relatorio_completo = valor_liberado_dashboard_completo
-                    
-                    cidade_rt_agendado_val = "N/A"
-                    uf_rt_agendado_val = "N/A"
-                    telefone_rt_agendado_val = "N/A"
-                    distancia_agendada_val = None
-
-                    if not dados_rt_atual_df.empty:
-                        dados_rt_atual_series = dados_rt_atual_df.iloc[0]
-                        cidade_rt_agendado_val = dados_rt_atual_series['Cidade RT']
-                        uf_rt_agendado_val = dados_rt_atual_series['UF RT']
-                        telefone_rt_agendado_val = dados_rt_atual_series['Telefone']
-                        distancia_agendada_val = dados_rt_atual_series['Distancia (km)']
-
-                    custo_sugerido = rt_sugerido_ordem['Custo_Correto_R$']
-                    
-                    
-                    # Calcula a economia para o relatório completo
-                    economia_custo_completo = 0.0
-                    if custo_agendado_relatorio_completo > 0:
-                        economia_custo_completo = custo_agendado_relatorio_completo - custo_sugerido
-
-
-                    data_agendamento_completo = ordem['DATA_FORMATADA']
-                    periodo_completo = ordem['PERIODO_FINAL']
-
-                    report_completo_data.append({
-                        'Numero OS': ordem[os_id_col],
-                        'UF O.S': ordem[os_uf_col] if os_uf_col in ordem and pd.notna(ordem[os_uf_col]) else "N/A",
-                        'Cliente': ordem[os_cliente_col],
-                        'Telefone Cliente': ordem.get(os_tel_cliente_col, "N/A"),
-                        'data agendamento': data_agendamento_completo,
-                        'periodo': periodo_completo,
-                        'Agendado Por': ordem.get(os_agendado_por_col, "N/A"),
-                        'RT Agendado': rt_atual,
-                        'Cidade RT Agendado': cidade_rt_agendado_val,
-                        'UF RT Agendado': uf_rt_agendado_val,
-                        'Cidade O.S': ordem[os_city_col],
-                        'Telefone RT Agendado': telefone_rt_agendado_val,
-                        'Distancia Agendada (km)': distancia_agendada_val,
-                        'Status': status_atual,
-                        'Valor Agendado': custo_agendado_relatorio_completo, # Este é o valor liberado do dashboard
-                        'RT Sugerido': rt_sugerido_ordem['Representante'],
-                        'Cidade RT Sugerido': rt_sugerido_ordem['Cidade RT'],
-                        'UF RT Sugerido': rt_sugerido_ordem['UF RT'],
-                        'Distancia Sugerida (km)': rt_sugerido_ordem['Distancia (km)'],
-                        'Telefone RT Sugerido': rt_sugerido_ordem['Telefone'],
-                        'Valor Sugerido': custo_sugerido,
-                        'Economia Potencial (R$)': economia_custo_completo
-                    })
-                
-                st.session_state.df_report_completo = pd.DataFrame(report_completo_data)
-                progress_bar.empty()
-                st.success(f"Relatório completo com {len(st.session_state.df_report_completo)} ordens está pronto para download!")
-
-        if "df_report_completo" in st.session_state and st.session_state.df_report_completo is not None:
-            df_report_completo_export = _arredondar_relatorio(st.session_state.df_report_completo)
-            csv_completo = convert_df_to_csv(df_report_completo_export)
-            st.download_button(
-                label=f"📥 Baixar Relatório Completo ({len(df_report_completo_export)} ordens)",
-                data=csv_completo,
+        if st.button("Preparar Relatório Completo"):
+            with st.spinner(f"Analisando TODAS as {len(df_otim)} ordens..."):
+                df_report_completo = _montar_relatorio_economia(
+                    df_otim, motor, os_id_col, os_uf_col, os_cliente_col, os_tel_cliente_col, os_agendado_por_col,
+                    os_rep_col, os_city_col, os_status_col, valor_deslocamento_dashboard_col, pedagio_dashboard_col
+                )
+                if motor.aviso_provedor:
+                    st.warning(motor.aviso_provedor)
+                # Guarda o relatório já arredondado; o CSV só é gerado no clique do download
+                st.session_state.df_report_completo = _arredondar_relatorio(df_report_completo.reset_index(drop=True))
+                st.success(f"Relatório completo com {len(df_report_completo)} ordens está pronto para download!")
+
+        if st.session_state.get("df_report_completo") is not None:
+            botao_download(
+                label=f"📥 Baixar Relatório Completo ({len(st.session_state.df_report_completo)} ordens)",
+                df=st.session_state.df_report_completo,
                 file_name="relatorio_otimizacao_COMPLETO.csv",
-                mime="text/csv",
                 key="download_completo"
             )
 
         st.markdown("---")
-        st.subheader("Análise de Proximidade de Agendamentos (6-7 dias)")
-        st.info("Esta análise identifica oportunidades para consolidar viagens. Ela mostra os técnicos que têm agendamentos para a mesma cidade em um intervalo de 6 a 7 dias.")
+        st.subheader("Análise de Proximidade de Agendamentos")
+        dias_min, dias_max = st.slider("Intervalo entre agendamentos (dias):", min_value=0, max_value=30, value=(6, 7), key="janela_proximidade", persist_state="session")
+        st.info(f"Esta análise identifica oportunidades para consolidar viagens. Ela mostra os técnicos que têm agendamentos para a mesma cidade em um intervalo de {dias_min} a {dias_max} dias.")
 
         if st.button("Analisar Agendamentos Próximos"):
             with st.spinner("Analisando agendamentos..."):
@@ -773,7 +679,9 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
                     cliente_col=os_cliente_col,
                     valor_desloc_col=valor_deslocamento_dashboard_col,
                     pedagio_col=pedagio_dashboard_col,
-                    tel_cliente_col=os_tel_cliente_col
+                    tel_cliente_col=os_tel_cliente_col,
+                    dias_min=dias_min,
+                    dias_max=dias_max
                 )
 
                 if not df_proximidade.empty:
@@ -789,12 +697,10 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
                         }
                     )
 
-                    csv_proximidade = convert_df_to_csv(df_proximidade)
-                    st.download_button(
+                    botao_download(
                         label="📥 Exportar Análise de Proximidade (.csv)",
-                        data=csv_proximidade,
+                        df=df_proximidade,
                         file_name="analise_proximidade_agendamentos.csv",
-                        mime="text/csv",
                         key="download_proximidade"
                     )
                 else:
@@ -840,10 +746,13 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
                             # Manter apenas a última posição registrada para cada serial
                             df_sem_posicao = df_sem_posicao.sort_values('Data da Posição', ascending=False).drop_duplicates('Serial')
 
-                            df_final = pd.merge(df_sem_posicao, df_at, on='Serial', how='left')
-                            
+                            # Modelo da base de ativos pelo serial normalizado (duplicados: vale a última linha)
+                            df_final = df_sem_posicao.reset_index(drop=True)
+                            linhas_ativos = IndiceEntidades(df_at).ultima_linha('serial', normalizar_chaves(df_final['Serial']))
+                            df_final['Modelo'] = df_at['Modelo'].reset_index(drop=True).reindex(linhas_ativos).to_numpy()
+
                             # Preencher modelo não encontrado
-                            df_final['Modelo'].fillna('Modelo não encontrado na base de ativos', inplace=True)
+                            df_final['Modelo'] = df_final['Modelo'].fillna('Modelo não encontrado na base de ativos')
                             
                             df_final = df_final[['Serial', 'Modelo', 'Dias Sem Posicionar', 'Data da Posição']]
 
@@ -852,12 +761,10 @@ def otimizador(df_dados, df_map, df_ultimaposicao=None, df_ativos=None):
                             st.success(f"Análise concluída! Encontrados {len(df_final)} ativos sem posição há 15 dias ou mais.")
                             st.dataframe(df_final.style.format({'Data da Posição': '{:%d/%m/%Y}'}), use_container_width=True)
                             
-                            csv_export = convert_df_to_csv(df_final)
-                            st.download_button(
+                            botao_download(
                                 label="📥 Exportar Relatório de Ativos Sem Posição (.csv)",
-                                data=csv_export,
+                                df=df_final,
                                 file_name="relatorio_ativos_sem_posicao.csv",
-                                mime="text/csv",
                                 key="download_sem_posicao"
                             )
 
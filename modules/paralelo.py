@@ -0,0 +1,108 @@
+# modules/paralelo.py
+"""
+Busca dos RTs mais próximos em paralelo (vários processos), usada no Backlog.
+
+Opcional: com 1 worker (padrão, ou MERCURIO_WORKERS) ou poucos pontos, a busca
+roda no próprio processo. Com mais workers, BuscaParalela abre um único pool
+por processamento, reaproveitado em todos os blocos: as coordenadas dos RTs
+vão uma vez para um bloco de memória compartilhada
+(multiprocessing.shared_memory), cada processo monta o seu índice a partir
+dele uma única vez (no initializer) e os pontos são divididos em partições
+contíguas, remontadas na ordem original. O resultado é idêntico ao do cálculo
+em um único processo.
+
+O ganho depende do hardware: o início dos processos ("spawn", que importa
+pandas/scikit-learn em cada um) é pago uma vez por processamento. Meça no
+servidor com benchmarks/benchmark_paralelo.py antes de mudar o padrão.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from modules.geo import RTIndex
+
+# Nº de processos padrão (1 = sem paralelismo); pode ser ajustado por variável de ambiente
+WORKERS_PADRAO = max(1, int(os.environ.get("MERCURIO_WORKERS", "1")))
+WORKERS_MAXIMO = os.cpu_count() or 1
+
+# Abaixo deste nº de pontos a divisão entre processos não compensa; a busca fica no processo atual
+MIN_PONTOS_PARALELO = 20000
+
+# Índice montado em cada processo (uma vez, no initializer) a partir da memória compartilhada
+_indice_worker = None
+
+
+def _inicializar_worker(nome_memoria, n_rts):
+    global _indice_worker
+    memoria = shared_memory.SharedMemory(name=nome_memoria)
+    try:
+        # Cópia local: o handle da memória compartilhada é fechado em seguida
+        coords = np.array(np.ndarray((2, n_rts), dtype=np.float64, buffer=memoria.buf))
+    finally:
+        memoria.close()
+    _indice_worker = RTIndex(None, np.arange(n_rts), coords[0], coords[1])
+
+
+def _k_mais_proximos_particao(lat, lon, k):
+    return _indice_worker.k_mais_proximos(lat, lon, k)
+
+
+class BuscaParalela:
+    """
+    Busca dos k RTs mais próximos com o mesmo resultado de
+    indice.k_mais_proximos, dividida entre `workers` processos. Use como
+    gerenciador de contexto ao redor de todos os blocos de um processamento;
+    o pool só é aberto na primeira busca com pontos suficientes.
+    """
+
+    def __init__(self, indice, workers=1, min_pontos=MIN_PONTOS_PARALELO):
+        self.indice = indice
+        self.workers = max(1, int(workers))
+        self.min_pontos = min_pontos
+        self._memoria = None
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+        return False
+
+    def _abrir(self):
+        n_rts = len(self.indice)
+        self._memoria = shared_memory.SharedMemory(create=True, size=2 * n_rts * 8)
+        coords = np.ndarray((2, n_rts), dtype=np.float64, buffer=self._memoria.buf)
+        coords[0], coords[1] = self.indice.lat, self.indice.lon
+        del coords
+        # "spawn" evita herdar o estado (threads, sockets) do servidor do Streamlit
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_inicializar_worker, initargs=(self._memoria.name, n_rts)
+        )
+
+    def fechar(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._memoria is not None:
+            self._memoria.close()
+            self._memoria.unlink()
+            self._memoria = None
+
+    def k_mais_proximos(self, lat, lon, k):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        if self.workers == 1 or len(lat) < self.min_pontos or len(self.indice) == 0:
+            return self.indice.k_mais_proximos(lat, lon, k)
+        if self._executor is None:
+            self._abrir()
+        # Partições contíguas: a concatenação na ordem de envio reproduz a ordem original
+        limites = np.linspace(0, len(lat), self.workers + 1).astype(np.int64)
+        futuros = [self._executor.submit(_k_mais_proximos_particao, lat[ini:fim], lon[ini:fim], k)
+                   for ini, fim in zip(limites[:-1], limites[1:]) if fim > ini]
+        partes = [f.result() for f in futuros]
+        return np.concatenate([p[0] for p in partes]), np.concatenate([p[1] for p in partes])
@@ -1,36 +1,27 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import re
-import io
-import pydeck as pdk
-import reverse_geocoder as rg
-import pycountry
-from modules.processar_relatorio import extrair_odometros
-from modules.utils import convert_df_to_csv
-
-def to_excel(df, highlight_col=None, highlight_value='Sim'):
-    """Converts a dataframe to an Excel file in-memory, with optional highlighting."""
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Manutenção')
-        
-        if highlight_col and highlight_col in df.columns:
-            from openpyxl.styles import PatternFill
-            # Get the workbook and worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['Manutenção']
-            
-            # Define fill style for highlighting
-            highlight_fill = PatternFill(start_color='FFFFE0', end_color='FFFFE0', fill_type='solid') # Light Yellow
-
-            # Iterate through rows and apply formatting if the condition is met
-            for row_idx, value in enumerate(df[highlight_col], start=2): # start=2 for 1-based index + header
-                if value == highlight_value:
-                    for col_idx in range(1, len(df.columns) + 1):
-                        worksheet.cell(row=row_idx, column=col_idx).fill = highlight_fill
-                        
-    return output.getvalue()
+import os
+import yaml
+from modules.carregamento_tardio import modulo_tardio
+from modules.processar_relatorio import extrair_odometros_series
+from modules.exportacao import botao_download, hash_dataframe
+from modules.data_loader import obter_geocodificador_reverso, manter_arquivos_enviados
+from modules.indice_entidades import IndiceEntidades, normalizar_chaves
+from modules.mapas import exibir_mapa, coordenadas_validas
+from modules.regras_manutencao import MotorRegras, CONFIG_PADRAO, CAMINHO_PADRAO as CAMINHO_REGRAS
+
+# Dependência pesada: importada só quando a aba de posição a usa
+pdk = modulo_tardio("pydeck")
+
+@st.cache_resource(max_entries=2)
+def _carregar_motor_regras(caminho, modificado_em):
+    """ Regras compiladas uma vez por versão do arquivo (a data de modificação entra na chave). """
+    return MotorRegras.from_yaml(caminho)
+
+def obter_motor_regras(caminho=CAMINHO_REGRAS):
+    modificado_em = os.path.getmtime(caminho) if os.path.exists(caminho) else None
+    return _carregar_motor_regras(caminho, modificado_em)
 
 def standardize_column_names(df):
     """Padroniza os nomes das colunas para garantir a compatibilidade."""
@@ -44,23 +35,12 @@ def standardize_column_names(df):
         df.rename(columns=rename_dict, inplace=True)
     return df
 
-def _normalize_key(value):
-    if value is None or (isinstance(value, float) and np.isnan(value)):
-        return None
-    text = str(value).strip()
-    return text.upper() if text else None
-
 def _prepare_posicao_odometro_df(df):
     if df is None or df.empty:
         return pd.DataFrame()
     cols = ['Serial', 'Placa', 'odometro', 'odometro_can']
     existing_cols = [c for c in cols if c in df.columns]
-    df_copy = df[existing_cols].copy()
-
-    df_copy['serial_key'] = df_copy.get('Serial').apply(_normalize_key) if 'Serial' in df_copy else None
-    df_copy['placa_key'] = df_copy.get('Placa').apply(_normalize_key) if 'Placa' in df_copy else None
-    df_copy['__pos_index__'] = df_copy.index
-    return df_copy
+    return df[existing_cols]
 
 def _prepare_cps_odometro_df(df):
     if df is None or df.empty or 'Evento / Ignição' not in df.columns:
@@ -68,9 +48,7 @@ def _prepare_cps_odometro_df(df):
     cps_copy = df.copy()
     cps_copy['Evento / Ignição'] = cps_copy['Evento / Ignição'].astype(str)
 
-    odometer_values = cps_copy['Evento / Ignição'].apply(
-        lambda txt: pd.Series(extrair_odometros(txt), index=['odometro', 'odometro_can'])
-    )
+    odometer_values = extrair_odometros_series(cps_copy['Evento / Ignição'])
     cps_copy = pd.concat([cps_copy, odometer_values], axis=1)
 
     splitted = cps_copy['Evento / Ignição'].str.split('/', n=1, expand=True)
@@ -86,54 +64,40 @@ def _prepare_cps_odometro_df(df):
     cps_copy['Serial'] = cps_copy[serial_col] if serial_col else None
     cps_copy['Placa'] = cps_copy[placa_col] if placa_col else None
 
-    cps_copy['serial_key'] = cps_copy['Serial'].apply(_normalize_key)
-    cps_copy['placa_key'] = cps_copy['Placa'].apply(_normalize_key)
-    cps_copy['__cps_index__'] = cps_copy.index
-
     return cps_copy
 
-def _merge_on_key(df_pos, df_cps, key, match_label):
-    if key not in df_pos.columns or key not in df_cps.columns:
-        return pd.DataFrame()
-    df_pos_key = df_pos[df_pos[key].notna()].copy()
-    df_cps_key = df_cps[df_cps[key].notna()].copy()
-    if df_pos_key.empty or df_cps_key.empty:
-        return pd.DataFrame()
-    merged = pd.merge(
-        df_pos_key,
-        df_cps_key,
-        on=key,
-        suffixes=('_pos', '_cps'),
-        how='inner',
-        sort=False,
-    )
-    if merged.empty:
-        return merged
-    merged['Match via'] = match_label
-    return merged
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _cps_indexado(hash_dados, _df_cps):
+    """CPS preparado para o cruzamento e seu índice de serial/placa, montados uma vez por conteúdo."""
+    df_cps_prepared = _prepare_cps_odometro_df(_df_cps)
+    if df_cps_prepared is None:
+        return None, None
+    return df_cps_prepared, IndiceEntidades(df_cps_prepared)
 
 def cruzar_odometros_posicao_cps(df_pos, df_cps):
-    df_cps_prepared = _prepare_cps_odometro_df(df_cps)
-    if df_cps_prepared is None or df_pos is None or df_pos.empty:
+    if df_cps is None or df_cps.empty or 'Evento / Ignição' not in df_cps.columns:
+        return None
+    if df_pos is None or df_pos.empty:
         return None
+    df_cps_prepared, indice_cps = _cps_indexado(hash_dataframe(df_cps), df_cps)
 
     df_pos_prepared = _prepare_posicao_odometro_df(df_pos)
     if df_pos_prepared.empty:
         return pd.DataFrame()
 
-    serial_merge = _merge_on_key(df_pos_prepared, df_cps_prepared, 'serial_key', 'Serial')
-
-    matched_pos = set(serial_merge['__pos_index__']) if not serial_merge.empty else set()
-    matched_cps = set(serial_merge['__cps_index__']) if not serial_merge.empty else set()
-
-    pos_remaining = df_pos_prepared[~df_pos_prepared['__pos_index__'].isin(matched_pos)]
-    cps_remaining = df_cps_prepared[~df_cps_prepared['__cps_index__'].isin(matched_cps)]
-
-    placa_merge = _merge_on_key(pos_remaining, cps_remaining, 'placa_key', 'Placa')
+    # Serial primeiro; o que sobrar dos dois lados tenta pela placa
+    pares = indice_cps.cruzar(IndiceEntidades(df_pos_prepared))
+    if pares.empty:
+        return pd.DataFrame()
 
-    final = pd.concat([serial_merge, placa_merge], ignore_index=True, sort=False)
-    if final.empty:
-        return final
+    lado_pos = df_pos_prepared.iloc[pares['linha_consulta'].to_numpy()].reset_index(drop=True)
+    lado_cps = df_cps_prepared.iloc[pares['linha_indice'].to_numpy()].reset_index(drop=True)
+    comuns = lado_pos.columns.intersection(lado_cps.columns)
+    final = pd.concat([
+        lado_pos.rename(columns={c: f"{c}_pos" for c in comuns}),
+        lado_cps.rename(columns={c: f"{c}_cps" for c in comuns}),
+    ], axis=1)
+    final['Match via'] = pares['campo'].map({'serial': 'Serial', 'placa': 'Placa'})
 
     rename_map = {
         'Serial_pos': 'Serial (Posição)',
@@ -156,9 +120,45 @@ def cruzar_odometros_posicao_cps(df_pos, df_cps):
     ]
     cols_existentes = [col for col in cols_order if col in final.columns]
     final = final[cols_existentes + [col for col in final.columns if col not in cols_existentes]]
-    final.drop(columns=[c for c in ['serial_key', 'placa_key', '__pos_index__', '__cps_index__'] if c in final.columns], inplace=True, errors='ignore')
     final.fillna('N/A', inplace=True)
     return final
+def _mais_frequente_por_grupo(grupos, valores):
+    """
+    {grupo: valor mais frequente} a partir de uma única contagem dos pares
+    (grupo, valor), feita sobre os códigos inteiros de pd.factorize. Empates
+    ficam com o menor valor, como em Series.mode().
+    """
+    codigos_grupo, grupos_unicos = pd.factorize(grupos)
+    codigos_valor, valores_unicos = pd.factorize(valores)
+    validos = (codigos_grupo >= 0) & (codigos_valor >= 0)
+    if not validos.any():
+        return {}
+    n_valores = len(valores_unicos)
+    pares, contagem = np.unique(codigos_grupo[validos].astype(np.int64) * n_valores + codigos_valor[validos], return_counts=True)
+    grupo, valor = pares // n_valores, pares % n_valores
+    # Posição de cada valor na ordem alfabética (critério de desempate)
+    ordem_valor = np.empty(n_valores, dtype=np.int64)
+    ordem_valor[np.argsort(np.asarray(valores_unicos, dtype=object), kind='stable')] = np.arange(n_valores)
+    # Ordena por grupo, contagem decrescente e valor; o primeiro de cada grupo é o vencedor
+    ordem = np.lexsort((ordem_valor[valor], -contagem, grupo))
+    primeiros = ordem[np.r_[True, grupo[ordem][1:] != grupo[ordem][:-1]]]
+    return dict(zip(grupos_unicos.take(grupo[primeiros]), valores_unicos.take(valor[primeiros])))
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _mapa_modelos_canonicos(hash_dados, _modelos):
+    """Mapeamento nome original -> nome canônico, calculado uma vez por conteúdo da coluna."""
+    originais = pd.Series(_modelos.dropna().unique(), dtype=object)
+    # Chave "limpa" de cada modelo (minúsculas, sem espaços/hífens/underscores)
+    chaves = originais.str.lower().str.replace(r'[\s_-]', '', regex=True)
+    chave_por_modelo = dict(zip(originais, chaves))
+    canonico_por_chave = _mais_frequente_por_grupo(_modelos.map(chave_por_modelo), _modelos)
+    return {modelo: canonico_por_chave[chave] for modelo, chave in chave_por_modelo.items()}
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _mapa_modelo_por_prefixo(hash_dados, _prefixos, _modelos):
+    """Modelo mais frequente para cada prefixo de Serial, calculado uma vez por conteúdo."""
+    return _mais_frequente_por_grupo(_prefixos, _modelos)
+
 def map_to_canonical_model_names(df):
     """
     Agrupa nomes de modelos de HW semelhantes e os padroniza para a forma mais comum,
@@ -169,36 +169,10 @@ def map_to_canonical_model_names(df):
 
     # Garante que a coluna seja do tipo string para manipulação
     df['Modelo de HW'] = df['Modelo de HW'].astype(str).replace('nan', np.nan)
-    
-    original_models = df['Modelo de HW'].dropna().unique()
-    
-    # Gera uma chave "limpa" para cada modelo (minúsculas, sem espaços/hífens)
-    model_groups = {}
-    for model in original_models:
-        clean_key = re.sub(r'[\s_-]', '', model.lower())
-        if clean_key not in model_groups:
-            model_groups[clean_key] = []
-        model_groups[clean_key].append(model)
-
-    # Para cada grupo, encontra o nome canônico (o mais frequente) e cria o mapeamento
-    canonical_mapping = {}
-    all_series = df['Modelo de HW'].dropna()
-    for _, messy_models in model_groups.items():
-        if not messy_models:
-            continue
-        
-        # Encontra a ocorrência mais comum dentro do grupo de nomes semelhantes
-        most_frequent_name = all_series[all_series.isin(messy_models)].mode()
-        
-        # Define o nome canônico
-        canonical_name = messy_models[0] # Fallback para o primeiro item
-        if not most_frequent_name.empty:
-            canonical_name = most_frequent_name.iloc[0]
-            
-        # Mapeia todas as variações para o nome canônico
-        for model in messy_models:
-            canonical_mapping[model] = canonical_name
-            
+
+    # Para cada grupo de nomes semelhantes, o nome canônico é o mais frequente
+    canonical_mapping = _mapa_modelos_canonicos(hash_dataframe(df[['Modelo de HW']]), df['Modelo de HW'])
+
     # Aplica o mapeamento na coluna do DataFrame
     df['Modelo de HW'] = df['Modelo de HW'].map(canonical_mapping)
     return df
@@ -209,19 +183,14 @@ def fill_missing_models(df):
         return df, 0
 
     df['Serial'] = df['Serial'].astype(str)
-    df['Modelo de HW'] = df['Modelo de HW'].apply(lambda x: x if isinstance(x, str) and x.strip() else np.nan)
+    # Apenas textos não vazios contam como modelo
+    modelos = df['Modelo de HW'].astype(object)
+    df['Modelo de HW'] = modelos.where(modelos.str.strip().fillna('') != '', np.nan)
     initial_filled_count = df['Modelo de HW'].notnull().sum()
 
     # Mapa dinâmico com prefixo de 5 (mais específico)
-    df_com_modelo = df.dropna(subset=['Modelo de HW']).copy()
-    if not df_com_modelo.empty:
-        df_com_modelo['prefixo_5'] = df_com_modelo['Serial'].str[:5]
-        try:
-            dynamic_map_5 = df_com_modelo.groupby('prefixo_5')['Modelo de HW'].agg(lambda x: x.mode().iloc[0]).to_dict()
-        except IndexError:
-            dynamic_map_5 = {}
-    else:
-        dynamic_map_5 = {}
+    prefixos_5 = df['Serial'].str[:5]
+    dynamic_map_5 = _mapa_modelo_por_prefixo(hash_dataframe(df[['Serial', 'Modelo de HW']]), prefixos_5, df['Modelo de HW'])
 
     # Mapa hardcoded com prefixo de 3
     hardcoded_map_3 = {'130': 'MXT-130', '202': 'MT-2000'}
@@ -230,8 +199,7 @@ def fill_missing_models(df):
     missing_mask = df['Modelo de HW'].isnull()
     if missing_mask.any():
         # 1. Tenta preencher com o mapa dinâmico de 5 prefixos
-        prefixes_5 = df.loc[missing_mask, 'Serial'].str[:5]
-        df.loc[missing_mask, 'Modelo de HW'] = prefixes_5.map(dynamic_map_5)
+        df.loc[missing_mask, 'Modelo de HW'] = prefixos_5[missing_mask].map(dynamic_map_5)
 
         # 2. Para os que ainda faltam, tenta preencher com o mapa hardcoded de 3 prefixos
         still_missing_mask = df['Modelo de HW'].isnull()
@@ -280,35 +248,15 @@ def process_location_data(df):
     if not rows_to_geocode.empty:
         st.info(f"Buscando cidade/estado para {len(rows_to_geocode)} registros sem essa informação...")
         try:
-            coordinates = list(zip(pd.to_numeric(rows_to_geocode['lat'], errors='coerce'), 
-                                   pd.to_numeric(rows_to_geocode['long'], errors='coerce')))
-            
-            # Filtra coordenadas inválidas que podem ter passado
-            valid_coords_with_indices = [(coord, index) for coord, index in zip(coordinates, rows_to_geocode.index) if -90 <= coord[0] <= 90 and -180 <= coord[1] <= 180]
-            
-            if valid_coords_with_indices:
-                valid_coords = [item[0] for item in valid_coords_with_indices]
-                valid_indices = [item[1] for item in valid_coords_with_indices]
-
-                results = rg.search(valid_coords)
-                
-                cities = [res.get('name', '') for res in results]
-                states = [res.get('admin1', '') for res in results]
-                countries_iso = [res.get('cc', '') for res in results]
-                
-                countries = []
-                for iso in countries_iso:
-                    try:
-                        country = pycountry.countries.get(alpha_2=iso)
-                        countries.append(country.name if country else iso)
-                    except:
-                        countries.append(iso)
+            # Consulta em lote no serviço compartilhado (coordenadas inválidas voltam vazias)
+            resultado_rg = obter_geocodificador_reverso().buscar(rows_to_geocode['lat'], rows_to_geocode['long']).dropna(subset=['cc'])
 
+            if not resultado_rg.empty:
                 geocoded_data = pd.DataFrame({
-                    'cidade_final': cities,
-                    'estado_final': states,
-                    'pais_final': countries
-                }, index=valid_indices)
+                    'cidade_final': resultado_rg['cidade'],
+                    'estado_final': resultado_rg['estado'],
+                    'pais_final': resultado_rg['pais'].fillna(resultado_rg['cc'])
+                })
 
                 # Preenche os valores nulos com os dados geocodificados
                 df['cidade_final'].fillna(geocoded_data['cidade_final'], inplace=True)
@@ -343,14 +291,17 @@ def analisar_ultima_posicao(df_processado):
             "Selecione o arquivo da base de ativos (Excel ou CSV). A base deve conter a coluna 'Serial'.",
             type=['xlsx', 'csv']
         )
+        arquivo_ativos = manter_arquivos_enviados('pos_arquivo_ativos', arquivo_ativos, "Base de ativos em uso")
         if arquivo_ativos:
             try:
                 if arquivo_ativos.name.endswith('.xlsx'):
                     df_ativos = pd.read_excel(arquivo_ativos, engine='openpyxl')
                 else:
                     try:
+                        arquivo_ativos.seek(0)
                         df_ativos = pd.read_csv(arquivo_ativos, sep=';', encoding='utf-8', on_bad_lines='warn')
                     except Exception:
+                         arquivo_ativos.seek(0)
                          df_ativos = pd.read_csv(arquivo_ativos, sep=',', encoding='utf-8', on_bad_lines='warn')
 
                 st.info("Colunas detectadas na base de ativos: " + ", ".join(df_ativos.columns))
@@ -359,13 +310,14 @@ def analisar_ultima_posicao(df_processado):
 
                 if 'Serial' in df_ativos.columns:
                     df_processado['Serial'] = df_processado['Serial'].astype(str).str.strip()
-                    df_ativos['Serial'] = df_ativos['Serial'].astype(str).str.strip()
-                    df_ativos.drop_duplicates(subset=['Serial'], keep='last', inplace=True)
-                    
+
                     processado_cols = df_processado.columns.tolist()
-                    ativos_cols_to_merge = [col for col in df_ativos.columns if col not in processado_cols or col == 'Serial']
-                    
-                    df_processado = pd.merge(df_processado, df_ativos[ativos_cols_to_merge], on='Serial', how='left')
+                    ativos_cols_to_merge = [col for col in df_ativos.columns if col not in processado_cols]
+
+                    # Serial duplicado na base de ativos: vale a última linha
+                    linhas_ativos = IndiceEntidades(df_ativos).ultima_linha('serial', normalizar_chaves(df_processado['Serial']))
+                    dados_ativos = df_ativos[ativos_cols_to_merge].reset_index(drop=True).reindex(linhas_ativos)
+                    df_processado = pd.concat([df_processado.reset_index(drop=True), dados_ativos.reset_index(drop=True)], axis=1)
                     st.success("✅ Base de ativos cruzada com sucesso!")
 
                     # Lógica de Comparação de Região
@@ -383,7 +335,7 @@ def analisar_ultima_posicao(df_processado):
                         df_processado.loc[match_condition, 'mesma_regiao'] = 'Sim'
                         st.info("Comparação de região concluída.")
 
-                    if st.toggle("Mostrar apenas equipamentos na mesma região da base de ativos"):
+                    if st.toggle("Mostrar apenas equipamentos na mesma região da base de ativos", key="pos_mesma_regiao", persist_state="session"):
                         if 'mesma_regiao' in df_processado.columns:
                             df_processado = df_processado[df_processado['mesma_regiao'] == 'Sim'].copy()
                             st.info(f"Exibindo {len(df_processado)} equipamentos que estão na mesma região da base.")
@@ -392,7 +344,7 @@ def analisar_ultima_posicao(df_processado):
 
                     # Filtro por cliente
                     if 'Cliente' in df_processado.columns:
-                        cliente_search = st.text_input("Pesquisar por nome do cliente para filtrar a visão:", placeholder="Digite o nome do cliente")
+                        cliente_search = st.text_input("Pesquisar por nome do cliente para filtrar a visão:", placeholder="Digite o nome do cliente", key="pos_busca_cliente", persist_state="session")
                         if cliente_search:
                             df_filtrado_cliente = df_processado[df_processado['Cliente'].str.contains(cliente_search, case=False, na=False)]
                             if df_filtrado_cliente.empty:
@@ -415,7 +367,8 @@ def analisar_ultima_posicao(df_processado):
     modelos_disponiveis = sorted(df_processado['Modelo de HW'].dropna().unique())
     modelos_selecionados = st.multiselect(
         "Selecione o(s) modelo(s) do equipamento:",
-        options=modelos_disponiveis
+        options=modelos_disponiveis,
+        key="pos_modelos", persist_state="session"
     )
 
     if modelos_selecionados:
@@ -426,38 +379,26 @@ def analisar_ultima_posicao(df_processado):
     # A lógica de geocodificação foi movida para a função 'process_location_data'
 
     if 'dias_sem_posicao' in df_filtrado.columns:
-        # Definição de modelos GSM
-        gsm_models = [
-            'MT2000', 'RI0352 - FROTAS 4G', 'MXT-130', 'GS10G', 'MXT-130-P5', 'ST350LC', 'ST380', 
-            'RT345BT', 'RI0350 - FROTAS 2G', 'MXT-162', 'E3 Plus', 'ST300H', 'ST340LC', 'SA200', 
-            'FMB130', 'GV300CAN'
-        ]
-
         #
-        # PASSO 1: Criar o DataFrame de status e aplicar as regras de manutenção
+        # PASSO 1: Aplicar as regras de manutenção (declaradas em regras_manutencao.yaml)
         #
-        df_status = df_filtrado.copy()
-
-        # Regra 1: Manutenção por dias sem posição
-        manutencao_por_dias = (df_status['dias_sem_posicao'] >= 15) | (df_status['dias_sem_posicao'].isnull())
+        try:
+            motor_regras = obter_motor_regras()
+        except (ValueError, yaml.YAMLError) as e:
+            st.error(f"Erro no arquivo de regras de manutenção ({CAMINHO_REGRAS}): {e}. Usando as regras padrão.")
+            motor_regras = MotorRegras(CONFIG_PADRAO)
+        gsm_models = motor_regras.grupo('modelos_gsm')
 
-        # Regra 2: Manutenção para modelos GSM com tecnologia inválida, com exceções
-        manutencao_por_tech = pd.Series(False, index=df_status.index)
-        if 'tecnologia_posicao' in df_status.columns and 'Modelo de HW' in df_status.columns:
-            is_gsm_model = df_status['Modelo de HW'].isin(gsm_models)
-            
-            # Tecnologias inválidas para GSM são todas que não são 'GSM' (e não são nulas)
-            is_invalid_tech = ~df_status['tecnologia_posicao'].isin(['GSM']) & df_status['tecnologia_posicao'].notna()
+        # Cópia: o status e as colunas derivadas abaixo não devem vazar para df_filtrado
+        df_status = df_filtrado.copy()
+        acertos_regras, motivos = motor_regras.avaliar(df_status)
+        df_status['Status'] = np.where(acertos_regras.any(axis=1), 'Gerar Manutenção', 'OK')
+        df_status['Motivo Manutenção'] = motivos
 
-            # Exceção para modelos como Iotracking e Contingência que podem usar outras tecnologias
-            is_exception_model = df_status['Modelo de HW'].str.contains('Iotracking|Contingencia', case=False, na=False)
+        with st.expander("🔎 Por que os equipamentos foram sinalizados (regras de manutenção)"):
+            st.dataframe(motor_regras.contagem(acertos_regras), use_container_width=True, hide_index=True)
+            st.caption(f"Regras carregadas de `{CAMINHO_REGRAS}`. Um equipamento é sinalizado se atender a qualquer regra.")
 
-            # A regra de manutenção só se aplica se NÃO for um modelo de exceção
-            manutencao_por_tech = is_gsm_model & is_invalid_tech & ~is_exception_model
-        
-        # Combinar as regras para definir o status final
-        df_status['Status'] = np.where(manutencao_por_dias | manutencao_por_tech, 'Gerar Manutenção', 'OK')
-        
         #
         # PASSO 2: Exibir o levantamento de GSMs com tecnologia incorreta (pedido do usuário)
         #
@@ -497,7 +438,7 @@ def analisar_ultima_posicao(df_processado):
         st.markdown("---")
         st.subheader("Status de Todos os Equipamentos")
         df_display = df_status.rename(columns={'data_evento': 'Data da Última Posição'})
-        colunas_status = ['Serial', 'Cliente', 'Placa', 'Modelo de HW', 'dias_sem_posicao', 'Data da Última Posição', 'Status', 'tecnologia_posicao']
+        colunas_status = ['Serial', 'Cliente', 'Placa', 'Modelo de HW', 'dias_sem_posicao', 'Data da Última Posição', 'Status', 'Motivo Manutenção', 'tecnologia_posicao']
         colunas_existentes = [col for col in colunas_status if col in df_display.columns]
         st.dataframe(df_display[colunas_existentes], use_container_width=True, column_config={"Data da Última Posição": st.column_config.DatetimeColumn("Data da Última Posição", format="DD/MM/YYYY HH:mm:ss")})
 
@@ -515,17 +456,8 @@ def analisar_ultima_posicao(df_processado):
             st.warning(f"Encontrados {len(df_fora_brasil)} equipamentos com posição fora do Brasil.")
 
             # --- Reverse Geocoding ---
-            paises = []
-            if not df_fora_brasil.empty:
-                coordenadas = list(zip(df_fora_brasil['lat'], df_fora_brasil['long']))
-                resultados_rg = rg.search(coordenadas)
-                for res in resultados_rg:
-                    try:
-                        country = pycountry.countries.get(alpha_2=res['cc'])
-                        paises.append(country.name if country else 'Local Desconhecido')
-                    except (IndexError, KeyError):
-                        paises.append('Oceano / Sem Dados')
-            df_fora_brasil['País'] = paises
+            resultado_rg = obter_geocodificador_reverso().buscar(df_fora_brasil['lat'], df_fora_brasil['long'])
+            df_fora_brasil['País'] = resultado_rg['pais'].fillna('Local Desconhecido')
             
             # Selecionar colunas relevantes para a exportação
             cols_export_fora_brasil = ['Serial', 'Cliente', 'Placa', 'Modelo de HW', 'lat', 'long', 'País', 'dias_sem_posicao', 'Data da Última Posição']
@@ -537,51 +469,14 @@ def analisar_ultima_posicao(df_processado):
             # --- Mapa de Posições Divergentes ---
             st.subheader("Mapa de Posições Divergentes")
             df_mapa_fora_brasil = df_fora_brasil[['Serial', 'lat', 'long']].copy()
-            df_mapa_fora_brasil.rename(columns={'Serial': 'name'}, inplace=True)
-
-            df_mapa_fora_brasil.dropna(subset=['lat', 'long'], inplace=True)
-            df_mapa_fora_brasil = df_mapa_fora_brasil[
-                (df_mapa_fora_brasil['lat'].between(-90, 90)) &
-                (df_mapa_fora_brasil['long'].between(-180, 180)) &
-                ((df_mapa_fora_brasil['lat'] != 0) | (df_mapa_fora_brasil['long'] != 0))
-            ]
-
-            if not df_mapa_fora_brasil.empty:
-                size = st.slider("Raio dos Pontos (em metros)", min_value=1000, max_value=50000, value=5000, step=1000, key="slider_mapa_divergente")
-                
-                layer = pdk.Layer(
-                    "ScatterplotLayer",
-                    data=df_mapa_fora_brasil,
-                    get_position=['long', 'lat'],
-                    get_fill_color=[255, 0, 0, 140],
-                    get_radius=size,
-                    pickable=True,
-                    radius_min_pixels=5,
-                )
-
-                view_state = pdk.ViewState(
-                    latitude=df_mapa_fora_brasil['lat'].mean(),
-                    longitude=df_mapa_fora_brasil['long'].mean(),
-                    zoom=2,
-                    pitch=0,
-                )
+            df_mapa_fora_brasil['rotulo'] = '<b>Serial:</b> ' + df_mapa_fora_brasil['Serial'].astype(str)
 
-                tooltip = {
-                    "html": "<b>Serial:</b> {name}",
-                    "style": {
-                        "backgroundColor": "steelblue",
-                        "color": "white",
-                    }
-                }
-
-                r = pdk.Deck(
-                    layers=[layer],
-                    initial_view_state=view_state,
-                    map_style=pdk.map_styles.DARK,
-                    tooltip=tooltip,
+            if coordenadas_validas(df_mapa_fora_brasil, 'lat', 'long').any():
+                size = st.slider("Raio dos Pontos (em metros)", min_value=1000, max_value=50000, value=5000, step=1000, key="slider_mapa_divergente", persist_state="session")
+                exibir_mapa(
+                    df_mapa_fora_brasil, key="mapa_divergente", lon_col='long', cor=[255, 0, 0],
+                    coluna_rotulo='rotulo', raio_metros=size, zoom=2, map_style=pdk.map_styles.DARK,
                 )
-                
-                st.pydeck_chart(r)
             else:
                 st.info("Nenhuma coordenada válida para exibir no mapa de posições divergentes.")
 
@@ -589,13 +484,10 @@ def analisar_ultima_posicao(df_processado):
             # Preparar para exportação
             df_export_final = df_fora_brasil[cols_existentes_fora_brasil].copy()
             df_export_final['Serial'] = '="' + df_export_final['Serial'].astype(str) + '"'
-            excel_data_fora_brasil = to_excel(df_export_final)
-            
-            st.download_button(
+            botao_download(
                 label="📥 Baixar Lista de Equipamentos Fora do Brasil (.xlsx)",
-                data=excel_data_fora_brasil,
+                df=df_export_final, tipo='xlsx', opcoes={'sheet_name': 'Manutenção'},
                 file_name="equipamentos_fora_do_brasil.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 use_container_width=True,
                 key="btn_export_fora_brasil"
             )
@@ -605,13 +497,12 @@ def analisar_ultima_posicao(df_processado):
 
         df_para_exportar_raw = df_status[df_status['Status'] == 'Gerar Manutenção']
         if not df_para_exportar_raw.empty:
-            cols_export = ['Serial', 'Cliente', 'Placa', 'Chassi', 'ObjetoRastreavelStatus', 'Endereco', 'Cidade', 'Uf Proprietario', 'Modelo de HW', 'dias_sem_posicao', 'data_evento', 'Observação', 'tecnologia_posicao']
+            cols_export = ['Serial', 'Cliente', 'Placa', 'Chassi', 'ObjetoRastreavelStatus', 'Endereco', 'Cidade', 'Uf Proprietario', 'Modelo de HW', 'dias_sem_posicao', 'data_evento', 'Observação', 'Motivo Manutenção', 'tecnologia_posicao']
             cols_export_existentes = [c for c in cols_export if c in df_para_exportar_raw.columns]
             df_export = df_para_exportar_raw[cols_export_existentes].copy()
             df_export.rename(columns={'data_evento': 'Data da Última Posição'}, inplace=True)
             df_export['Serial'] = '="' + df_export['Serial'].astype(str) + '"'
-            excel_data = to_excel(df_export)
-            st.download_button(label="📥 Baixar Seriais para Manutenção (.xlsx)", data=excel_data, file_name="seriais_manutencao.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+            botao_download(label="📥 Baixar Seriais para Manutenção (.xlsx)", df=df_export, tipo='xlsx', opcoes={'sheet_name': 'Manutenção'}, file_name="seriais_manutencao.xlsx", use_container_width=True)
 
         st.markdown("---")
         st.subheader("Status da Frota por Tempo")
@@ -665,35 +556,33 @@ def analisar_ultima_posicao(df_processado):
     else:
         st.metric("Combinações encontradas", len(cps_cross_df))
         st.dataframe(cps_cross_df, use_container_width=True)
-        st.download_button(
+        botao_download(
             label="📥 Exportar cruzamento",
-            data=convert_df_to_csv(cps_cross_df),
+            df=cps_cross_df,
             file_name="cruzamento_odometros_posicao_cps.csv",
-            mime="text/csv",
             use_container_width=True
         )
 
     st.markdown("---")
     st.subheader("Mapa de Posições (Equipamentos posicionando há menos de 15 dias)")
-    df_mapa = df_filtrado[df_filtrado['dias_sem_posicao'] < 15].copy()
-    df_mapa.dropna(subset=['lat', 'long'], inplace=True)
-    if not df_mapa.empty:
-        df_mapa = df_mapa[((df_mapa['lat'] != 0) | (df_mapa['long'] != 0)) & (df_mapa['lat'].between(-90, 90)) & (df_mapa['long'].between(-180, 180))]
+    colunas_mapa = [c for c in ['Serial', 'lat', 'long', 'tecnologia_posicao'] if c in df_filtrado.columns]
+    coluna_status_mapa = 'tecnologia_posicao' if 'tecnologia_posicao' in colunas_mapa else None
+    coluna_rotulo_mapa = 'Serial' if 'Serial' in colunas_mapa else None
+    df_mapa = df_filtrado.loc[df_filtrado['dias_sem_posicao'] < 15, colunas_mapa]
+    df_mapa = df_mapa[coordenadas_validas(df_mapa, 'lat', 'long')]
     if not df_mapa.empty:
         st.info(f"Exibindo {len(df_mapa)} equipamentos com última posição registrada há menos de 15 dias.")
-        st.map(df_mapa, latitude='lat', longitude='long')
+        exibir_mapa(df_mapa, key="mapa_posicoes_recentes", lon_col='long', coluna_status=coluna_status_mapa, coluna_rotulo=coluna_rotulo_mapa)
     else:
         st.warning("Nenhum equipamento posicionando há menos de 15 dias com coordenadas válidas para exibir no mapa.")
 
     st.markdown("---")
     st.subheader("Mapa de Última Posição (Equipamentos sem posição há mais de 15 dias)")
-    df_mapa_antigos = df_filtrado[(df_filtrado['dias_sem_posicao'] >= 15) | (df_filtrado['dias_sem_posicao'].isnull())].copy()
-    df_mapa_antigos.dropna(subset=['lat', 'long'], inplace=True)
-    if not df_mapa_antigos.empty:
-        df_mapa_antigos = df_mapa_antigos[((df_mapa_antigos['lat'] != 0) | (df_mapa_antigos['long'] != 0)) & (df_mapa_antigos['lat'].between(-90, 90)) & (df_mapa_antigos['long'].between(-180, 180))]
+    df_mapa_antigos = df_filtrado.loc[(df_filtrado['dias_sem_posicao'] >= 15) | (df_filtrado['dias_sem_posicao'].isnull()), colunas_mapa]
+    df_mapa_antigos = df_mapa_antigos[coordenadas_validas(df_mapa_antigos, 'lat', 'long')]
     if not df_mapa_antigos.empty:
         st.info(f"Exibindo {len(df_mapa_antigos)} equipamentos com última posição registrada há 15 dias ou mais.")
-        st.map(df_mapa_antigos, latitude='lat', longitude='long')
+        exibir_mapa(df_mapa_antigos, key="mapa_posicoes_antigas", lon_col='long', coluna_status=coluna_status_mapa, coluna_rotulo=coluna_rotulo_mapa)
     else:
         st.info("Nenhum equipamento sem posição há mais de 15 dias com coordenadas válidas encontrado.")
 
@@ -845,17 +734,17 @@ def analisar_ultima_posicao(df_processado):
         col1, col2, col3 = st.columns(3)
         with col1:
             if not df_com_posicao.empty:
-                st.download_button(label="📥 Baixar COM Posição", data=to_excel(df_com_posicao, highlight_col='Multiplos Equipamentos'), file_name="equipamentos_com_posicao.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+                botao_download(label="📥 Baixar COM Posição", df=df_com_posicao, tipo='xlsx', opcoes={'sheet_name': 'Manutenção', 'linha_destaque': ('Multiplos Equipamentos', 'Sim')}, file_name="equipamentos_com_posicao.xlsx", use_container_width=True)
             else:
                 st.info("Nenhum equipamento com posição para exportar.")
         with col2:
             if not df_sem_posicao.empty:
                 df_sem_posicao_export = df_sem_posicao.drop(columns=['Data da Posição', 'Tecnologia'], errors='ignore')
-                st.download_button(label="📥 Baixar SEM Posição", data=to_excel(df_sem_posicao_export, highlight_col='Multiplos Equipamentos'), file_name="equipamentos_sem_posicao.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+                botao_download(label="📥 Baixar SEM Posição", df=df_sem_posicao_export, tipo='xlsx', opcoes={'sheet_name': 'Manutenção', 'linha_destaque': ('Multiplos Equipamentos', 'Sim')}, file_name="equipamentos_sem_posicao.xlsx", use_container_width=True)
             else:
                 st.info("Nenhum equipamento sem posição para exportar.")
         with col3:
             if not df_full_export.empty:
-                st.download_button(label="📥 Baixar TODOS Equipamentos", data=to_excel(df_full_export, highlight_col='Multiplos Equipamentos'), file_name="equipamentos_todos.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+                botao_download(label="📥 Baixar TODOS Equipamentos", df=df_full_export, tipo='xlsx', opcoes={'sheet_name': 'Manutenção', 'linha_destaque': ('Multiplos Equipamentos', 'Sim')}, file_name="equipamentos_todos.xlsx", use_container_width=True)
             else:
                 st.info("Nenhum equipamento para exportar.")
@@ -0,0 +1,111 @@
+# modules/posicao_processada.py
+"""
+Relatório de Última Posição processado, calculado uma vez por conteúdo.
+
+A extração (processar_relatorio.extrair_dados_posicao) é guardada pelo hash do
+conteúdo do arquivo somado às colunas e à forma do DataFrame lido (o mesmo
+arquivo lido com outra linha de cabeçalho gera outra chave): em memória (LRU)
+e em disco, em Parquet (colunar e comprimido), de modo que a aba Posição, o
+resumo do upload e o script temp_summary.py reaproveitam o mesmo resultado.
+Colunas de tipos mistos, que o Parquet não aceita, viram texto. Só
+'dias_sem_posicao', que depende da data de hoje, é recalculado a cada consulta.
+"""
+import glob
+import hashlib
+import os
+
+import pandas as pd
+
+from modules.cache import CacheLRU
+from modules.processar_relatorio import extrair_dados_posicao, calcular_dias_sem_posicao
+
+CAMINHO_PADRAO = os.path.join("cache", "posicao")
+# Incrementar quando a extração mudar, invalidando os arquivos já gravados
+VERSAO_PROCESSAMENTO = 2
+MAX_ARQUIVOS_DISCO = 8
+
+_cache_memoria = CacheLRU(max_itens=4, ttl_segundos=None)
+
+
+def hash_conteudo_bytes(conteudo):
+    """Hash dos bytes do arquivo enviado (mesma chave usada pelo upload e pelo script)."""
+    return hashlib.md5(conteudo).hexdigest()
+
+
+def hash_posicao_bruta(df_bruto):
+    """Hash do DataFrame bruto, para quando os bytes do arquivo não estão disponíveis."""
+    h = hashlib.md5(repr(list(df_bruto.columns)).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df_bruto.astype(str), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _assinatura_leitura(df_bruto):
+    """Colunas e forma do DataFrame bruto, que dependem das opções de leitura do arquivo."""
+    return hashlib.md5(repr((list(df_bruto.columns), df_bruto.shape)).encode('utf-8')).hexdigest()[:12]
+
+
+def _caminho_arquivo(diretorio, chave):
+    return os.path.join(diretorio, f"v{VERSAO_PROCESSAMENTO}_{chave}.parquet")
+
+
+def _texto_em_colunas_mistas(df):
+    """Colunas object com tipos mistos (comuns em planilhas) viram texto, mantendo os ausentes."""
+    mistas = [c for c in df.columns[df.dtypes == object]
+              if pd.api.types.infer_dtype(df[c], skipna=True).startswith('mixed')]
+    if not mistas:
+        return df
+    df = df.copy()
+    for coluna in mistas:
+        df[coluna] = df[coluna].where(df[coluna].isna(), df[coluna].astype(str))
+    return df
+
+
+def _ler_disco(diretorio, chave):
+    caminho = _caminho_arquivo(diretorio, chave)
+    if not os.path.exists(caminho):
+        return None
+    try:
+        return pd.read_parquet(caminho)
+    except (ImportError, OSError, ValueError):
+        return None
+
+
+def _gravar_disco(df, diretorio, chave):
+    """Grava o resultado em Parquet (sem disco gravável ou sem pyarrow, fica só em memória)."""
+    try:
+        os.makedirs(diretorio, exist_ok=True)
+        df.to_parquet(_caminho_arquivo(diretorio, chave), index=True)
+    except (ImportError, OSError, TypeError, ValueError):
+        return
+    # Mantém apenas os arquivos mais recentes (e descarta os de versões anteriores)
+    arquivos = sorted(glob.glob(os.path.join(diretorio, "v*_*.*")), key=os.path.getmtime, reverse=True)
+    for antigo in arquivos[MAX_ARQUIVOS_DISCO:] + [a for a in arquivos if not a.endswith('.parquet')]:
+        if os.path.exists(antigo):
+            os.remove(antigo)
+
+
+def obter_posicao_processada(df_bruto, hash_conteudo=None, diretorio=CAMINHO_PADRAO):
+    """
+    Equivalente a processar_dataframe_posicao(df_bruto), reaproveitando a
+    extração já feita para o mesmo conteúdo. Devolve uma cópia (pode ser alterada).
+    """
+    if df_bruto is None:
+        return None
+    if hash_conteudo:
+        chave = f"{hash_conteudo}_{_assinatura_leitura(df_bruto)}"
+    else:
+        chave = hash_posicao_bruta(df_bruto)
+    df = _cache_memoria.get(chave)
+    if df is None:
+        df = _ler_disco(diretorio, chave) if diretorio else None
+        if df is None:
+            df = _texto_em_colunas_mistas(extrair_dados_posicao(df_bruto))
+            if diretorio:
+                _gravar_disco(df, diretorio, chave)
+        _cache_memoria.set(chave, df)
+    return calcular_dias_sem_posicao(df.copy())
+
+
+def limpar_cache_posicao():
+    """Esvazia o cache em memória (os arquivos em disco são identificados pelo conteúdo e continuam válidos)."""
+    _cache_memoria.limpar()
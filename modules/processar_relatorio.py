@@ -9,32 +9,24 @@ def extrair_odometros(texto):
     """
     if not isinstance(texto, str):
         return None, None
+    match_normal = PADRAO_ODOMETRO.search(texto)
+    match_can = PADRAO_ODOMETRO_CAN.search(texto)
+    return (float(match_normal.group('odometro')) if match_normal else None,
+            float(match_can.group('odometro_can')) if match_can else None)
 
-    texto_limpo = texto.replace('\n', ' ').replace('\r', ' ')
-    
-    odometro_normal = None
-    odometro_can = None
-
-    # Padrão para "Odometro CAN", agora mais flexível (H opcional, espaço ou underscore, : opcional)
-    padrao_can = r"(H?odometro[\s_]*CAN)\s*:?\s*(-?\d+\.?\d*)"
-    match_can = re.search(padrao_can, texto_limpo, re.IGNORECASE)
-    if match_can:
-        odometro_can = float(match_can.group(2))
-
-    # Padrão para "Odometro" normal.
-    padrao_normal = r"(H?odometro)\s*:?\s*(-?\d+\.?\d*)"
-    matches_normal = re.finditer(padrao_normal, texto_limpo, re.IGNORECASE)
-    for match in matches_normal:
-        start_substring = match.start(1) + len(match.group(1))
-        end_substring = match.start(2)
-        # The substring is what's between "H?odometro" and the number
-        substring = texto_limpo[start_substring:end_substring]
-        
-        if "can" not in substring.lower():
-            odometro_normal = float(match.group(2))
-            break 
-            
-    return odometro_normal, odometro_can
+
+def extrair_odometros_series(serie):
+    """
+    Versão vetorizada de extrair_odometros: DataFrame com as colunas float
+    'odometro' e 'odometro_can', alinhado ao índice de `serie` (NaN quando
+    ausente ou quando a célula não é texto).
+    """
+    try:
+        odometros = pd.concat([serie.str.extract(PADRAO_ODOMETRO), serie.str.extract(PADRAO_ODOMETRO_CAN)], axis=1)
+    except AttributeError:
+        # Coluna sem nenhum texto (vazia ou numérica)
+        return pd.DataFrame(float('nan'), index=serie.index, columns=CAMPOS_ODOMETRO)
+    return odometros.astype(float)
 
 def extrair_valor(texto, campo):
     """Usa Regex para encontrar um valor em um bloco de texto."""
@@ -64,6 +56,54 @@ def extrair_valor(texto, campo):
     
     return None
 
+# Padrão combinado: cada lookahead opcional, ancorado no início do texto, captura
+# a primeira ocorrência do seu campo (mesmo resultado de um re.search por campo).
+_NUMERO = r"-?\d+\.?\d*"
+# Odômetro normal e CAN; "Odometro CAN: N" não casa com o normal (depois de "odometro" vem "CAN", não o número)
+_ODOMETRO = rf"odometro\s*:?\s*(?P<odometro>{_NUMERO})"
+_ODOMETRO_CAN = rf"odometro[\s_]*CAN\s*:?\s*(?P<odometro_can>{_NUMERO})"
+PADRAO_CAMPOS_POSICAO = re.compile(
+    r"^"
+    rf"(?:(?=.*?latitude\s*:\s*(?P<latitude>{_NUMERO})))?"
+    rf"(?:(?=.*?longitude\s*:\s*(?P<longitude>{_NUMERO})))?"
+    rf"(?:(?=.*?velocidade\s*:\s*(?P<velocidade>{_NUMERO})))?"
+    rf"(?:(?=.*?tensao\s*:\s*(?P<tensao>{_NUMERO})))?"
+    r'(?:(?=.*?municipio\s*:\s*""(?P<municipio>[^""]+)""))?'
+    rf"(?:(?=.*?{_ODOMETRO}))?"
+    rf"(?:(?=.*?{_ODOMETRO_CAN}))?",
+    re.IGNORECASE | re.DOTALL
+)
+# Sozinhos, os odômetros são mais rápidos com duas buscas simples do que com os lookaheads
+PADRAO_ODOMETRO = re.compile(_ODOMETRO, re.IGNORECASE)
+PADRAO_ODOMETRO_CAN = re.compile(_ODOMETRO_CAN, re.IGNORECASE)
+CAMPOS_POSICAO = ['latitude', 'longitude', 'velocidade', 'tensao', 'municipio', 'odometro', 'odometro_can']
+CAMPOS_ODOMETRO = ['odometro', 'odometro_can']
+
+
+def _decodificar_municipio(texto):
+    return unquote(texto.replace('\n', ' ').replace('\r', ' ')).replace('+', ' ')
+
+
+def extrair_campos_posicao(serie):
+    """
+    Versão vetorizada de extrair_valor/extrair_odometros: extrai de uma vez
+    todos os CAMPOS_POSICAO de uma coluna de texto (Dados GSM ou Dados P2P).
+    Valores ausentes (ou células que não são texto) ficam como NaN.
+    """
+    try:
+        campos = serie.str.extract(PADRAO_CAMPOS_POSICAO)
+    except AttributeError:
+        # Coluna sem nenhum texto (vazia ou numérica)
+        return pd.DataFrame(float('nan'), index=serie.index, columns=CAMPOS_POSICAO)
+    for campo in CAMPOS_POSICAO:
+        if campo != 'municipio':
+            campos[campo] = pd.to_numeric(campos[campo])
+    # Decodifica cada município distinto uma só vez
+    municipios = campos['municipio'].dropna()
+    campos['municipio'] = municipios.map({m: _decodificar_municipio(m) for m in municipios.unique()}).reindex(campos.index)
+    return campos
+
+
 def processar_dataframe_posicao(df_bruto):
     """
     Recebe um DataFrame bruto de última posição e retorna um DataFrame processado
@@ -71,47 +111,24 @@ def processar_dataframe_posicao(df_bruto):
     """
     if df_bruto is None:
         return None
+    return calcular_dias_sem_posicao(extrair_dados_posicao(df_bruto))
+
 
+def extrair_dados_posicao(df_bruto):
+    """
+    Parte de processar_dataframe_posicao que depende só do conteúdo do arquivo
+    (tudo menos 'dias_sem_posicao', que muda a cada dia).
+    """
     df = df_bruto.copy()
 
     if 'Dados GSM' not in df.columns: df['Dados GSM'] = None
     if 'Dados P2P' not in df.columns: df['Dados P2P'] = None
 
-    campos_para_extrair = ['latitude', 'longitude', 'velocidade', 'tensao', 'municipio']
-    
-    for campo in campos_para_extrair:
-        # Tenta extrair do GSM primeiro
-        if 'Dados GSM' in df.columns:
-            df[campo] = df['Dados GSM'].apply(lambda texto: extrair_valor(texto, campo))
-        
-        # Onde não encontrou, tenta no P2P
-        if 'Dados P2P' in df.columns:
-            coluna_p2p = df['Dados P2P'].apply(lambda texto: extrair_valor(texto, campo))
-            df[campo] = df.get(campo, pd.Series(index=df.index)).fillna(coluna_p2p)
-
-    # --- EXTRAÇÃO DO ODÔMETRO (Normal e CAN) ---
-    def assign_odometers(row):
-        # Prioriza GSM
-        gsm_text = row.get('Dados GSM', None)
-        normal_gsm, can_gsm = extrair_odometros(gsm_text) if isinstance(gsm_text, str) else (None, None)
-
-        # Fallback para P2P
-        p2p_text = row.get('Dados P2P', None)
-        normal_p2p, can_p2p = extrair_odometros(p2p_text) if isinstance(p2p_text, str) else (None, None)
-        
-        # Consolida os resultados: usa o valor do GSM se existir, senão usa o do P2P.
-        final_normal = normal_gsm if normal_gsm is not None else normal_p2p
-        final_can = can_gsm if can_gsm is not None else can_p2p
-        
-        return (final_normal, final_can)
-
-    # Aplica a função para obter os dois valores de odômetro
-    odometer_data = df.apply(assign_odometers, axis=1, result_type='expand')
-    odometer_data.columns = ['odometro', 'odometro_can']
-
-    # Atribui as novas colunas ao DataFrame principal
-    df['odometro'] = odometer_data['odometro']
-    df['odometro_can'] = odometer_data['odometro_can']
+    # Uma única passada de regex por coluna de origem; o que faltar no GSM vem do P2P
+    campos = extrair_campos_posicao(df['Dados GSM'])
+    campos_p2p = extrair_campos_posicao(df['Dados P2P'])
+    for campo in CAMPOS_POSICAO:
+        df[campo] = campos[campo].fillna(campos_p2p[campo])
 
     df.rename(columns={
         'latitude': 'lat', 'longitude': 'long',
@@ -145,6 +162,11 @@ def processar_dataframe_posicao(df_bruto):
         df.loc[fill_mask, 'data_evento'] = data_p2p[fill_mask]
         df.loc[fill_mask, 'tecnologia_posicao'] = 'P2P'
 
+    return df
+
+
+def calcular_dias_sem_posicao(df):
+    """Adiciona 'dias_sem_posicao' (dias de hoje até 'data_evento') ao DataFrame."""
     # Calcula a diferença em dias de hoje até a data do evento
     if 'data_evento' in df.columns:
         df['dias_sem_posicao'] = (pd.Timestamp.now() - df['data_evento']).dt.days
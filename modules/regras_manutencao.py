@@ -0,0 +1,174 @@
+# modules/regras_manutencao.py
+"""
+Motor de regras de manutenção da aba Posição.
+
+As regras ficam em regras_manutencao.yaml (raiz do projeto): um equipamento
+recebe "Gerar Manutenção" quando atende a QUALQUER regra, e as condições de
+uma mesma regra são combinadas com E. Condições aceitas:
+
+    dias_sem_posicao_min: N          dias sem posição >= N
+    sem_posicao: true                nunca posicionou (dias sem posição vazio)
+    modelos: [..] | nome_do_grupo    modelo está na lista (ou no grupo declarado em `grupos`)
+    modelo_contem: [..]              modelo contém algum dos textos (sem diferenciar maiúsculas)
+    excecao_modelos: [..] | grupo    modelo NÃO está na lista
+    excecao_modelo_contem: [..]      modelo NÃO contém nenhum dos textos
+    tecnologias: [..]                tecnologia da posição está na lista
+    tecnologia_diferente_de: [..]    tecnologia informada e fora da lista
+
+As condições de modelo/tecnologia são avaliadas uma vez por valor distinto
+(pd.factorize) e expandidas para as linhas, de modo que a avaliação de todas
+as regras é uma única passada vetorizada mesmo com milhões de equipamentos.
+"""
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import yaml
+from yaml.loader import SafeLoader
+
+CAMINHO_PADRAO = "regras_manutencao.yaml"
+
+COL_DIAS = 'dias_sem_posicao'
+COL_MODELO = 'Modelo de HW'
+COL_TECNOLOGIA = 'tecnologia_posicao'
+
+# Usadas quando o arquivo de regras não existe (mesmo conteúdo do regras_manutencao.yaml)
+CONFIG_PADRAO = {
+    'grupos': {
+        'modelos_gsm': [
+            'MT2000', 'RI0352 - FROTAS 4G', 'MXT-130', 'GS10G', 'MXT-130-P5', 'ST350LC', 'ST380',
+            'RT345BT', 'RI0350 - FROTAS 2G', 'MXT-162', 'E3 Plus', 'ST300H', 'ST340LC', 'SA200',
+            'FMB130', 'GV300CAN',
+        ],
+    },
+    'regras': [
+        {'nome': 'Sem posição há 15 dias ou mais', 'dias_sem_posicao_min': 15},
+        {'nome': 'Nunca posicionou', 'sem_posicao': True},
+        {'nome': 'Modelo GSM posicionando por outra tecnologia', 'modelos': 'modelos_gsm',
+         'tecnologia_diferente_de': ['GSM'], 'excecao_modelo_contem': ['Iotracking', 'Contingencia']},
+    ],
+}
+
+
+class Regra:
+    """
+    Uma regra compilada: nome e condições (coluna, função, valor_ausente). A
+    função recebe os dias (array) ou os valores distintos da coluna;
+    valor_ausente é o resultado para modelo/tecnologia vazios.
+    """
+
+    def __init__(self, nome, condicoes):
+        self.nome = nome
+        self.condicoes = condicoes
+
+
+class MotorRegras:
+    """Regras de manutenção compiladas, avaliadas de uma vez sobre o DataFrame de posições."""
+
+    def __init__(self, config):
+        self.grupos = {nome: list(valores) for nome, valores in (config.get('grupos') or {}).items()}
+        regras = config.get('regras') or []
+        if not regras:
+            raise ValueError("Nenhuma regra de manutenção declarada.")
+        self.regras = [self._compilar(i, regra) for i, regra in enumerate(regras, start=1)]
+
+    @classmethod
+    def from_yaml(cls, caminho=CAMINHO_PADRAO):
+        """Carrega as regras do arquivo YAML (ou as regras padrão, se o arquivo não existir)."""
+        if not os.path.exists(caminho):
+            return cls(CONFIG_PADRAO)
+        with open(caminho, encoding='utf-8') as f:
+            return cls(yaml.load(f, Loader=SafeLoader) or {})
+
+    def grupo(self, nome):
+        return self.grupos.get(nome, [])
+
+    def _lista(self, valor, regra):
+        """Lista literal ou nome de um grupo declarado."""
+        if isinstance(valor, str):
+            if valor not in self.grupos:
+                raise ValueError(f"Regra '{regra}': grupo '{valor}' não declarado em 'grupos'.")
+            return self.grupos[valor]
+        return [str(v) for v in valor]
+
+    def _compilar(self, posicao, regra):
+        nome = str(regra.get('nome') or f"Regra {posicao}")
+        condicoes = []
+        for chave, valor in regra.items():
+            if chave == 'nome':
+                continue
+            if chave == 'dias_sem_posicao_min':
+                limite = float(valor)
+                condicoes.append((COL_DIAS, lambda dias, limite=limite: dias >= limite, None))
+            elif chave == 'sem_posicao':
+                esperado = bool(valor)
+                condicoes.append((COL_DIAS, lambda dias, esperado=esperado: np.isnan(dias) == esperado, None))
+            elif chave in ('modelos', 'excecao_modelos'):
+                conjunto = set(self._lista(valor, nome))
+                negar = chave.startswith('excecao')
+                condicoes.append((COL_MODELO, lambda unicos, conjunto=conjunto, negar=negar:
+                                  np.array([v in conjunto for v in unicos], dtype=bool) ^ negar, negar))
+            elif chave in ('modelo_contem', 'excecao_modelo_contem'):
+                padrao = re.compile('|'.join(re.escape(t) for t in self._lista(valor, nome)), re.IGNORECASE)
+                negar = chave.startswith('excecao')
+                condicoes.append((COL_MODELO, lambda unicos, padrao=padrao, negar=negar:
+                                  np.array([bool(padrao.search(str(v))) for v in unicos], dtype=bool) ^ negar, negar))
+            elif chave in ('tecnologias', 'tecnologia_diferente_de'):
+                conjunto = set(self._lista(valor, nome))
+                negar = chave == 'tecnologia_diferente_de'
+                # Tecnologia vazia não conta como "diferente de"
+                condicoes.append((COL_TECNOLOGIA, lambda unicos, conjunto=conjunto, negar=negar:
+                                  np.array([v in conjunto for v in unicos], dtype=bool) ^ negar, False))
+            else:
+                raise ValueError(f"Regra '{nome}': condição desconhecida '{chave}'.")
+        if not condicoes:
+            raise ValueError(f"Regra '{nome}' não tem condições.")
+        return Regra(nome, condicoes)
+
+    def avaliar(self, df):
+        """
+        Avalia todas as regras. Retorna (acertos, motivos):
+        acertos é uma matriz booleana (linhas x regras) e motivos uma Series com
+        os nomes das regras atendidas por linha ('' quando nenhuma).
+        """
+        n = len(df)
+        dias = pd.to_numeric(df[COL_DIAS], errors='coerce').to_numpy(dtype=np.float64) if COL_DIAS in df.columns else np.full(n, np.nan)
+        # Colunas categóricas: cada condição roda sobre os valores distintos
+        codigos = {}
+        for coluna in (COL_MODELO, COL_TECNOLOGIA):
+            if coluna in df.columns:
+                codigos[coluna] = pd.factorize(df[coluna])
+            else:
+                codigos[coluna] = (np.full(n, -1, dtype=np.int64), pd.Index([]))
+
+        # Ordem 'F': cada coluna (regra) fica contígua em memória
+        acertos = np.ones((n, len(self.regras)), dtype=bool, order='F')
+        for j, regra in enumerate(self.regras):
+            for coluna, condicao, valor_ausente in regra.condicoes:
+                if coluna == COL_DIAS:
+                    with np.errstate(invalid='ignore'):
+                        acertos[:, j] &= condicao(dias)
+                else:
+                    cod, unicos = codigos[coluna]
+                    # O último elemento atende o código -1 (valor ausente) do factorize
+                    por_valor = np.append(condicao(np.asarray(unicos, dtype=object)), valor_ausente)
+                    acertos[:, j] &= por_valor[cod]
+        return acertos, self._motivos(acertos, df.index)
+
+    def _motivos(self, acertos, indice):
+        # Cada combinação de regras vira um inteiro (bits); os textos são montados só por combinação distinta
+        pesos = (1 << np.arange(len(self.regras), dtype=np.int64))
+        combinacoes = acertos.astype(np.int64) @ pesos
+        distintas = np.unique(combinacoes)
+        textos = {c: '; '.join(r.nome for i, r in enumerate(self.regras) if c >> i & 1) for c in distintas}
+        return pd.Series(combinacoes, index=indice).map(textos)
+
+    def contagem(self, acertos):
+        """Por regra: equipamentos sinalizados e quantos foram sinalizados só por ela."""
+        exclusivos = acertos & (acertos.sum(axis=1) == 1)[:, None]
+        return pd.DataFrame({
+            'Regra': [r.nome for r in self.regras],
+            'Equipamentos': acertos.sum(axis=0),
+            'Somente por esta regra': exclusivos.sum(axis=0),
+        })
@@ -1,6 +1,6 @@
 import pandas as pd
 
-from modules.processar_relatorio import processar_dataframe_posicao
+from modules.posicao_processada import obter_posicao_processada
 from modules.utils import safe_to_numeric
 
 
@@ -47,11 +47,11 @@ def _sum_money_columns(df):
     return resultados
 
 
-def gerar_resumo_ultima_posicao(df_bruto, nome_arquivo=None):
+def gerar_resumo_ultima_posicao(df_bruto, nome_arquivo=None, hash_conteudo=None):
     if df_bruto is None or df_bruto.empty:
         return "Resumo Geral — Última Posição\nNenhum dado válido encontrado no relatório."
 
-    df_processado = processar_dataframe_posicao(df_bruto)
+    df_processado = obter_posicao_processada(df_bruto, hash_conteudo)
     if df_processado is None or df_processado.empty:
         return "Resumo Geral — Última Posição\nNenhum dado válido encontrado após o processamento."
 
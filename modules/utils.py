@@ -15,6 +15,18 @@ def convert_df_to_csv(df):
     return df.to_csv(index=False, sep=';', decimal=',').encode('utf-8-sig')
     # --- FIM DA CORREÇÃO ---
 
+def convert_df_to_csv_em_blocos(df, linhas_por_bloco=50000):
+    """
+    Mesmo formato de convert_df_to_csv (sep=';', decimal=',', utf-8-sig), mas
+    escrito bloco a bloco num buffer binário, sem montar a string inteira em memória.
+    """
+    output = io.BytesIO()
+    output.write('\ufeff'.encode('utf-8'))
+    for inicio in range(0, max(len(df), 1), linhas_por_bloco):
+        bloco = df.iloc[inicio:inicio + linhas_por_bloco]
+        output.write(bloco.to_csv(index=False, sep=';', decimal=',', header=(inicio == 0)).encode('utf-8'))
+    return output.getvalue()
+
 @st.cache_data
 def convert_df_to_excel(df):
     """
@@ -1,8 +1,8 @@
 
-import pandas as pd
 import glob
 import os
-from modules.processar_relatorio import processar_dataframe_posicao
+from modules.data_loader import carregar_dataframe_bytes
+from modules.posicao_processada import obter_posicao_processada, hash_conteudo_bytes
 
 try:
     # 1. Find the latest position report file
@@ -13,12 +13,15 @@ try:
         latest_file = max(list_of_files, key=os.path.getctime)
         print(f"Analisando o arquivo: {latest_file}...")
 
-        # 2. Load the file
-        df_bruto = pd.read_excel(latest_file)
+        # 2. Load the file (same loader and header options as the app upload)
+        with open(latest_file, 'rb') as f:
+            conteudo = f.read()
+        df_bruto = carregar_dataframe_bytes(conteudo, latest_file, forcar_cabecalho_relatorio=True)
         total_equipamentos = len(df_bruto)
 
         # 3. Process the dataframe using the project's own logic
-        df_processado = processar_dataframe_posicao(df_bruto)
+        # (reuses the cached result in cache/posicao when the file was already processed)
+        df_processado = obter_posicao_processada(df_bruto, hash_conteudo_bytes(conteudo))
 
         # 4. Perform the analysis
         if 'dias_sem_posicao' in df_processado.columns: